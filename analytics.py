@@ -0,0 +1,804 @@
+"""
+Dataset-scoped analytics structures for the dashboard pages.
+
+Everything here is built once per loaded dataset and kept in a small
+process-wide LRU keyed by the dataset ID (the content hash the dashboard
+already tracks in st.session_state.current_file_hash), so Streamlit reruns
+reuse it instead of recomputing from the full frame. Chart figures get a
+larger LRU of their own (cached_figure), keyed by dataset, chart and the
+parameters the chart depends on, and so do small page lookups (dataset_memo).
+"""
+import functools
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from profiling import span
+from transforms import ComboKeyIndex
+
+
+DATASET_CACHE_SIZE = 32
+
+_dataset_cache = OrderedDict()
+_dataset_cache_lock = threading.Lock()
+
+
+def _lru_get_or_build(cache, lock, max_size, key, build):
+    with lock:
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+
+    value = build()
+
+    with lock:
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > max_size:
+            cache.popitem(last=False)
+    return value
+
+
+def dataset_cached(dataset_id, kind, build):
+    """
+    Returns the structure of the given kind for a dataset, building it with
+    build() on a miss. With no dataset_id (e.g. a filtered subset) the result
+    is built fresh and not cached. Builds are timed as span 'build:<kind>'.
+    """
+    def timed_build():
+        with span(f'build:{kind}'):
+            return build()
+
+    if dataset_id is None:
+        return timed_build()
+    return _lru_get_or_build(_dataset_cache, _dataset_cache_lock, DATASET_CACHE_SIZE,
+                             (dataset_id, kind), timed_build)
+
+
+# Results of dataset_memo functions kept across reruns
+MEMO_CACHE_SIZE = 512
+
+_memo_cache = OrderedDict()
+_memo_cache_lock = threading.Lock()
+
+
+def dataset_memo(kind):
+    """
+    Decorator for small per-dataset lookups, func(df, dataset_id, *params).
+    Results are kept in a bounded LRU keyed by (kind, dataset_id, *params),
+    so unlike st.cache_data a call never hashes the frame; params must be
+    hashable. With no dataset_id the function just runs. Results are shared
+    by every session, so callers must not modify them.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(df, dataset_id, *params):
+            if dataset_id is None:
+                return func(df, dataset_id, *params)
+            return _lru_get_or_build(_memo_cache, _memo_cache_lock, MEMO_CACHE_SIZE,
+                                     (kind, dataset_id) + params, lambda: func(df, dataset_id, *params))
+        return wrapper
+    return decorator
+
+
+# ============================================
+# FIGURE CACHE
+# ============================================
+
+FIGURE_CACHE_SIZE = 256
+
+_figure_cache = OrderedDict()
+_figure_cache_lock = threading.Lock()
+
+
+def cached_figure(dataset_id, kind, column, params, build):
+    """
+    Returns the Plotly figure for one chart of a dataset, building it with
+    build() on a miss. The key is (dataset_id, kind, column, params); params
+    is a hashable tuple of everything else the figure depends on (filter
+    values, the selected rank, a palette). With no dataset_id the figure is
+    built fresh, as in dataset_cached.
+
+    Figures are kept as built objects: st.plotly_chart serializes one in well
+    under a millisecond, while rebuilding a figure from its JSON revalidates
+    every property and costs a good part of a px call. The same object is
+    served to every session, so callers must not modify it.
+    """
+    if dataset_id is None:
+        return build()
+    return _lru_get_or_build(_figure_cache, _figure_cache_lock, FIGURE_CACHE_SIZE,
+                             (dataset_id, kind, column, params), build)
+
+
+# ============================================
+# FREE-TEXT SEARCH INDEX
+# ============================================
+
+GRAM_SIZE = 3
+
+
+GRAM_BLOCK = 65536
+_CODEPOINT_BITS = 21
+_CODEPOINT_MASK = (1 << _CODEPOINT_BITS) - 1
+
+
+def _gram_keys(values):
+    """
+    Packs every trigram of each string into one int64 (three 21-bit code
+    points). Strings shorter than a trigram are packed whole, zero padded.
+
+    Returns (keys, value_ids): one entry per gram occurrence.
+    """
+    keys, value_ids = [], []
+    for block_start in range(0, len(values), GRAM_BLOCK):
+        block = values[block_start:block_start + GRAM_BLOCK]
+        chars = np.asarray(block.tolist(), dtype=str)
+        width = max(chars.dtype.itemsize // 4, GRAM_SIZE)
+        points = np.zeros((len(block), width), dtype=np.int64)
+        points[:, :chars.dtype.itemsize // 4] = chars.view(np.uint32).reshape(len(block), -1)
+        lengths = np.array([len(v) for v in block])
+
+        packed = (points[:, :-2] << (2 * _CODEPOINT_BITS)) | (points[:, 1:-1] << _CODEPOINT_BITS) | points[:, 2:]
+        starts = np.arange(packed.shape[1])
+        valid = (starts[None, :] + GRAM_SIZE <= lengths[:, None]) | ((starts[None, :] == 0) & (lengths[:, None] < GRAM_SIZE))
+        rows, cols = np.nonzero(valid)
+        keys.append(packed[rows, cols])
+        value_ids.append(rows + block_start)
+
+    if not keys:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    return np.concatenate(keys), np.concatenate(value_ids)
+
+
+def _decode_gram_keys(keys):
+    """Inverse of _gram_keys for the gram dictionary: packed keys back to strings."""
+    points = np.stack([(keys >> (2 * _CODEPOINT_BITS)) & _CODEPOINT_MASK,
+                       (keys >> _CODEPOINT_BITS) & _CODEPOINT_MASK,
+                       keys & _CODEPOINT_MASK], axis=1).astype(np.uint32)
+    return np.ascontiguousarray(points).view(f'U{GRAM_SIZE}').ravel().astype(object)
+
+
+class SearchIndex:
+    """
+    Two-level inverted index over the string form of every cell.
+
+    - value level: each distinct lowercase cell string -> the rows holding it
+    - gram level: each trigram (or the whole string, for values shorter than
+      three characters) -> the distinct values containing it
+
+    A search term is matched case-insensitively as a substring of a single
+    cell, like df.astype(str)...str.contains(term, case=False) did. Terms of
+    three or more characters intersect the posting lists of their trigrams
+    and verify the few candidates; shorter terms scan the gram dictionary.
+    Several whitespace-separated terms are ANDed.
+    """
+
+    def __init__(self, df):
+        self.n_rows = len(df)
+
+        # Per column: factorize, then stringify only the uniques. Object columns
+        # are stringified first so None and NaN keep their distinct spellings.
+        labels = []
+        cell_ids = []
+        offset = 0
+        for col_idx in range(df.shape[1]):
+            column = df.iloc[:, col_idx]
+            if column.dtype == object:
+                column = column.astype(str)
+            codes, uniques = pd.factorize(column, use_na_sentinel=False)
+            labels.append(pd.Index(uniques).astype(str).str.lower())
+            cell_ids.append(codes + offset)
+            offset += len(uniques)
+
+        if offset == 0:
+            self.vocab = np.array([], dtype=object)
+            self.value_ptr = np.zeros(1, dtype=np.int64)
+            self.value_rows = np.array([], dtype=np.int32)
+            self.gram_keys = np.array([], dtype=np.int64)
+            self.gram_ptr = np.zeros(1, dtype=np.int64)
+            self.gram_values = np.array([], dtype=np.int32)
+            self.gram_strings = np.array([], dtype=object)
+            return
+
+        # One vocabulary across columns
+        label_to_value, vocab = pd.factorize(np.concatenate([np.asarray(l, dtype=object) for l in labels]))
+        self.vocab = np.asarray(vocab, dtype=object)
+
+        # value -> rows posting lists (CSR)
+        value_of_cell = label_to_value[np.concatenate(cell_ids)]
+        row_of_cell = np.tile(np.arange(self.n_rows, dtype=np.int32), df.shape[1])
+        order = np.argsort(value_of_cell, kind='stable')
+        self.value_rows = row_of_cell[order]
+        self.value_ptr = np.concatenate([[0], np.cumsum(np.bincount(value_of_cell, minlength=len(self.vocab)))])
+
+        # gram -> values posting lists (CSR)
+        gram_keys, gram_value_ids = _gram_keys(self.vocab)
+        self.gram_keys, gram_codes = np.unique(gram_keys, return_inverse=True)
+        pairs = np.unique(gram_codes.astype(np.int64) * len(self.vocab) + gram_value_ids)
+        pair_grams = pairs // len(self.vocab)
+        self.gram_values = (pairs % len(self.vocab)).astype(np.int32)
+        self.gram_ptr = np.concatenate([[0], np.cumsum(np.bincount(pair_grams, minlength=len(self.gram_keys)))])
+        self.gram_strings = _decode_gram_keys(self.gram_keys)
+
+    def _gram_postings(self, gram_id):
+        return self.gram_values[self.gram_ptr[gram_id]:self.gram_ptr[gram_id + 1]]
+
+    def _matching_values(self, term):
+        """Vocabulary ids of the distinct cell strings containing term."""
+        if len(term) < GRAM_SIZE:
+            gram_ids = np.flatnonzero(pd.Series(self.gram_strings).str.contains(term, regex=False).to_numpy())
+            if len(gram_ids) == 0:
+                return np.array([], dtype=np.int32)
+            return np.unique(np.concatenate([self._gram_postings(gid) for gid in gram_ids]))
+
+        term_keys, _ = _gram_keys(np.array([term], dtype=object))
+        candidates = None
+        for key in term_keys:
+            gram_id = np.searchsorted(self.gram_keys, key)
+            if gram_id == len(self.gram_keys) or self.gram_keys[gram_id] != key:
+                return np.array([], dtype=np.int32)
+            postings = self._gram_postings(gram_id)
+            candidates = postings if candidates is None else np.intersect1d(candidates, postings, assume_unique=True)
+            if len(candidates) == 0:
+                return candidates
+
+        if len(term) == GRAM_SIZE:
+            return candidates
+        return np.array([v for v in candidates if term in self.vocab[v]], dtype=np.int32)
+
+    def _rows_for_values(self, value_ids):
+        """Boolean row mask from the concatenated posting lists of value_ids."""
+        mask = np.zeros(self.n_rows, dtype=bool)
+        if len(value_ids) == 0:
+            return mask
+        starts = self.value_ptr[value_ids]
+        lengths = self.value_ptr[value_ids + 1] - starts
+        total = int(lengths.sum())
+        if total:
+            offsets = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+            mask[self.value_rows[offsets + np.arange(total)]] = True
+        return mask
+
+    def search(self, query):
+        """Boolean mask over the indexed rows matching every term of the query."""
+        terms = query.lower().split()
+        mask = np.ones(self.n_rows, dtype=bool)
+        for term in terms:
+            mask &= self._rows_for_values(self._matching_values(term))
+            if not mask.any():
+                break
+        return mask
+
+
+def get_search_index(df, dataset_id):
+    return dataset_cached(dataset_id, 'search_index', lambda: SearchIndex(df))
+
+
+# ============================================
+# BITMAP FILTER INDEX
+# ============================================
+
+# Columns with more distinct values than this are filtered with a plain mask
+MAX_BITMAP_VALUES = 1000
+
+METRIC_COLUMNS = ['Rank', 'Combo Size', 'Visitors', 'Purchasers', 'Conversion %', 'Min Visitors']
+
+
+class BitmapIndex:
+    """
+    Packed bitmaps (np.packbits, one bit per row) for every value of the
+    low-cardinality attribute columns, plus the numeric metric columns as
+    arrays. A column's bitmaps are built the first time a filter uses it;
+    metric columns are never filtered on and get none.
+
+    select() resolves segment filters by ORing the bitmaps of the chosen
+    values within a column and ANDing across columns, and returns row
+    positions; sum()/mean() aggregate metrics at those positions, so no
+    filtered copy of the frame is needed.
+    """
+
+    def __init__(self, df, max_values=MAX_BITMAP_VALUES):
+        self.n_rows = len(df)
+        self.max_values = max_values
+        self.columns = {}
+        self.metrics = {}
+        self._df = df
+
+    def _empty(self):
+        return np.zeros((self.n_rows + 7) // 8, dtype=np.uint8)
+
+    def _bitmaps(self, column):
+        """Value -> bitmap for column, or None if it has too many values (or is a metric)."""
+        if column not in self.columns:
+            bitmaps = None
+            values = self._df[column]
+            if column not in METRIC_COLUMNS and not isinstance(values, pd.DataFrame):
+                codes, uniques = pd.factorize(values)
+                if len(uniques) <= self.max_values:
+                    bitmaps = {value: np.packbits(codes == code) for code, value in enumerate(uniques)}
+            self.columns[column] = bitmaps
+        return self.columns[column]
+
+    def _column_bits(self, column, values):
+        """OR of the bitmaps of values in column (values outside the column match nothing)."""
+        bitmaps = self._bitmaps(column)
+        if bitmaps is not None:
+            bits = self._empty()
+            for value in values:
+                value_bits = bitmaps.get(value)
+                if value_bits is not None:
+                    bits |= value_bits
+            return bits
+
+        # High-cardinality or metric column: one vectorized mask
+        return np.packbits(self._df[column].isin(values).to_numpy())
+
+    def select(self, filters):
+        """
+        Row positions matching every active filter; filters map a column to a
+        list of accepted values (or a single value).
+        """
+        bits = None
+        for column, values in filters.items():
+            if not values or column not in self._df.columns:
+                continue
+            if not isinstance(values, list):
+                values = [values]
+            column_bits = self._column_bits(column, values)
+            bits = column_bits if bits is None else bits & column_bits
+
+        if bits is None:
+            return np.arange(self.n_rows)
+        return np.flatnonzero(np.unpackbits(bits, count=self.n_rows))
+
+    def _metric(self, column):
+        if column not in self.metrics:
+            self.metrics[column] = pd.to_numeric(self._df[column], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+        return self.metrics[column]
+
+    def sum(self, column, positions=None):
+        values = self._metric(column)
+        return np.nansum(values if positions is None else values[positions])
+
+    def mean(self, column, positions=None):
+        values = self._metric(column)
+        values = values if positions is None else values[positions]
+        if len(values) == 0 or np.isnan(values).all():
+            return np.nan
+        return np.nanmean(values)
+
+
+def get_bitmap_index(df, dataset_id):
+    return dataset_cached(dataset_id, 'bitmap_index', lambda: BitmapIndex(df))
+
+
+# ============================================
+# DEMOGRAPHIC ROLLUP CUBE
+# ============================================
+
+def _rollup_frame(keys, combos, visitors, purchasers):
+    """Rollup table from per-group sums, with conversion derived from the sums."""
+    rollup = keys.copy()
+    # Whole-number sums (the usual case for counts) stay integers like groupby().sum()
+    if np.array_equal(visitors, np.floor(visitors)):
+        visitors = visitors.astype(np.int64)
+    if np.array_equal(purchasers, np.floor(purchasers)):
+        purchasers = purchasers.astype(np.int64)
+    rollup['Combos'] = combos
+    rollup['Visitors'] = visitors
+    rollup['Purchasers'] = purchasers
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rollup['Conversion %'] = np.where(visitors > 0, purchasers / visitors * 100, np.nan)
+    return rollup[rollup['Combos'] > 0].reset_index(drop=True)
+
+
+class RollupCube:
+    """
+    Per-attribute and per-attribute-pair sums of Visitors and Purchasers (plus
+    the number of combos and the derived conversion), built once per dataset
+    with np.bincount over factorized attribute codes.
+
+    Every non-metric column is an attribute; missing values are left out, like
+    groupby() and value_counts() do. Pairs are summed over a dense value grid
+    when it is no larger than the frame, and otherwise over only the value
+    combinations that occur, so high-cardinality attributes (a zip code
+    against a state) are rolled up too.
+    """
+
+    def __init__(self, df):
+        self.n_rows = len(df)
+        self.attributes = {}
+        self.pairs = {}
+
+        visitors = self._metric(df, 'Visitors')
+        purchasers = self._metric(df, 'Purchasers')
+        self.total_visitors = visitors.sum()
+        self.total_purchasers = purchasers.sum()
+
+        codes = {}
+        for col in df.columns:
+            column = df[col]
+            if col in METRIC_COLUMNS or isinstance(column, pd.DataFrame):
+                continue
+            col_codes, uniques = pd.factorize(column)
+            codes[col] = (col_codes, uniques)
+
+            present = col_codes >= 0
+            k = len(uniques)
+            self.attributes[col] = _rollup_frame(
+                pd.DataFrame({col: uniques}),
+                np.bincount(col_codes[present], minlength=k),
+                np.bincount(col_codes[present], weights=visitors[present], minlength=k),
+                np.bincount(col_codes[present], weights=purchasers[present], minlength=k))
+
+        columns = list(codes)
+        for i, col_a in enumerate(columns):
+            codes_a, uniques_a = codes[col_a]
+            for col_b in columns[i + 1:]:
+                codes_b, uniques_b = codes[col_b]
+                n_b = len(uniques_b)
+                cells = len(uniques_a) * n_b
+                if cells == 0:
+                    continue
+                present = (codes_a >= 0) & (codes_b >= 0)
+                cell = codes_a[present].astype(np.int64) * n_b + codes_b[present]
+                if cells <= len(cell):
+                    grid = np.arange(cells)
+                else:
+                    grid, cell = np.unique(cell, return_inverse=True)
+                self.pairs[(col_a, col_b)] = _rollup_frame(
+                    pd.DataFrame({col_a: uniques_a.take(grid // n_b), col_b: uniques_b.take(grid % n_b)}),
+                    np.bincount(cell, minlength=len(grid)),
+                    np.bincount(cell, weights=visitors[present], minlength=len(grid)),
+                    np.bincount(cell, weights=purchasers[present], minlength=len(grid)))
+
+    @staticmethod
+    def _metric(df, column):
+        if column not in df.columns:
+            return np.zeros(len(df))
+        values = pd.to_numeric(df[column], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+        return np.nan_to_num(values, nan=0.0)
+
+    def attribute(self, column):
+        """Rollup of one attribute: value, Combos, Visitors, Purchasers, Conversion %."""
+        return self.attributes[column]
+
+    def pair(self, col_a, col_b):
+        """Rollup of two attributes (either order), or None when either is not an attribute."""
+        if (col_a, col_b) in self.pairs:
+            return self.pairs[(col_a, col_b)]
+        rollup = self.pairs.get((col_b, col_a))
+        return None if rollup is None else rollup[[col_a, col_b] + list(rollup.columns[2:])]
+
+    def top(self, column, by='Purchasers', n=10):
+        """
+        The n values of an attribute with the largest total of `by`, as a frame
+        with the attribute column and `by` (groupby(column)[by].sum().nlargest(n)).
+        """
+        rollup = self.attributes[column]
+        return rollup.nlargest(n, by)[[column, by]].reset_index(drop=True)
+
+    def value_counts(self, column, n=10):
+        """Number of combos per value, largest first (value_counts().head(n))."""
+        rollup = self.attributes[column].nlargest(n, 'Combos')
+        return pd.Series(rollup['Combos'].to_numpy(), index=pd.Index(rollup[column], name=column), name='count')
+
+
+def get_rollup_cube(df, dataset_id):
+    return dataset_cached(dataset_id, 'rollup_cube', lambda: RollupCube(df))
+
+
+# ============================================
+# ATTRIBUTE AFFINITY
+# ============================================
+
+class AffinityMatrix:
+    """
+    Lift between every two attribute values (e.g. AGE=25-34 with
+    INCOME=100K+), assembled from a RollupCube: its attribute sums are the
+    diagonal of the one-hot co-occurrence product X^T W X and its pair sums
+    the off-diagonal blocks, so nothing is recounted from the rows.
+
+    `values` has one row per attribute value (Attribute, Value, Combos,
+    Visitors, Purchasers, Conversion %). `pairs` has one row per pair of
+    values from different attributes that occur together, with the
+    positions of both values in `values` (a, b, a < b), the pair's sums, and
+    these columns:
+
+    - Lift: purchaser-weighted co-occurrence over independence,
+      P(a,b) * P / (P(a) * P(b)), > 1 when the two go together among buyers
+    - Conversion Lift: the pair's conversion over the overall conversion
+    """
+
+    def __init__(self, cube):
+        value_frames = []
+        for column, rollup in cube.attributes.items():
+            value_frames.append(pd.DataFrame({
+                'Attribute': column,
+                'Value': rollup[column].astype(str).to_numpy(),
+                'Combos': rollup['Combos'].to_numpy(),
+                'Visitors': rollup['Visitors'].to_numpy(),
+                'Purchasers': rollup['Purchasers'].to_numpy()}))
+        self.values = (pd.concat(value_frames, ignore_index=True) if value_frames else
+                       pd.DataFrame(columns=['Attribute', 'Value', 'Combos', 'Visitors', 'Purchasers']))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.values['Conversion %'] = np.where(self.values['Visitors'] > 0,
+                                                   self.values['Purchasers'] / self.values['Visitors'] * 100, np.nan)
+
+        # Position of each attribute's first value in self.values
+        offsets = {}
+        start = 0
+        for column, rollup in cube.attributes.items():
+            offsets[column] = start
+            start += len(rollup)
+
+        a_ids, b_ids, combos, visitors, purchasers = [], [], [], [], []
+        for (col_a, col_b), rollup in cube.pairs.items():
+            index_a = pd.Index(cube.attributes[col_a][col_a])
+            index_b = pd.Index(cube.attributes[col_b][col_b])
+            a_ids.append(index_a.get_indexer(rollup[col_a]) + offsets[col_a])
+            b_ids.append(index_b.get_indexer(rollup[col_b]) + offsets[col_b])
+            combos.append(rollup['Combos'].to_numpy())
+            visitors.append(rollup['Visitors'].to_numpy())
+            purchasers.append(rollup['Purchasers'].to_numpy())
+
+        if a_ids:
+            a, b = np.concatenate(a_ids), np.concatenate(b_ids)
+            pair_visitors, pair_purchasers = np.concatenate(visitors), np.concatenate(purchasers)
+            pair_combos = np.concatenate(combos)
+        else:
+            a = b = pair_combos = np.array([], dtype=np.int64)
+            pair_visitors = pair_purchasers = np.array([], dtype=float)
+
+        total_visitors = float(cube.total_visitors)
+        total_purchasers = float(cube.total_purchasers)
+        value_purchasers = self.values['Purchasers'].to_numpy(dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            lift = pair_purchasers * total_purchasers / (value_purchasers[a] * value_purchasers[b])
+            conversion = np.where(pair_visitors > 0, pair_purchasers / pair_visitors * 100, np.nan)
+            overall = total_purchasers / total_visitors * 100 if total_visitors > 0 else np.nan
+            conversion_lift = conversion / overall
+
+        self.pairs = pd.DataFrame({
+            'a': np.minimum(a, b), 'b': np.maximum(a, b),
+            'Combos': pair_combos, 'Visitors': pair_visitors, 'Purchasers': pair_purchasers,
+            'Conversion %': conversion,
+            'Lift': np.where(np.isfinite(lift), lift, np.nan),
+            'Conversion Lift': np.where(np.isfinite(conversion_lift), conversion_lift, np.nan)})
+
+    def _label(self, ids):
+        return (self.values['Attribute'].to_numpy()[ids] + ': ' + self.values['Value'].to_numpy()[ids]).astype(object)
+
+    def best_pairs(self, by='Lift', min_purchasers=1, n=50):
+        """The n pairs with the highest `by` among those with at least min_purchasers."""
+        pairs = self.pairs[self.pairs['Purchasers'] >= min_purchasers].nlargest(n, by)
+        a, b = pairs['a'].to_numpy(), pairs['b'].to_numpy()
+        best = pd.DataFrame({
+            'Attribute A': self.values['Attribute'].to_numpy()[a], 'Value A': self.values['Value'].to_numpy()[a],
+            'Attribute B': self.values['Attribute'].to_numpy()[b], 'Value B': self.values['Value'].to_numpy()[b]})
+        for column in ['Combos', 'Visitors', 'Purchasers', 'Conversion %', 'Lift', 'Conversion Lift']:
+            best[column] = pairs[column].to_numpy()
+        return best
+
+    def matrix(self, metric='Lift', top=30, min_purchasers=1):
+        """
+        Dense square matrix of `metric` over the `top` values with the most
+        purchasers, as a frame with 'Attribute: Value' labels. Cells of two
+        values of the same attribute, and pairs below min_purchasers, are NaN.
+        """
+        ids = np.argsort(-self.values['Purchasers'].to_numpy(dtype=float), kind='stable')[:top]
+        position = np.full(len(self.values), -1)
+        position[ids] = np.arange(len(ids))
+
+        pairs = self.pairs[self.pairs['Purchasers'] >= min_purchasers]
+        pa, pb = position[pairs['a'].to_numpy()], position[pairs['b'].to_numpy()]
+        shown = (pa >= 0) & (pb >= 0)
+        grid = np.full((len(ids), len(ids)), np.nan)
+        grid[pa[shown], pb[shown]] = pairs[metric].to_numpy()[shown]
+        grid[pb[shown], pa[shown]] = pairs[metric].to_numpy()[shown]
+
+        labels = self._label(ids)
+        return pd.DataFrame(grid, index=labels, columns=labels)
+
+
+def get_affinity_matrix(df, dataset_id):
+    return dataset_cached(dataset_id, 'affinity_matrix', lambda: AffinityMatrix(get_rollup_cube(df, dataset_id)))
+
+
+# ============================================
+# SORT ORDERS
+# ============================================
+
+# Columns the paginated tables can sort by
+SORT_COLUMNS = ['Conversion %', 'Purchasers', 'Rank']
+
+
+def sort_order(df, column, ascending=True):
+    """
+    Row positions of df sorted by a numeric column, stable (ties keep
+    their row order) and with missing values last in either direction.
+    """
+    values = df[column].to_numpy(dtype=float, na_value=np.nan)
+    return np.argsort(values if ascending else -values, kind='stable')
+
+
+def get_sort_order(df, dataset_id, column, ascending=True):
+    return dataset_cached(dataset_id, f'sort:{column}:{"asc" if ascending else "desc"}',
+                          lambda: sort_order(df, column, ascending))
+
+
+class TopK:
+    """
+    Rows in descending order of one column with running sums of Visitors
+    and Purchasers, so top-k rows, their totals and concentration curves
+    are slices and lookups instead of nlargest() calls. Rows where the
+    column is missing come last and are never part of a top k (as with
+    nlargest), but they count towards the totals.
+    """
+
+    def __init__(self, df, column, order):
+        self.order = order
+        self.n_valid = len(order) - int(df[column].isna().to_numpy()[order].sum())
+        self.cum_visitors = np.cumsum(RollupCube._metric(df, 'Visitors')[order])
+        self.cum_purchasers = np.cumsum(RollupCube._metric(df, 'Purchasers')[order])
+        self.total_visitors = self.cum_visitors[-1] if len(order) else 0.0
+        self.total_purchasers = self.cum_purchasers[-1] if len(order) else 0.0
+
+    def __len__(self):
+        return self.n_valid
+
+    def top(self, k):
+        """Positions (in df) of the top k rows, best first (nlargest(k).index, as positions)."""
+        return self.order[:min(k, self.n_valid)]
+
+    def purchasers(self, k):
+        """Purchasers of the top k rows; k may be an int or an array of ints."""
+        k = np.minimum(np.asarray(k, dtype=np.int64), self.n_valid)
+        if not len(self.order):
+            return np.zeros(k.shape)
+        return np.where(k > 0, self.cum_purchasers[np.maximum(k, 1) - 1], 0.0)
+
+    def share(self, k):
+        """Percent of all purchasers held by the top k rows (int or array of ints)."""
+        if not self.total_purchasers:
+            return np.zeros(np.shape(k))
+        return self.purchasers(k) / self.total_purchasers * 100
+
+    def concentration(self):
+        """share() at every k from 1 to len(self)."""
+        return self.share(np.arange(1, self.n_valid + 1))
+
+
+def get_top_k(df, dataset_id, column, mask=None):
+    """
+    TopK of df by column, cached per dataset. With a boolean mask (e.g. the
+    Home filters) it covers the masked rows only: the cached order is
+    filtered rather than re-sorted, and the result is not cached.
+    """
+    if mask is None:
+        return dataset_cached(dataset_id, f'top_k:{column}',
+                              lambda: TopK(df, column, get_sort_order(df, dataset_id, column, ascending=False)))
+    order = get_sort_order(df, dataset_id, column, ascending=False)
+    return TopK(df, column, order[mask[order]])
+
+
+# ============================================
+# RANK INDEX
+# ============================================
+
+class RankIndex:
+    """
+    Rows ordered by Rank, for the Deep Dive: a combo and its neighbouring
+    ranks are a binary search and a slice away instead of a scan of the
+    frame. Also keeps each metric sorted, so "better than x% of combos"
+    is a binary search too.
+    """
+
+    PERCENTILE_COLUMNS = ['Visitors', 'Purchasers', 'Conversion %']
+
+    def __init__(self, df):
+        self.n_rows = len(df)
+        ranks = df['Rank'].to_numpy(dtype=float, na_value=np.nan)
+        # Stable, so among equal ranks the first row comes first, like df[df['Rank'] == r].iloc[0]
+        self.order = np.argsort(ranks, kind='stable')
+        self.ranks = ranks[self.order]
+        self.sorted_metrics = {}
+        for column in self.PERCENTILE_COLUMNS:
+            if column in df.columns:
+                values = df[column].to_numpy(dtype=float, na_value=np.nan)
+                self.sorted_metrics[column] = np.sort(values[~np.isnan(values)])
+
+    def position(self, rank):
+        """Position (in df) of the first row with this Rank, or None."""
+        i = np.searchsorted(self.ranks, rank, side='left')
+        if i < len(self.ranks) and self.ranks[i] == rank:
+            return int(self.order[i])
+        return None
+
+    def window(self, min_rank, max_rank):
+        """Positions (in df) of the rows with min_rank <= Rank <= max_rank, in Rank order."""
+        start = np.searchsorted(self.ranks, min_rank, side='left')
+        end = np.searchsorted(self.ranks, max_rank, side='right')
+        return self.order[start:end]
+
+    def percentile(self, column, value):
+        """Percent of all rows whose column is below value ((df[column] < value).mean() * 100)."""
+        if not self.n_rows or pd.isna(value):
+            return 0.0
+        return np.searchsorted(self.sorted_metrics[column], value, side='left') / self.n_rows * 100
+
+
+def get_rank_index(df, dataset_id):
+    return dataset_cached(dataset_id, 'rank_index', lambda: RankIndex(df))
+
+
+# ============================================
+# COMBO KEY INDEX
+# ============================================
+
+def get_combo_key_index(df, dataset_id, derived=None):
+    """
+    The dataset's ComboKeyIndex (attribute key -> row) for append_combo_frame().
+    Pass derived, the index append_combo_frame() returned, when df is a freshly
+    appended table, so its index is stored instead of rebuilt.
+    """
+    if derived is not None:
+        return dataset_cached(dataset_id, 'combo_key_index', lambda: derived)
+    return dataset_cached(dataset_id, 'combo_key_index', lambda: ComboKeyIndex.build(df))
+
+
+# ============================================
+# SCATTER DOWNSAMPLING
+# ============================================
+
+# Scatter plots of more combos than this are drawn from a sample
+SCATTER_POINT_BUDGET = 20_000
+# Best-ranked combos always drawn, whatever the sample
+SCATTER_KEEP_TOP = 1_000
+# Cells per axis of the (log) grid the sample is stratified over
+SCATTER_GRID = 64
+
+
+def _grid_cells(values, grid):
+    values = np.log1p(np.maximum(np.nan_to_num(values), 0))
+    low, high = values.min(), values.max()
+    scale = grid / (high - low) if high > low else 0.0
+    return np.minimum(((values - low) * scale).astype(np.int64), grid - 1)
+
+
+def scatter_sample(df, x='Visitors', y='Purchasers', budget=SCATTER_POINT_BUDGET,
+                   keep_top=SCATTER_KEEP_TOP, grid=SCATTER_GRID, seed=0):
+    """
+    Positions of the rows to draw in an x/y scatter of df: all of them up to
+    budget, else about budget rows. The keep_top best-ranked rows are always
+    kept; the rest are sampled per cell of a grid x grid log-scaled grid, in
+    proportion to the cell's rows, plus each cell's highest y, so sparse
+    regions (the outliers) stay visible while the dense mass thins out.
+    The sample is deterministic for a given seed.
+    """
+    n = len(df)
+    if n <= budget:
+        return np.arange(n)
+
+    keep_top = min(keep_top, budget)
+    ranks = np.nan_to_num(df['Rank'].to_numpy(dtype=float), nan=np.inf)
+    top = np.argpartition(ranks, keep_top - 1)[:keep_top] if keep_top else np.array([], dtype=np.int64)
+    rest_mask = np.ones(n, dtype=bool)
+    rest_mask[top] = False
+    rest = np.flatnonzero(rest_mask)
+
+    y_values = df[y].to_numpy(dtype=float)[rest]
+    cells = _grid_cells(df[x].to_numpy(dtype=float)[rest], grid) * grid + _grid_cells(y_values, grid)
+    order = np.lexsort((np.random.default_rng(seed).random(len(rest)), cells))
+    sorted_cells = cells[order]
+    starts = np.flatnonzero(np.r_[True, sorted_cells[1:] != sorted_cells[:-1]])
+    counts = np.diff(np.r_[starts, len(order)])
+    quotas = np.maximum(1, (counts * ((budget - keep_top) / len(rest))).astype(np.int64))
+    rank_in_cell = np.arange(len(order)) - np.repeat(starts, counts)
+    sampled = order[rank_in_cell < np.repeat(quotas, counts)]
+    # Plus the highest y of every cell (same cell order, so the same starts)
+    cell_peaks = np.lexsort((-np.nan_to_num(y_values), cells))[starts]
+
+    return np.union1d(top, rest[np.union1d(sampled, cell_peaks)])
@@ -12,8 +12,18 @@ import hashlib
 import sqlite3
 import secrets
 import io
-import json
-import re
+
+from analytics import (SCATTER_KEEP_TOP, SCATTER_POINT_BUDGET, SORT_COLUMNS, cached_figure, dataset_memo,
+                       get_affinity_matrix, get_bitmap_index, get_combo_key_index, get_rank_index, get_rollup_cube,
+                       get_search_index, get_sort_order, get_top_k, scatter_sample)
+from database import (create_history_indexes, create_tables, fetch_audit_page, fetch_uploads_page,
+                      get_audit_writer, get_db_connection)
+from events import CollectingSink, Code, use_sink
+from ingest import PARSER_VERSION
+from profiling import ROLLING_WINDOW, RerunProfile, export_json, reset_spans, span, span_snapshot, timed
+from storage import get_cached_parse, load_upload_frame, migrate_upload_history_once, put_cached_parse, save_upload_frame
+from transforms import (APPEND_FORMATS, append_combo_frame, combo_attribute_columns, merge_combo_frames,
+                        parse_files_parallel, smart_load_csv)
 
 
 # Custom CSS Styling
@@ -316,61 +326,24 @@ st.set_page_config(
 # Load custom CSS
 load_custom_css()
 
-# Database setup with improved connection handling
-def get_db_connection():
-    """Get a new database connection with timeout"""
-    conn = sqlite3.connect('buyers_dashboard.db', check_same_thread=False, timeout=10.0)
-    conn.execute('PRAGMA journal_mode=WAL')
-    return conn
-
 def init_db():
     conn = get_db_connection()
-    c = conn.cursor()
-    
-    # Users table
-    c.execute('''CREATE TABLE IF NOT EXISTS users
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  email TEXT UNIQUE NOT NULL,
-                  password TEXT NOT NULL,
-                  role TEXT DEFAULT 'Viewer',
-                  created_at TEXT,
-                  last_login TEXT)''')
-    
-    # Magic links table
-    c.execute('''CREATE TABLE IF NOT EXISTS magic_links
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  email TEXT NOT NULL,
-                  token TEXT UNIQUE NOT NULL,
-                  created_at TEXT,
-                  expires_at TEXT,
-                  used INTEGER DEFAULT 0)''')
-    
-    # Audit log table
-    c.execute('''CREATE TABLE IF NOT EXISTS audit_log
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  user_email TEXT,
-                  action TEXT,
-                  timestamp TEXT,
-                  details TEXT)''')
-    
-    # Upload history table
-    c.execute('''CREATE TABLE IF NOT EXISTS upload_history
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  user_email TEXT,
-                  filename TEXT,
-                  upload_date TEXT,
-                  row_count INTEGER,
-                  file_data TEXT)''')
-    
-    # Saved segments table
-    c.execute('''CREATE TABLE IF NOT EXISTS saved_segments
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  user_email TEXT,
-                  segment_name TEXT,
-                  filters TEXT,
-                  created_at TEXT)''')
-    
-    conn.commit()
+    
+    # Users, magic links, audit log, upload history, saved segments
+    create_tables(conn)
+    
+    # Move legacy JSON uploads into the columnar upload store (once per process)
+    try:
+        migrate_upload_history_once(conn)
+    except Exception as e:
+        print(f"Upload history migration error: {e}")
+    
+    # Indexes for paginated history/audit pages and filename search
+    try:
+        create_history_indexes(conn)
+    except Exception as e:
+        print(f"History index migration error: {e}")
+    
     conn.close()
     return True
 
@@ -474,21 +447,12 @@ def verify_magic_link(token):
         if conn:
             conn.close()
 
-# Audit logging with separate connection
+# Audit logging (queued; the background audit writer inserts events in batches)
 def log_audit(user_email, action, details=''):
-    conn = None
     try:
-        conn = get_db_connection()
-        c = conn.cursor()
-        timestamp = datetime.now().isoformat()
-        c.execute('INSERT INTO audit_log (user_email, action, timestamp, details) VALUES (?, ?, ?, ?)',
-                  (user_email, action, timestamp, details))
-        conn.commit()
+        get_audit_writer().submit(user_email, action, details)
     except Exception as e:
         print(f"Audit log error: {e}")
-    finally:
-        if conn:
-            conn.close()
 
 # Initialize database
 init_db()
@@ -522,6 +486,85 @@ def get_file_hash(file_content):
     """Generate hash of file content to check if it's the same file"""
     return hashlib.md5(file_content).hexdigest()
 
+# Helper function to get the cache key of a frame
+def current_dataset_id(df):
+    """Content hash of the loaded dataset if df is it, else None (derived frames are not cached)"""
+    if df is st.session_state.data:
+        return st.session_state.current_file_hash
+    return None
+
+# Helper for keyset-paginated tables (the page keys live in session state)
+def keyset_pager(state_key, reset_on=None):
+    """Returns the key of the page to show; page_controls() moves between pages"""
+    pager = st.session_state.get(state_key)
+    if pager is None or pager['reset_on'] != reset_on:
+        pager = {'keys': [None], 'reset_on': reset_on}
+        st.session_state[state_key] = pager
+    return pager['keys'][-1]
+
+def page_controls(state_key, next_key):
+    """Newer / Older buttons under a keyset-paginated table"""
+    keys = st.session_state[state_key]['keys']
+    prev_col, page_col, next_col = st.columns([1, 2, 1])
+    with prev_col:
+        st.button("◀ Newer", key=f"{state_key}_newer", disabled=len(keys) == 1, on_click=keys.pop)
+    with page_col:
+        st.caption(f"Page {len(keys)}")
+    with next_col:
+        st.button("Older ▶", key=f"{state_key}_older", disabled=next_key is None,
+                  on_click=keys.append, args=(next_key,))
+
+# Helper for large frames: sorted and paged on the server, one page sent to the browser
+TABLE_PAGE_SIZE = 100
+
+def sort_controls(state_key, df, default=None):
+    """Sort column and direction pickers for paged_table(); returns (sort_by, ascending)"""
+    options = [col for col in SORT_COLUMNS if col in df.columns]
+    if default is None:
+        options = ["Original order"] + options
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        sort_by = st.selectbox("📊 Sort by", options, key=f"{state_key}_sort",
+                               index=options.index(default) if default in options else 0)
+    with col2:
+        ascending = st.checkbox("⬆️ Ascending order", False, key=f"{state_key}_ascending")
+    return (None if sort_by == "Original order" else sort_by), ascending
+
+def paged_table(df, state_key, dataset_id=None, mask=None, sort_by=None, ascending=False,
+                reset_on=None, page_size=TABLE_PAGE_SIZE, height=400):
+    """
+    Shows one page of df's rows (those where mask is True, ordered by sort_by).
+    Sorting uses the dataset's cached argsort, so a page costs the same at any
+    size; the page number resets when the sort, the mask or reset_on change.
+    """
+    if sort_by is None:
+        positions = np.flatnonzero(mask) if mask is not None else None
+    else:
+        positions = get_sort_order(df, dataset_id, sort_by, ascending)
+        if mask is not None:
+            positions = positions[mask[positions]]
+    total = len(df) if positions is None else len(positions)
+    pages = max(1, -(-total // page_size))
+
+    page_key = f"{state_key}_page"
+    view = (sort_by, ascending, reset_on, total)
+    # The page widget's state is dropped on runs that don't render it, so it may be missing
+    if (st.session_state.get(f"{state_key}_view") != view or page_key not in st.session_state
+            or st.session_state[page_key] > pages):
+        st.session_state[f"{state_key}_view"] = view
+        st.session_state[page_key] = 1
+
+    start = (st.session_state[page_key] - 1) * page_size
+    end = min(start + page_size, total)
+    page_df = df.iloc[start:end] if positions is None else df.iloc[positions[start:end]]
+    st.dataframe(page_df, use_container_width=True, height=height)
+
+    info_col, page_col = st.columns([3, 1])
+    with info_col:
+        st.caption(f"Rows {start + 1 if total else 0:,}–{end:,} of {total:,}")
+    with page_col:
+        st.number_input(f"Page (of {pages:,})", min_value=1, max_value=pages, step=1, key=page_key)
+
 # Check for magic link token
 query_params = st.query_params
 if 'token' in query_params and not st.session_state.authenticated:
@@ -605,1253 +648,6 @@ def show_auth_page():
                 else:
                     st.warning("Please enter your email")
 # ============================================
-# ENHANCED CSV DETECTION AND detect_exc
-# ============================================
-
-def detect_csv_format(df, uploaded_file):
-    """
-    Detects which format the CSV is and returns format type
-    Supports multiple formats from your images
-    """
-    columns = [col.strip().upper() for col in df.columns]
-    columns_str = ' '.join(columns)
-    
-    # ========== NEW: Check for Excel-style multi-header format FIRST ==========
-    is_excel_style, header_row, metadata = detect_excel_style_headers(df)
-    if is_excel_style:
-        st.info(f"🔧 Detected Excel-style format with headers at row {header_row + 1}")
-        return 'excel_multi_header'
-     # ========== NEW: Check for multi-table attribute format ==========
-    is_multi_table, table_starts, metadata = detect_multi_table_attribute_format(df)
-    if is_multi_table:
-        st.info(f"🔧 Detected multi-table format with {len(table_starts)} attribute tables")
-        return 'multi_table_attributes'
-    
-    # Format 4: Original Combo Format (Rank, Combo Size, Visitors, Purchasers) - CHECK FIRST
-    combo_indicators = ['RANK', 'COMBO SIZE', 'VISITORS', 'PURCHASERS']
-    if all(ind in columns for ind in combo_indicators):
-        return 'combo'
-    
-    # Format 2: Gender Analysis Format (Attribute Visitors, Purchasers, Conversion Rate)
-    gender_indicators = ['ATTRIBUTE VISITORS', 'PURCHASERS', 'CONVERSION']
-    if any(ind in columns_str for ind in gender_indicators):
-        return 'gender_analysis'
-    
-    # Format 3: Purchase Email Format (Purchase, Email, Age_Range, Gender)
-    if 'PURCHASE' in columns and any(demo in columns_str for demo in ['AGE_RANGE', 'GENDER', 'INCOME']):
-        return 'purchase_email'
-    
-    # Format 5: UUID Format (with SKIPTRACE, COMPANY fields)
-    if 'UUID' in columns or 'SKIPTRACE' in columns_str or 'FIRST_NAME' in columns:
-        return 'uuid_enriched'
-    
-    # Format 1: Shopify Export Format (Order #, Billing Name, Lineitem, etc.)
-    shopify_indicators = ['ORDER', 'BILLING', 'LINEITEM', 'PAID', 'SHIPPING']
-    if sum(1 for ind in shopify_indicators if ind in columns_str) >= 2:
-        return 'shopify'
-    
-    # Check if it has demographic + numeric data (generic e-commerce/purchase data)
-    has_demographics = any(demo in columns_str for demo in ['AGE', 'GENDER', 'INCOME', 'STATE', 'MARRIED'])
-    has_order_data = any(order in columns_str for order in ['ORDER', 'PURCHASE', 'QUANTITY', 'TOTAL', 'PRICE'])
-    
-    if has_demographics and has_order_data:
-        return 'shopify'  # Treat as shopify-like format
-    
-    if has_demographics:
-        return 'purchase_email'  # Generic demographic data
-    
-    # ========== ADD THIS SECTION HERE (BEFORE 'unknown') ==========
-    # Format 6: Attribute Conversion Table (Value, Visitors, Purchasers, Conversion %)
-    attribute_conversion_indicators = ['VALUE', 'VISITORS', 'PURCHASERS', 'CONVERSION']
-    has_value_col = 'VALUE' in columns or 'ATTRIBUTE VALUE' in columns_str
-    has_metrics = all(ind in columns_str for ind in ['VISITORS', 'PURCHASERS'])
-    
-    # Check if there's a demographic attribute name before the table
-    if has_value_col and has_metrics:
-        return 'attribute_conversion'
-    
-    # Alternative: Check if columns match the exact pattern
-    if len(df.columns) >= 3 and len(df.columns) <= 5:
-        col_names = [c.upper() for c in df.columns if 'NAN' not in str(c).upper()]
-        if any('VALUE' in c for c in col_names) and 'VISITORS' in ' '.join(col_names) and 'PURCHASERS' in ' '.join(col_names):
-            return 'attribute_conversion'
-    # ========== END OF ADDITION ==========
-    
-    return 'unknown'
-
-def fix_duplicate_columns(df):
-    """
-    FIXES DUPLICATE COLUMN NAMES
-    This handles 'nan', 'Unnamed', and duplicate columns
-    """
-    # Step 1: Replace 'nan' strings with empty
-    df.columns = df.columns.astype(str)
-    
-    # Step 2: Remove actual 'nan' and 'Unnamed' columns
-    df = df.loc[:, ~df.columns.str.contains('nan|Unnamed', case=False, na=False)]
-    
-    # Step 3: Make column names unique by adding suffix to duplicates
-    cols = pd.Series(range(len(df.columns)))
-    for dup in df.columns[df.columns.duplicated(keep=False)]:
-        cols[df.columns == dup] = (df.columns == dup).cumsum()
-    df.columns = [f"{x}_{y}" if y != 0 else x for x, y in zip(df.columns, cols)]
-    
-    # Step 4: Drop completely empty columns
-    df = df.loc[:, (df.astype(str).applymap(lambda x: x.strip()) != '').any(axis=0)]
-    
-    return df
-def detect_excel_style_headers(df):
-    """
-    Detects if CSV has Excel-style multi-row headers with metadata rows above the actual headers
-    
-    Pattern to detect:
-    - Row 1: Descriptive text or merged cell content
-    - Row 2: May contain metadata like "Min Visitors: 400"
-    - Row 3: Empty or spacer
-    - Row 4+: Actual column headers
-    
-    Returns: (is_excel_style, header_row_index, metadata)
-    """
-    if len(df) < 4:
-        return False, None, {}
-    
-    metadata = {}
-    
-    # Check first 5 rows for patterns
-    for idx in range(min(5, len(df))):
-        row = df.iloc[idx]
-        row_str = ' '.join(row.astype(str).tolist()).upper()
-        
-        # Pattern 1: Check if row contains "RANK" + other combo-related columns
-        if 'RANK' in row_str and 'VISITORS' in row_str and 'PURCHASERS' in row_str:
-            # Found the actual header row!
-            if idx > 0:  # Headers are NOT in first row = Excel style
-                # Extract metadata from rows above
-                for meta_idx in range(idx):
-                    meta_row = df.iloc[meta_idx]
-                    meta_text = ' '.join(meta_row.astype(str).tolist())
-                    
-                    # Look for "Min Visitors" or similar metadata
-                    if 'MIN' in meta_text.upper() and 'VISITOR' in meta_text.upper():
-                        # Extract the number
-                        import re
-                        numbers = re.findall(r'\d+', meta_text)
-                        if numbers:
-                            metadata['min_visitors'] = int(numbers[0])
-                
-                return True, idx, metadata
-    
-    return False, None, {}
-def detect_multi_table_attribute_format(df):
-    """
-    Detects multi-table attribute conversion format where multiple demographic
-    tables are stacked vertically in one CSV.
-    
-    Pattern:
-    - Row 1: Main title (e.g., "Attribute Conversion Tables")
-    - Rows 2-X: Metadata rows
-    - Multiple tables, each with:
-      - Attribute name row (e.g., "SKIPTRACE_CREDIT_RATING")
-      - Header row ("Value | Visitors | Purchasers | Conversion %")
-      - Data rows
-    
-    Returns: (is_multi_table, table_starts, metadata)
-    """
-    if len(df) < 10:
-        return False, [], {}
-    
-    table_starts = []
-    metadata = {}
-    
-    # Look for attribute name patterns
-    attribute_keywords = [
-        'SKIPTRACE', 'DEPARTMENT', 'SENIORITY', 'AGE', 'INCOME',
-        'CREDIT', 'ETHNIC', 'GENDER', 'STATE', 'MARRIED'
-    ]
-    
-    for idx in range(len(df)):
-        row = df.iloc[idx]
-        row_str = ' '.join(row.astype(str).tolist()).upper()
-        
-        # Check if this row looks like an attribute name
-        if any(keyword in row_str for keyword in attribute_keywords):
-            # Check if next row has "Value, Visitors, Purchasers" headers
-            if idx + 1 < len(df):
-                next_row = df.iloc[idx + 1]
-                next_row_str = ' '.join(next_row.astype(str).tolist()).upper()
-                
-                if 'VALUE' in next_row_str and 'VISITORS' in next_row_str and 'PURCHASERS' in next_row_str:
-                    # Found a table!
-                    attribute_name = row.iloc[0] if pd.notna(row.iloc[0]) else f"ATTRIBUTE_{idx}"
-                    table_starts.append({
-                        'attribute_name': str(attribute_name).strip(),
-                        'header_row': idx + 1,
-                        'data_start': idx + 2
-                    })
-    
-    # Extract metadata from top rows if available
-    if len(table_starts) > 0:
-        first_table_start = table_starts[0]['header_row']
-        for meta_idx in range(min(first_table_start, 10)):
-            meta_row = df.iloc[meta_idx]
-            meta_text = ' '.join(meta_row.astype(str).tolist())
-            
-            # Look for "# unique p" or similar metadata
-            if 'UNIQUE' in meta_text.upper():
-                numbers = re.findall(r'\d+', meta_text)
-                if numbers:
-                    metadata['unique_purchasers'] = int(numbers[0])
-    
-    is_multi_table = len(table_starts) >= 2
-    
-    return is_multi_table, table_starts, metadata
-def transform_shopify_to_combo(df):
-    """
-    Transforms Shopify export format to combo format
-    """
-    st.info("🔄 Detected Shopify format - transforming to combo format...")
-    
-    # Clean column names
-    df.columns = df.columns.str.strip()
-    
-    # Show what columns we found
-    with st.expander("🔍 Columns found in your file"):
-        st.write(list(df.columns))
-    
-    # Group by demographic attributes and calculate metrics
-    demographic_cols = []
-    for col in df.columns:
-        col_upper = col.upper()
-        if any(keyword in col_upper for keyword in ['AGE_RANGE', 'AGE', 'GENDER', 'MARRIED', 'INCOME_RANGE', 
-                                                      'INCOME', 'NET_WORTH', 'HOMEOWNER', 'CHILDREN', 
-                                                      'STATE', 'PROVINCE', 'CREDIT', 'SKIPTRACE']):
-            demographic_cols.append(col)
-    
-    if not demographic_cols:
-        st.warning("⚠️ No demographic columns found. Searching for any groupable columns...")
-        # Find any non-order columns to group by
-        skip_cols = ['Order #', 'Order', 'Paid at', 'Subtotal', 'Total', 'Discount Code', 
-                     'Discount Amount', 'Shipping Method', 'Order Date', 'Lineitem quantity',
-                     'Lineitem name', 'Lineitem price', 'Quantity', 'Sale Price', 'SKU',
-                     'Billing Phone', 'Shipping Phone', 'Notes', 'Payment Method', 'Tags',
-                     'Phone', 'UUID', 'FIRST_NAME', 'LAST_NAME']
-        
-        for col in df.columns:
-            if col not in skip_cols and not any(skip in col for skip in skip_cols):
-                if df[col].nunique() < len(df) * 0.8:  # Column has some repeated values
-                    demographic_cols.append(col)
-                    if len(demographic_cols) >= 5:  # Limit to 5 columns
-                        break
-    
-    if not demographic_cols:
-        st.error("❌ Could not find any columns to group by. Using first column.")
-        demographic_cols = [df.columns[0]]
-    
-    st.info(f"📊 Grouping by: {', '.join(demographic_cols)}")
-    
-    # Count unique orders/purchases
-    df['_Purchasers'] = 1  # Each row is a purchase
-    
-    # Find a column to count as visitors (prefer Email, Order #, or any unique identifier)
-    visitor_col = None
-    for possible_col in ['Email', 'email', 'Order #', 'Order', df.columns[0]]:
-        if possible_col in df.columns:
-            visitor_col = possible_col
-            break
-    
-    if visitor_col is None:
-        visitor_col = df.columns[0]
-    
-    st.info(f"📈 Using '{visitor_col}' to count visitors")
-    
-    # Group by demographics
-    agg_dict = {'_Purchasers': 'sum'}
-    if visitor_col in df.columns:
-        agg_dict[visitor_col] = 'count'
-    
-    grouped = df.groupby(demographic_cols, dropna=False).agg(agg_dict).reset_index()
-    
-    grouped.rename(columns={'_Purchasers': 'Purchasers'}, inplace=True)
-    
-    if visitor_col in grouped.columns:
-        grouped.rename(columns={visitor_col: 'Visitors'}, inplace=True)
-    else:
-        grouped['Visitors'] = grouped['Purchasers'] * 20  # Estimate visitors
-    
-    # Calculate conversion
-    grouped['Conversion %'] = (grouped['Purchasers'] / grouped['Visitors'] * 100).round(2)
-    
-    # Add required columns
-    grouped['Rank'] = range(1, len(grouped) + 1)
-    grouped['Combo Size'] = len(demographic_cols)
-    grouped['Min Visitors'] = 40
-    
-    # Sort by conversion
-    grouped = grouped.sort_values('Conversion %', ascending=False).reset_index(drop=True)
-    grouped['Rank'] = range(1, len(grouped) + 1)
-    
-    st.success(f"✅ Transformed {len(df)} Shopify orders into {len(grouped)} combo segments!")
-    
-    return grouped
-
-def transform_gender_analysis_to_combo(df):
-    """
-    Transforms Gender/Income analysis format to combo format
-    FIXED: Handles summary rows and duplicate columns properly
-    """
-    st.info("🔄 Detected analysis format - transforming to combo format...")
-    
-    df.columns = df.columns.str.strip()
-    
-    # ========== STEP 1: REMOVE DUPLICATE/NAN COLUMNS ==========
-    # Remove columns named 'nan' or 'Unnamed'
-    df = df.loc[:, ~df.columns.astype(str).str.contains('nan|unnamed', case=False, regex=False)]
-    
-    # Show what columns we found
-    with st.expander("🔍 Analysis format columns found"):
-        st.write(list(df.columns))
-        st.dataframe(df.head(3), use_container_width=True)
-    
-    # ========== STEP 2: IDENTIFY THE GROUPING COLUMN ==========
-    group_col = None
-    skip_columns = ['Attribute Visitors', 'Purchasers', 'Conversion Rate', 'Conversion Visitors', 
-                    'Conversion', 'Conversion [Female]', 'Purchasers [Female]', 'Visitors', 
-                    'Attribute Visitors (Female)', 'Conversion Visitors (Female)', 
-                    'Conversion Visitors [Female]']
-    
-    for col in df.columns:
-        if col not in skip_columns and not any(skip in col for skip in ['Visitors', 'Purchasers', 'Conversion']):
-            group_col = col
-            break
-    
-    if group_col is None:
-        group_col = df.columns[0]
-    
-    st.info(f"📊 Using '{group_col}' as the grouping column")
-    
-    # ========== STEP 3: REMOVE SUMMARY/TOTAL ROWS EARLY ==========
-    # Remove rows with summary values BEFORE processing
-    summary_keywords = ['total', 'sum', 'average', 'conversion (total)', 'grand total', 
-                       'subtotal', 'all', 'overall']
-    
-    if group_col in df.columns:
-        mask = df[group_col].astype(str).str.lower().str.contains('|'.join(summary_keywords), na=False)
-        rows_before = len(df)
-        df = df[~mask]
-        rows_removed = rows_before - len(df)
-        if rows_removed > 0:
-            st.info(f"🗑️ Removed {rows_removed} summary/total rows")
-    
-    # ========== STEP 4: STANDARDIZE COLUMN NAMES ==========
-    column_mapping = {}
-    for col in df.columns:
-        col_upper = col.upper()
-        if 'ATTRIBUTE VISITORS' in col_upper and 'Visitors' not in column_mapping:
-            column_mapping[col] = 'Visitors'
-        elif col_upper == 'PURCHASERS' or (col_upper.startswith('PURCHASERS') and 'Purchasers' not in column_mapping):
-            column_mapping[col] = 'Purchasers'
-        elif 'CONVERSION RATE' in col_upper or col_upper == 'CONVERSION':
-            column_mapping[col] = 'Conversion %'
-    
-    df = df.rename(columns=column_mapping)
-    
-    st.info(f"🔄 Renamed columns to: {list(df.columns)}")
-    
-    # ========== STEP 5: ENSURE VISITORS COLUMN ==========
-    if 'Visitors' not in df.columns:
-        visitor_col = None
-        for col in df.columns:
-            if 'visitor' in col.lower() or 'visits' in col.lower():
-                visitor_col = col
-                break
-        
-        if visitor_col:
-            df.rename(columns={visitor_col: 'Visitors'}, inplace=True)
-            st.info(f"✅ Using '{visitor_col}' as Visitors column")
-        else:
-            st.warning("⚠️ No Visitors column found - will estimate from Purchasers")
-    
-    # ========== STEP 6: ENSURE PURCHASERS COLUMN ==========
-    if 'Purchasers' not in df.columns:
-        purchaser_col = None
-        for col in df.columns:
-            if 'purchaser' in col.lower() and col != group_col:
-                purchaser_col = col
-                break
-        
-        if purchaser_col:
-            df.rename(columns={purchaser_col: 'Purchasers'}, inplace=True)
-            st.info(f"✅ Using '{purchaser_col}' as Purchasers column")
-        else:
-            st.error("❌ Could not find Purchasers column")
-            return None
-    
-    # ========== STEP 7: HANDLE CONVERSION % COLUMN ==========
-    if 'Conversion %' not in df.columns:
-        conversion_col = None
-        for col in df.columns:
-            if 'conversion' in col.lower() and col != group_col:
-                conversion_col = col
-                break
-        
-        if conversion_col:
-            df.rename(columns={conversion_col: 'Conversion %'}, inplace=True)
-            st.info(f"✅ Using '{conversion_col}' as Conversion % column")
-    
-    # ========== STEP 8: CONVERT NUMERIC COLUMNS WITH ERROR HANDLING ==========
-    # Convert Purchasers
-    if 'Purchasers' in df.columns:
-        df['Purchasers'] = pd.to_numeric(df['Purchasers'], errors='coerce')
-    
-    # Convert Visitors
-    if 'Visitors' in df.columns:
-        df['Visitors'] = pd.to_numeric(df['Visitors'], errors='coerce')
-    elif 'Purchasers' in df.columns:
-        # Estimate visitors if not present (assume 5% conversion)
-        df['Visitors'] = (df['Purchasers'] / 0.05).fillna(0).astype(int)
-        st.info("📈 Estimated Visitors column from Purchasers (assuming 5% baseline conversion)")
-    
-    # Handle Conversion % with proper error handling
-    if 'Conversion %' in df.columns:
-        if df['Conversion %'].dtype == 'object':
-            # Clean percentage values more carefully
-            df['Conversion %'] = (df['Conversion %']
-                                 .astype(str)
-                                 .str.replace('%', '', regex=False)
-                                 .str.replace(',', '', regex=False)
-                                 .str.strip())
-            # Convert to numeric, coercing errors to NaN
-            df['Conversion %'] = pd.to_numeric(df['Conversion %'], errors='coerce')
-        else:
-            df['Conversion %'] = pd.to_numeric(df['Conversion %'], errors='coerce')
-    else:
-        # Calculate conversion if we have both Visitors and Purchasers
-        if 'Visitors' in df.columns and 'Purchasers' in df.columns:
-            df['Conversion %'] = (df['Purchasers'] / df['Visitors'] * 100).round(2)
-            st.info("📊 Calculated Conversion % from Visitors and Purchasers")
-    
-    # ========== STEP 9: REMOVE ROWS WITH MISSING CRITICAL DATA ==========
-    rows_before = len(df)
-    df = df.dropna(subset=['Purchasers'])
-    
-    # Also remove rows where Conversion % couldn't be converted
-    if 'Conversion %' in df.columns:
-        df = df.dropna(subset=['Conversion %'])
-    
-    rows_after = len(df)
-    if rows_before - rows_after > 0:
-        st.info(f"🗑️ Removed {rows_before - rows_after} rows with invalid data")
-    
-    # ========== STEP 10: ADD REQUIRED COLUMNS ==========
-    df['Combo Size'] = 1
-    df['Min Visitors'] = 40
-    
-    # Rename the group column to a standard name if it exists
-    if group_col and group_col in df.columns:
-        df.rename(columns={group_col: 'Attribute'}, inplace=True)
-    
-    # ========== STEP 11: FINAL CLEANUP - REMOVE ANY REMAINING SUMMARY ROWS ==========
-    if 'Attribute' in df.columns:
-        df = df[~df['Attribute'].astype(str).str.contains('Total|total|TOTAL|conversion', 
-                                                         na=False, case=False, regex=True)]
-    
-    # ========== STEP 12: SORT AND RANK ==========
-    if 'Conversion %' in df.columns and len(df) > 0:
-        df = df.sort_values('Conversion %', ascending=False).reset_index(drop=True)
-    
-    df['Rank'] = range(1, len(df) + 1)
-    
-    # ========== STEP 13: FINAL VALIDATION ==========
-    if len(df) == 0:
-        st.error("❌ No valid data rows found after cleaning")
-        return None
-    
-    st.success(f"✅ Transformed analysis data into {len(df)} combo segments!")
-    
-    # Show final structure
-    with st.expander("✅ Final transformed data preview"):
-        st.dataframe(df.head(5), use_container_width=True)
-    
-    return df
-
-def transform_purchase_email_to_combo(df):
-    """
-    Transforms Purchase/Email format to combo format
-    FIXED VERSION - Creates proper top combos table
-    """
-    st.info("🔄 Detected purchase/demographic data - transforming to combo format...")
-    
-    # Clean column names
-    df.columns = df.columns.str.strip()
-    
-    st.info(f"📊 Found {len(df)} purchase records")
-    
-    # ========== IDENTIFY DEMOGRAPHIC COLUMNS ==========
-    demographic_keywords = [
-        'AGE', 'GENDER', 'INCOME', 'STATE', 'MARRIED', 'CHILDREN', 
-        'HOMEOWNER', 'HOME_OWNER', 'CREDIT', 'NET_WORTH', 
-        'EDUCATION', 'OCCUPATION', 'ETHNICITY'
-    ]
-    
-    demographic_cols = []
-    skip_cols = ['Purchase', 'Email', 'Order', 'Paid', 'Subtotal', 'Total', 
-                 'Discount', 'Shipping', 'Billing', 'Lineitem', 'Quantity',
-                 'Product', 'Sale', 'Price', 'SKU', 'Zip', 'Phone', 'Notes',
-                 'UUID', 'FIRST_NAME', 'LAST_NAME', 'ADDRESS', 'CITY']
-    
-    for col in df.columns:
-        col_upper = col.upper()
-        # Check if column matches demographic keywords and isn't in skip list
-        if any(keyword in col_upper for keyword in demographic_keywords):
-            if not any(skip in col_upper for skip in skip_cols):
-                demographic_cols.append(col)
-    
-    # If no demographics found, try to find ANY categorical columns
-    if not demographic_cols:
-        st.warning("⚠️ No demographic columns detected. Using all categorical columns...")
-        for col in df.columns:
-            if col not in skip_cols and df[col].dtype == 'object':
-                if df[col].nunique() < len(df) * 0.8:  # Has some repeated values
-                    demographic_cols.append(col)
-                    if len(demographic_cols) >= 5:
-                        break
-    
-    # Fallback: use first 3 columns if still nothing found
-    if not demographic_cols:
-        demographic_cols = [df.columns[0], df.columns[1], df.columns[2]]
-        st.warning(f"⚠️ Using first 3 columns: {', '.join(demographic_cols)}")
-    else:
-        # Limit to top 5 most important demographics
-        demographic_cols = demographic_cols[:5]
-    
-    st.info(f"📊 Grouping by these attributes: **{', '.join(demographic_cols)}**")
-    
-    # ========== COUNT PURCHASES AND VISITORS ==========
-    # Each row = 1 purchase
-    df['_temp_purchase'] = 1
-    
-    # Count unique emails as visitors
-    if 'Email' in df.columns:
-        visitor_col = 'Email'
-    elif 'email' in df.columns:
-        visitor_col = 'email'
-    else:
-        # Use first column if no email column
-        visitor_col = df.columns[0]
-        st.info(f"📧 No email column found, using '{visitor_col}' to count visitors")
-    
-    # ========== GROUP BY DEMOGRAPHICS ==========
-    grouped = df.groupby(demographic_cols, dropna=False).agg({
-        '_temp_purchase': 'sum',           # Count purchases
-        visitor_col: 'nunique'              # Count unique visitors
-    }).reset_index()
-    
-    # Rename columns
-    grouped.rename(columns={
-        '_temp_purchase': 'Purchasers',
-        visitor_col: 'Visitors'
-    }, inplace=True)
-    
-    # ========== CALCULATE CONVERSION RATE ==========
-    grouped['Conversion %'] = (grouped['Purchasers'] / grouped['Visitors'] * 100).round(2)
-    
-    # ========== ADD REQUIRED COLUMNS ==========
-    grouped['Combo Size'] = len(demographic_cols)
-    grouped['Min Visitors'] = 40
-    
-    # ========== SORT BY CONVERSION RATE ==========
-    grouped = grouped.sort_values('Conversion %', ascending=False).reset_index(drop=True)
-    
-    # ========== ADD RANK ==========
-    grouped['Rank'] = range(1, len(grouped) + 1)
-    
-    # ========== REORDER COLUMNS (RANK FIRST) ==========
-    cols = ['Rank', 'Combo Size', 'Visitors', 'Purchasers', 'Conversion %', 'Min Visitors'] + demographic_cols
-    grouped = grouped[cols]
-    
-    st.success(f"✅ Created {len(grouped)} combo segments from {len(df)} purchase records!")
-    
-    # Show preview
-    with st.expander("✅ Preview of Top 5 Combos"):
-        st.dataframe(grouped.head(5), use_container_width=True)
-    
-    return grouped
-
-def transform_uuid_to_combo(df):
-    """
-    Transforms UUID/enriched data format to combo format
-    """
-    st.info("🔄 Detected enriched data format - transforming to combo format...")
-    
-    df.columns = df.columns.str.strip()
-    
-    # Select key demographic columns
-    demographic_cols = []
-    priority_cols = ['AGE_RANGE', 'GENDER', 'INCOME_RANGE', 'NET_WORTH', 'MARRIED', 
-                     'HOMEOWNER', 'CHILDREN', 'PERSONAL_STATE', 'COMPANY_INDUSTRY',
-                     'SKIPTRACE_CREDIT_RATING', 'SKIPTRACE_ETHNIC_CODE']
-    
-    for col in priority_cols:
-        if col in df.columns:
-            demographic_cols.append(col)
-    
-    if not demographic_cols:
-        # Fallback to any demographic-like columns
-        for col in df.columns:
-            if any(keyword in col.upper() for keyword in ['AGE', 'GENDER', 'INCOME', 'STATE']):
-                demographic_cols.append(col)
-    
-    if not demographic_cols:
-        st.warning("⚠️ No demographic columns found. Using first available column.")
-        demographic_cols = [df.columns[0]]
-    
-    # Limit to top 5 demographic attributes
-    demographic_cols = demographic_cols[:5]
-    
-    # Group by demographics
-    grouped = df.groupby(demographic_cols, dropna=False).size().reset_index(name='Purchasers')
-    
-    # Estimate visitors (assume 5% conversion rate baseline)
-    grouped['Visitors'] = (grouped['Purchasers'] / 0.05).astype(int)
-    
-    # Calculate conversion
-    grouped['Conversion %'] = (grouped['Purchasers'] / grouped['Visitors'] * 100).round(2)
-    
-    # Add required columns
-    grouped['Rank'] = range(1, len(grouped) + 1)
-    grouped['Combo Size'] = len(demographic_cols)
-    grouped['Min Visitors'] = 40
-    
-    # Sort by conversion
-    grouped = grouped.sort_values('Conversion %', ascending=False).reset_index(drop=True)
-    grouped['Rank'] = range(1, len(grouped) + 1)
-    
-    st.success(f"✅ Transformed {len(df)} enriched records into {len(grouped)} combo segments!")
-    
-    return grouped
-def transform_attribute_conversion_to_combo(df):
-    """
-    Transforms Attribute Conversion Tables to combo format
-    
-    Input format (from your images):
-    - Column 1: "Value" (e.g., A, U, B for Credit Rating)
-    - Column 2: "Visitors" 
-    - Column 3: "Purchasers"
-    - Column 4: "Conversion %"
-    
-    The attribute name (like SKIPTRACE_CREDIT_RATING) is often in a row above the headers
-    """
-    st.info("🔄 Detected Attribute Conversion Table format - transforming...")
-    
-    # Clean column names
-    df.columns = df.columns.str.strip().str.upper()
-    
-    with st.expander("🔍 Detected Attribute Conversion Table"):
-        st.write("**Columns found:**", list(df.columns))
-        st.dataframe(df.head(10), use_container_width=True)
-    
-    # Try to detect the attribute name from the data
-    # Often it's in the first few rows or in the filename
-    attribute_name = "DEMOGRAPHIC_ATTRIBUTE"
-    
-    # Check if first row contains the attribute name (common pattern)
-    first_row_text = ' '.join(df.iloc[0].astype(str).tolist()).upper()
-    if any(keyword in first_row_text for keyword in ['SKIPTRACE', 'AGE', 'CREDIT', 'ETHNIC', 'INCOME']):
-        # Found attribute name in first row - extract it
-        potential_name = df.iloc[0, 0] if pd.notna(df.iloc[0, 0]) else "ATTRIBUTE"
-        attribute_name = str(potential_name).strip().replace(' ', '_').upper()
-        st.info(f"📋 Detected attribute name: **{attribute_name}**")
-        
-        # Remove the attribute name row and reset
-        df = df.iloc[1:].reset_index(drop=True)
-        
-        # Re-clean column names after removing first row
-        df.columns = df.columns.str.strip().str.upper()
-
-    # Alternative: Check if columns match the exact pattern from your images
-    if len(df.columns) >= 3 and len(df.columns) <= 5:
-        col_names = [c.upper() for c in df.columns if 'NAN' not in str(c).upper()]
-        if any('VALUE' in c for c in col_names) and 'VISITORS' in ' '.join(col_names) and 'PURCHASERS' in ' '.join(col_names):
-            return 'attribute_conversion'
-    
-    # Standardize column names
-    column_mapping = {}
-    for col in df.columns:
-        col_upper = col.upper()
-        if col_upper in ['VALUE', 'VAL', 'ATTRIBUTE VALUE']:
-            column_mapping[col] = 'Value'
-        elif 'VISITOR' in col_upper:
-            column_mapping[col] = 'Visitors'
-        elif 'PURCHASER' in col_upper:
-            column_mapping[col] = 'Purchasers'
-        elif 'CONVERSION' in col_upper:
-            column_mapping[col] = 'Conversion %'
-    
-    df = df.rename(columns=column_mapping)
-    
-    # Ensure required columns exist
-    required = ['Value', 'Visitors', 'Purchasers']
-    missing = [col for col in required if col not in df.columns]
-    
-    if missing:
-        st.error(f"❌ Missing required columns: {', '.join(missing)}")
-        st.info("💡 Expected columns: Value, Visitors, Purchasers, Conversion %")
-        return None
-    
-    # Convert numeric columns
-    df['Visitors'] = pd.to_numeric(df['Visitors'], errors='coerce')
-    df['Purchasers'] = pd.to_numeric(df['Purchasers'], errors='coerce')
-    
-    # Handle Conversion %
-    if 'Conversion %' in df.columns:
-        if df['Conversion %'].dtype == 'object':
-            df['Conversion %'] = (df['Conversion %']
-                                  .str.replace('%', '', regex=False)
-                                  .str.replace(',', '', regex=False)
-                                  .astype(float))
-        else:
-            df['Conversion %'] = pd.to_numeric(df['Conversion %'], errors='coerce')
-    else:
-        # Calculate conversion if not present
-        df['Conversion %'] = (df['Purchasers'] / df['Visitors'] * 100).round(2)
-    
-    # Remove rows with missing data
-    df = df.dropna(subset=['Visitors', 'Purchasers'])
-    
-    # Remove summary rows (like "Blank/Unk", "Total", etc.)
-    df = df[~df['Value'].astype(str).str.contains('blank|unk|total|sum', case=False, na=False)]
-    
-    # Add the attribute name as a column (so we know what demographic this represents)
-    df[attribute_name] = df['Value']
-    
-    # Add required combo format columns
-    df['Rank'] = range(1, len(df) + 1)
-    df['Combo Size'] = 1  # Single attribute analysis
-    df['Min Visitors'] = 40
-    
-    # Sort by conversion rate
-    df = df.sort_values('Conversion %', ascending=False).reset_index(drop=True)
-    df['Rank'] = range(1, len(df) + 1)
-    
-    # Reorder columns to match combo format
-    cols = ['Rank', 'Combo Size', 'Visitors', 'Purchasers', 'Conversion %', 'Min Visitors', attribute_name]
-    df = df[cols]
-    
-    st.success(f"✅ Transformed {len(df)} attribute values into combo format!")
-    
-    with st.expander("✅ Preview of transformed data"):
-        st.dataframe(df.head(10), use_container_width=True)
-    
-    return df
-def transform_excel_multi_header_to_combo(df):
-    """
-    Transforms Excel-style multi-header CSV to combo format
-    
-    Handles:
-    - Metadata rows before headers (like "Min Visitors: 400")
-    - Empty spacer rows
-    - Actual data headers buried in row 3-5
-    - Merged cell artifacts
-    """
-    st.info("🔄 Detected Excel export format with multi-row headers - restructuring...")
-    
-    # ========== STEP 1: Find the actual header row ==========
-    is_excel_style, header_row_idx, metadata = detect_excel_style_headers(df)
-    
-    if not is_excel_style or header_row_idx is None:
-        st.error("❌ Could not locate header row in Excel format")
-        return None
-    
-    st.info(f"📋 Found column headers at row {header_row_idx + 1}")
-    
-    # ========== STEP 2: Extract metadata from top rows ==========
-    if metadata.get('min_visitors'):
-        st.success(f"✅ Extracted metadata: Min Visitors = {metadata['min_visitors']}")
-    
-    # Show what we're skipping
-    with st.expander("🔍 Rows being skipped (metadata/empty rows)", expanded=False):
-        skipped_df = df.iloc[:header_row_idx]
-        st.dataframe(skipped_df, use_container_width=True)
-    
-    # ========== STEP 3: Rebuild dataframe with correct headers ==========
-    # Use the detected row as column names
-    new_columns = df.iloc[header_row_idx].tolist()
-    
-    # Clean column names
-    new_columns = [str(col).strip() for col in new_columns]
-    
-    # Get data starting from row AFTER the headers
-    new_df = df.iloc[header_row_idx + 1:].copy()
-    new_df.columns = new_columns
-    
-    # Reset index
-    new_df = new_df.reset_index(drop=True)
-    
-    # ========== STEP 4: Remove any remaining empty rows ==========
-    new_df = new_df.dropna(how='all')
-    
-    # ========== STEP 5: Clean column names (remove special characters) ==========
-    new_df.columns = (new_df.columns
-                      .str.strip()
-                      .str.replace('\n', ' ', regex=False)
-                      .str.replace('\r', ' ', regex=False)
-                      .str.replace('  ', ' ', regex=True))
-    
-    # Show cleaned structure
-    with st.expander("✅ Cleaned column structure", expanded=True):
-        st.write("**New Column Names:**")
-        st.code(', '.join(new_df.columns.tolist()))
-        st.write("**First 5 rows of cleaned data:**")
-        st.dataframe(new_df.head(), use_container_width=True)
-    
-    # ========== STEP 6: Validate it's actually combo format now ==========
-    required_cols = ['Rank', 'Combo Size', 'Visitors', 'Purchasers']
-    missing = [col for col in required_cols if col not in new_df.columns]
-    
-    if missing:
-        st.info(f"Available columns: {', '.join(df.columns.tolist())}")
-                
-        with st.expander("Raw File Preview (first 10 lines)"):
-                    uploaded_file.seek(0)
-                    for i, line in enumerate(uploaded_file):
-                        if i < 10:
-                            st.code(line.decode('utf-8') if isinstance(line, bytes) else line)
-                        else:
-                            break
-        return None
-    
-    # ========== STEP 7: Convert numeric columns ==========
-    numeric_cols = ['Rank', 'Combo Size', 'Visitors', 'Purchasers', 'Conversion %', 'Min Visitors']
-    
-    for col in numeric_cols:
-        if col in new_df.columns:
-            if new_df[col].dtype == 'object':
-                # Clean percentage signs, dollar signs, commas
-                new_df[col] = (new_df[col].astype(str)
-                              .str.replace('%', '', regex=False)
-                              .str.replace('$', '', regex=False)
-                              .str.replace(',', '', regex=False)
-                              .str.strip())
-            
-            # Convert to numeric
-            new_df[col] = pd.to_numeric(new_df[col], errors='coerce')
-    
-    # ========== STEP 8: Add Min Visitors from metadata if missing ==========
-    if 'Min Visitors' not in new_df.columns or new_df['Min Visitors'].isna().all():
-        if metadata.get('min_visitors'):
-            new_df['Min Visitors'] = metadata['min_visitors']
-            st.info(f"✅ Added Min Visitors column from metadata: {metadata['min_visitors']}")
-        else:
-            new_df['Min Visitors'] = 40  # Default
-    
-    # ========== STEP 9: Calculate Conversion % if missing ==========
-    if 'Conversion %' not in new_df.columns or new_df['Conversion %'].isna().all():
-        if 'Visitors' in new_df.columns and 'Purchasers' in new_df.columns:
-            new_df['Conversion %'] = (new_df['Purchasers'] / new_df['Visitors'] * 100).round(2)
-            st.info("📊 Calculated Conversion % from Visitors and Purchasers")
-    
-    # ========== STEP 10: Remove rows with missing critical data ==========
-    rows_before = len(new_df)
-    new_df = new_df.dropna(subset=['Rank', 'Purchasers'])
-    rows_after = len(new_df)
-    
-    if rows_before - rows_after > 0:
-        st.info(f"🗑️ Removed {rows_before - rows_after} rows with invalid data")
-    
-    # ========== STEP 11: Ensure Rank is properly sorted ==========
-    new_df = new_df.sort_values('Rank').reset_index(drop=True)
-    
-    # ========== STEP 12: Final validation ==========
-    if len(new_df) == 0:
-        st.error("❌ No valid data rows after cleaning")
-        return None
-    
-    st.success(f"✅ Successfully transformed Excel format into {len(new_df)} combo rows!")
-    
-    # Show final preview
-    with st.expander("✅ Final transformed data preview"):
-        st.dataframe(new_df.head(10), use_container_width=True)
-    
-    return new_df
-def transform_multi_table_attributes_to_combo(df):
-    """
-    FIXED VERSION: Transforms multi-table attribute format to combo format
-    
-    Handles the structure from your images:
-    - Row with attribute name (e.g., "Income Range")
-    - Row with headers: "Attribute Value | Visitors (T) | Purchasers | Conversion Rate | Visitors (M) | ..."
-    - Data rows
-    - Blank row or separator
-    - Next attribute section
-    """
-    st.info("🔄 Detected multi-table attribute format - parsing all tables...")
-    
-    is_multi, table_starts, metadata = detect_multi_table_attribute_format(df)
-    
-    if not is_multi or len(table_starts) == 0:
-        st.error("❌ Could not detect multiple attribute tables")
-        return None
-    
-    st.info(f"📊 Found {len(table_starts)} attribute tables to parse")
-    
-    # Show detected tables
-    with st.expander("🔍 Detected Attribute Tables"):
-        for i, table_info in enumerate(table_starts, 1):
-            st.write(f"{i}. **{table_info['attribute_name']}** (header at row {table_info['header_row'] + 1})")
-    
-    # ===== PARSE EACH TABLE =====
-    all_tables = {}
-    
-    for i, table_info in enumerate(table_starts):
-        attr_name = table_info['attribute_name']
-        header_row_idx = table_info['header_row']
-        data_start_idx = table_info['data_start']
-        
-        # Find where this table ends (start of next table or end of data)
-        # ===== IMPROVED: Find where this table ACTUALLY ends =====
-        if i + 1 < len(table_starts):
-            # End at the ATTRIBUTE NAME row of next table (not header row)
-            next_attr_name_row = table_starts[i + 1]['header_row'] - 1
-            data_end_idx = next_attr_name_row
-        else:
-            data_end_idx = len(df)
-
-        # ===== ADDITIONAL SAFETY: Stop at empty rows or new attribute names =====
-        actual_end = data_start_idx
-        for check_idx in range(data_start_idx, data_end_idx):
-            row = df.iloc[check_idx]
-            row_str = ' '.join(row.astype(str).tolist()).strip()
-            
-            # Stop if we hit an empty row
-            if row_str == '' or row_str.lower() == 'nan':
-                break
-            
-            # Stop if we hit a new attribute name (keywords like "Homeowner", "Credit", etc.)
-            attribute_keywords = [
-                'HOMEOWNER', 'CREDIT', 'ETHNIC', 'MARITAL', 'MARRIED', 
-                'CHILDREN', 'EDUCATION', 'VEHICLE', 'LANGUAGE', 'OCCUPATION'
-            ]
-            if any(keyword in row_str.upper() for keyword in attribute_keywords):
-                break
-            
-            actual_end = check_idx + 1
-
-        data_end_idx = actual_end
-        
-        # ===== EXTRACT TABLE DATA =====
-        try:
-            # Get header row
-            header_row = df.iloc[header_row_idx]
-            header_names = [str(col).strip() for col in header_row.tolist()]
-            
-            # Get data rows
-            table_data = df.iloc[data_start_idx:data_end_idx].copy()
-            
-            # Apply headers
-            table_data.columns = header_names
-            
-            # Reset index
-            table_data = table_data.reset_index(drop=True)
-            
-            # ===== CLEAN UP COLUMNS =====
-            # Standardize column names with fuzzy matching
-            column_mapping = {}
-            
-            for col in table_data.columns:
-                col_upper = col.upper().strip()
-                
-                # Match "Attribute Value" or "Value"
-                if 'VALUE' in col_upper or 'ATTRIBUTE' in col_upper:
-                    if 'Value' not in column_mapping.values():
-                        column_mapping[col] = 'Value'
-                
-                # Match visitor columns - handle (T), (M), (F) suffixes
-                elif 'VISITOR' in col_upper:
-                    # For now, prefer the first visitors column
-                    if 'Visitors' not in column_mapping.values():
-                        column_mapping[col] = 'Visitors'
-                
-                # Match purchaser columns
-                elif 'PURCHASER' in col_upper:
-                    if 'Purchasers' not in column_mapping.values():
-                        column_mapping[col] = 'Purchasers'
-                
-                # Match conversion columns
-                elif 'CONVERSION' in col_upper:
-                    if 'Conversion %' not in column_mapping.values():
-                        column_mapping[col] = 'Conversion %'
-            
-            table_data = table_data.rename(columns=column_mapping)
-            
-            st.info(f"📋 {attr_name} columns: {list(table_data.columns)[:5]}...")
-            
-            # ===== ENSURE REQUIRED COLUMNS EXIST =====
-            required = ['Value', 'Visitors', 'Purchasers']
-            
-            # Check if we have them
-            missing = [col for col in required if col not in table_data.columns]
-            
-            if missing:
-                # Try to find alternatives
-                st.warning(f"⚠️ {attr_name}: Missing columns {missing}")
-                
-                # Try to find any numeric columns to use as substitute
-                numeric_cols = table_data.select_dtypes(include=[np.number]).columns.tolist()
-                
-                if len(numeric_cols) < 2:
-                    st.warning(f"❌ {attr_name}: Not enough numeric columns, skipping table")
-                    continue
-            
-            # ===== CONVERT NUMERIC COLUMNS =====
-            for col in ['Visitors', 'Purchasers', 'Conversion %']:
-                if col in table_data.columns:
-                    # More robust conversion
-                    if table_data[col].dtype == 'object':
-                        table_data[col] = (table_data[col].astype(str)
-                                          .str.replace('%', '', regex=False)
-                                          .str.replace(',', '', regex=False)
-                                          .str.strip())
-                    
-                    # Use pandas to_numeric with coercion
-                    table_data[col] = pd.to_numeric(table_data[col], errors='coerce')
-            
-            # ===== REMOVE INVALID ROWS =====
-            # Remove rows with NaN in critical columns
-            before_count = len(table_data)
-            table_data = table_data.dropna(subset=['Value'])
-            
-            if 'Visitors' in table_data.columns and 'Purchasers' in table_data.columns:
-                table_data = table_data.dropna(subset=['Visitors', 'Purchasers'])
-            
-            after_count = len(table_data)
-            
-            if before_count - after_count > 0:
-                st.info(f"🗑️ {attr_name}: Removed {before_count - after_count} invalid rows")
-            
-            # ===== REMOVE SUMMARY ROWS =====
-            summary_keywords = ['blank', 'unk', 'unknown', 'total', 'sum', 'average', 'all']
-            
-            if 'Value' in table_data.columns:
-                initial_len = len(table_data)
-                table_data = table_data[
-                    ~table_data['Value'].astype(str).str.lower().str.contains(
-                        '|'.join(summary_keywords), 
-                        na=False, 
-                        regex=True
-                    )
-                ]
-                if len(table_data) < initial_len:
-                    st.info(f"🗑️ {attr_name}: Removed {initial_len - len(table_data)} summary rows")
-            
-            if len(table_data) == 0:
-                st.warning(f"⚠️ {attr_name}: No valid data rows after cleaning, skipping")
-                continue
-            
-            # ===== RENAME VALUE COLUMN TO ATTRIBUTE NAME =====
-            if 'Value' in table_data.columns:
-                table_data = table_data.rename(columns={'Value': attr_name})
-            
-            # Store the cleaned table
-            all_tables[attr_name] = table_data
-            
-            st.success(f"✅ Parsed {attr_name}: {len(table_data)} values")
-            
-        except Exception as e:
-            st.error(f"❌ Error parsing {attr_name}: {e}")
-            import traceback
-            with st.expander(f"🐛 Error details for {attr_name}"):
-                st.code(traceback.format_exc())
-            continue
-    
-    if len(all_tables) == 0:
-        st.error("❌ No tables could be parsed successfully")
-        return None
-    
-    # ===== COMBINE ALL TABLES INTO WIDE FORMAT =====
-    st.info("🔄 Creating combined wide-format table...")
-    
-    final_rows = []
-    
-    for attr_name, table_df in all_tables.items():
-        for _, row in table_df.iterrows():
-            final_row = {
-                'Visitors': row.get('Visitors', 0),
-                'Purchasers': row.get('Purchasers', 0),
-                'Conversion %': row.get('Conversion %', 0.0),
-                attr_name: row.get(attr_name, '')
-            }
-            final_rows.append(final_row)
-    
-    # Create DataFrame from all rows
-    final_df = pd.DataFrame(final_rows)
-    
-    # Fill NaN values
-    for attr_name in all_tables.keys():
-        if attr_name not in final_df.columns:
-            final_df[attr_name] = ''
-        else:
-            final_df[attr_name] = final_df[attr_name].fillna('').astype(str)
-    
-    # ===== ADD REQUIRED COLUMNS =====
-    final_df['Combo Size'] = 1
-    final_df['Min Visitors'] = 40
-    
-    # Sort by conversion rate
-    final_df = final_df.sort_values('Conversion %', ascending=False).reset_index(drop=True)
-    final_df['Rank'] = range(1, len(final_df) + 1)
-    
-    # ===== REORDER COLUMNS =====
-    attribute_columns = list(all_tables.keys())
-    base_columns = ['Rank', 'Combo Size', 'Visitors', 'Purchasers', 'Conversion %', 'Min Visitors']
-    final_columns = base_columns + attribute_columns
-    
-    final_df = final_df[final_columns]
-    
-    st.success(f"✅ Created {len(final_df)} combo rows from {len(all_tables)} attribute tables!")
-    
-    with st.expander("✅ Final combined table preview"):
-        st.write(f"**Total Rows:** {len(final_df)}")
-        st.write(f"**Attribute Columns:** {', '.join(attribute_columns)}")
-        st.dataframe(final_df.head(20), use_container_width=True)
-    
-    return final_df
-def smart_load_csv(uploaded_file):
-    """
-    FIXED VERSION - Less verbose, cleaner output
-    """
-    try:
-        # Try reading with different encodings
-        encodings = ['utf-8', 'latin1', 'iso-8859-1', 'cp1252']
-        df = None
-        
-        for encoding in encodings:
-            try:
-                uploaded_file.seek(0)
-                df_raw = pd.read_csv(uploaded_file, encoding=encoding, low_memory=False, header=None)
-                
-                # Detect Excel-style headers
-                is_excel_style, header_row, metadata = detect_excel_style_headers(df_raw)
-                
-                if is_excel_style:
-                    uploaded_file.seek(0)
-                    df = pd.read_csv(uploaded_file, encoding=encoding, low_memory=False, header=None)
-                else:
-                    # Check for merged headers
-                    first_row = df_raw.iloc[0].astype(str)
-                    first_row_text_count = first_row.str.contains('[A-Za-z]', regex=True, na=False).sum()
-                    
-                    if first_row_text_count <= 2 and len(df_raw) > 1:
-                        uploaded_file.seek(0)
-                        df = pd.read_csv(uploaded_file, encoding=encoding, low_memory=False, header=1)
-                    else:
-                        uploaded_file.seek(0)
-                        df = pd.read_csv(uploaded_file, encoding=encoding, low_memory=False, header=0)
-                
-                break
-                
-            except UnicodeDecodeError:
-                continue
-        
-        if df is None:
-            st.error("❌ Could not read file with any encoding")
-            return None
-        
-        # Clean column names (silently)
-        df.columns = df.columns.astype(str)
-        df.columns = (df.columns
-                      .str.strip()
-                      .str.replace('\n', ' ', regex=False)
-                      .str.replace('\r', ' ', regex=False)
-                      .str.replace('  ', ' ', regex=True)
-                      .str.replace('[^A-Za-z0-9_\s%]', '', regex=True)
-                      .str.strip())
-        
-        # Remove empty rows/columns
-        df = df.dropna(axis=1, how='all')
-        df = df.dropna(how='all')
-        
-        # Fix unnamed columns
-        unnamed_count = sum(1 for col in df.columns if 'Unnamed' in str(col))
-        
-        if unnamed_count > len(df.columns) * 0.5:
-            new_columns = df.iloc[0].astype(str).str.strip().tolist()
-            df.columns = new_columns
-            df = df.iloc[1:].reset_index(drop=True)
-        
-        # Remove nan columns
-        df = df.loc[:, ~df.columns.astype(str).str.contains('nan|unnamed', case=False, regex=False)]
-        df = df.dropna(axis=1, how='all')
-        df = df.dropna(how='all')
-        
-        # Make columns unique
-        if df.columns.duplicated().any():
-            cols = pd.Series(df.columns)
-            for dup in df.columns[df.columns.duplicated(keep=False)]:
-                cols[df.columns.get_loc(dup)] = [f'{dup}_{d_idx}' if d_idx != 0 else dup 
-                                                for d_idx in range(sum(df.columns == dup))]
-            df.columns = cols
-        
-        # Detect format (SILENTLY - no st.info calls here)
-        csv_format = detect_csv_format(df, uploaded_file)
-        
-        # Transform based on format
-        if csv_format == 'excel_multi_header':
-            return transform_excel_multi_header_to_combo(df)
-        elif csv_format == 'multi_table_attributes':
-            return transform_multi_table_attributes_to_combo(df)
-        elif csv_format == 'combo':
-            # Standardize columns
-            df.columns = df.columns.str.strip()
-            
-            for col in ['Rank', 'Combo Size', 'Visitors', 'Purchasers', 'Conversion %', 'Min Visitors']:
-                if col in df.columns:
-                    if df[col].dtype == 'object':
-                        df[col] = (df[col].astype(str)
-                                  .str.replace('%', '', regex=False)
-                                  .str.replace(',', '', regex=False)
-                                  .str.replace('$', '', regex=False)
-                                  .str.strip())
-                    df[col] = pd.to_numeric(df[col], errors='coerce')
-            
-            df = df.dropna(subset=['Rank'])
-            return df
-        elif csv_format == 'shopify':
-            return transform_shopify_to_combo(df)
-        elif csv_format == 'gender_analysis':
-            return transform_gender_analysis_to_combo(df)
-        elif csv_format == 'purchase_email':
-            return transform_purchase_email_to_combo(df)
-        elif csv_format == 'uuid_enriched':
-            return transform_uuid_to_combo(df)
-        elif csv_format == 'attribute_conversion':
-            return transform_attribute_conversion_to_combo(df)
-        else:
-            # Generic fallback
-            numeric_cols = df.select_dtypes(include=[np.number]).columns.tolist()
-            categorical_cols = [col for col in df.columns if col not in numeric_cols][:5]
-            
-            if not categorical_cols:
-                st.error("❌ Cannot process this file format")
-                st.info("💡 Please ensure your CSV has proper column headers")
-                return None
-            
-            grouped = df.groupby(categorical_cols, dropna=False).size().reset_index(name='Purchasers')
-            grouped['Visitors'] = (grouped['Purchasers'] / 0.05).astype(int)
-            grouped['Conversion %'] = (grouped['Purchasers'] / grouped['Visitors'] * 100).round(2)
-            grouped['Rank'] = range(1, len(grouped) + 1)
-            grouped['Combo Size'] = len(categorical_cols)
-            grouped['Min Visitors'] = 40
-            
-            return grouped
-            
-    except Exception as e:
-        st.error(f"❌ Error processing file: {e}")
-        with st.expander("🐛 Error Details"):
-            import traceback
-            st.code(traceback.format_exc())
-        return None
-
-# ============================================
 # REPLACE THE load_data FUNCTION IN YOUR CODE
 # ============================================
 
@@ -1870,107 +666,29 @@ def load_data(uploaded_file=None):
             
             uploaded_file.seek(0)
             
-            # Show loading message
-            with st.spinner("📂 Processing your file..."):
-                # Use the smart CSV loader
-                df = smart_load_csv(uploaded_file)
+            # Same file parsed before (any session, any user) - reuse the cached combo table
+            df = get_cached_parse(file_hash, PARSER_VERSION)
             
-            if df is None:
-                st.error("❌ Could not process this file format")
-                return None
-            
-            # ========== SUCCESS - SHOW CLEAN PREVIEW ==========
-            st.success(f"✅ File loaded successfully!")
-            
-            # Create a clean preview table
-            preview_col1, preview_col2 = st.columns(2)
-            
-            with preview_col1:
-                st.metric("📊 Total Rows", f"{len(df):,}")
-            with preview_col2:
-                st.metric("📋 Total Columns", len(df.columns))
-            
-            # Show column names in an organized way
-            with st.expander("📋 Column Structure", expanded=True):
-                # Split columns into categories
-                metric_cols = []
-                demographic_cols = []
-                other_cols = []
-                
-                for col in df.columns:
-                    col_upper = col.upper()
-                    if any(x in col_upper for x in ['RANK', 'VISITORS', 'PURCHASERS', 'CONVERSION', 'COMBO']):
-                        metric_cols.append(col)
-                    elif any(x in col_upper for x in ['AGE', 'GENDER', 'INCOME', 'STATE', 'CREDIT', 'MARRIED', 'HOME']):
-                        demographic_cols.append(col)
-                    else:
-                        other_cols.append(col)
-                
-                col_preview1, col_preview2, col_preview3 = st.columns(3)
-                
-                with col_preview1:
-                    st.markdown("**📊 Metrics**")
-                    if metric_cols:
-                        for col in metric_cols:
-                            st.markdown(f"• {col}")
-                    else:
-                        st.caption("None")
-                
-                with col_preview2:
-                    st.markdown("**👥 Demographics**")
-                    if demographic_cols:
-                        for col in demographic_cols[:10]:  # Limit to 10
-                            st.markdown(f"• {col}")
-                        if len(demographic_cols) > 10:
-                            st.caption(f"...and {len(demographic_cols) - 10} more")
-                    else:
-                        st.caption("None")
-                
-                with col_preview3:
-                    st.markdown("**📁 Other Fields**")
-                    if other_cols:
-                        for col in other_cols[:10]:  # Limit to 10
-                            st.markdown(f"• {col}")
-                        if len(other_cols) > 10:
-                            st.caption(f"...and {len(other_cols) - 10} more")
-                    else:
-                        st.caption("None")
-            
-            # Show data preview
-            with st.expander("👁️ Data Preview (First 10 Rows)", expanded=True):
-                st.dataframe(
-                    df.head(10),
-                    use_container_width=True,
-                    height=400
-                )
-            
-            # Update session state
-            st.session_state.current_file_hash = file_hash
-            
-            # Log the upload
-            from datetime import datetime
-            log_audit(st.session_state.user_email, 'Data Upload', 
-                     f'Uploaded file: {uploaded_file.name}, Rows: {len(df)}')
-            
-            # Store in database (do this silently in background)
-            try:
-                file_data_json = df.to_json(orient='records')
+            if df is not None:
+                st.info("⚡ This file was processed before - loaded the parsed result from cache")
+            else:
+                # Show loading message
+                pipeline_events = CollectingSink()
+                with st.spinner("📂 Processing your file..."), use_sink(pipeline_events):
+                    # Use the smart CSV loader
+                    df = smart_load_csv(uploaded_file)
                 
-                conn = get_db_connection()
-                c = conn.cursor()
-                c.execute('''INSERT INTO upload_history 
-                            (user_email, filename, upload_date, row_count, file_data) 
-                            VALUES (?, ?, ?, ?, ?)''',
-                         (st.session_state.user_email, 
-                          uploaded_file.name, 
-                          datetime.now().isoformat(), 
-                          len(df), 
-                          file_data_json))
-                conn.commit()
-                conn.close()
-            except Exception as e:
-                # Don't show error to user, just log it
-                print(f"Database storage error: {e}")
+                render_pipeline_events(pipeline_events)
+                
+                if df is None:
+                    st.error("❌ Could not process this file format")
+                    return None
+                
+                put_cached_parse(file_hash, PARSER_VERSION, df, csv_format=pipeline_events.stage_note('detect'))
+            
+            st.success(f"✅ File loaded successfully!")
+            show_load_preview(df)
+            record_upload(df, uploaded_file.name, file_hash)
             
             return df
             
@@ -1982,18 +700,261 @@ def load_data(uploaded_file=None):
             return None
     
     return None
-# Apply filters function
-def apply_filters(df, filters):
-    filtered_df = df.copy()
-    
-    for column, values in filters.items():
-        if values and column in filtered_df.columns:
-            if isinstance(values, list):
-                filtered_df = filtered_df[filtered_df[column].isin(values)]
+# Load several CSVs at once and merge them into one dataset
+def load_data_multi(uploaded_files):
+    """
+    Parses the files in parallel worker processes (cached parses are reused),
+    then merges their combos: identical attribute values are summed and
+    Conversion % / Rank recomputed
+    """
+    try:
+        files = [(f.name, f.getvalue()) for f in uploaded_files]
+        file_hashes = [hashlib.md5(content).hexdigest() for _, content in files]
+        
+        # The merged dataset is identified by its files' hashes, in upload order
+        merged_hash = hashlib.md5(''.join(file_hashes).encode()).hexdigest()
+        if st.session_state.current_file_hash == merged_hash:
+            return st.session_state.data
+        
+        frames = [get_cached_parse(file_hash, PARSER_VERSION) for file_hash in file_hashes]
+        timings = [{'File': name, 'Status': '⚡ Cached', 'Seconds': 0.0} for name, _ in files]
+        pending = [i for i, frame in enumerate(frames) if frame is None]
+        
+        if pending:
+            start = datetime.now()
+            with st.spinner(f"📂 Processing {len(pending)} files in parallel..."):
+                results = parse_files_parallel([files[i] for i in pending])
+            wall_seconds = (datetime.now() - start).total_seconds()
+            
+            for i, (name, df, seconds, error, _) in zip(pending, results):
+                frames[i] = df
+                timings[i]['Seconds'] = round(seconds, 2)
+                if df is None:
+                    timings[i]['Status'] = f"❌ {error}"
+                else:
+                    timings[i]['Status'] = '✅ Parsed'
+                    put_cached_parse(file_hashes[i], PARSER_VERSION, df)
+            
+            st.caption(f"⏱️ {len(pending)} files parsed in {wall_seconds:.1f}s wall time "
+                       f"({sum(timings[i]['Seconds'] for i in pending):.1f}s of parsing)")
+        
+        for i, frame in enumerate(frames):
+            timings[i]['Combos'] = len(frame) if frame is not None else 0
+        
+        with st.expander("⏱️ Per-file processing", expanded=True):
+            st.dataframe(pd.DataFrame(timings)[['File', 'Status', 'Combos', 'Seconds']],
+                         use_container_width=True, hide_index=True)
+        
+        try:
+            df = merge_combo_frames(frames)
+        except ValueError as e:
+            # Files with different layouts: show which columns each one has
+            st.error(f"❌ {e}")
+            st.dataframe(pd.DataFrame({
+                'File': [name for (name, _), frame in zip(files, frames) if frame is not None],
+                'Attribute Columns': [', '.join(combo_attribute_columns(frame)) for frame in frames if frame is not None]
+            }), use_container_width=True, hide_index=True)
+            return None
+        if df is None:
+            st.error("❌ None of the files could be processed")
+            return None
+        
+        loaded = sum(frame is not None for frame in frames)
+        st.success(f"✅ Merged {loaded} of {len(files)} files into {len(df):,} combos!")
+        show_load_preview(df)
+        
+        filename = f"{len(files)} files: " + ', '.join(name for name, _ in files)
+        record_upload(df, filename[:200], merged_hash)
+        
+        return df
+        
+    except Exception as e:
+        st.error(f"❌ Error loading files: {str(e)}")
+        with st.expander("🐛 Technical Details"):
+            import traceback
+            st.code(traceback.format_exc())
+        return None
+
+# Fold a new day's export into the current dataset instead of replacing it
+def load_data_append(uploaded_file):
+    """
+    Parses only the new file and merges its combos into the current combo
+    table: matching combos get their Visitors / Purchasers added and
+    Conversion % recomputed, new combos are added and Rank repaired around them
+    """
+    try:
+        file_hash = hashlib.md5(uploaded_file.getvalue()).hexdigest()
+        
+        # Already appended on an earlier run (the uploader keeps the file across reruns)
+        if st.session_state.get('last_append') == (st.session_state.current_file_hash, file_hash):
+            return st.session_state.data
+        
+        # Same file parsed before - reuse it if its format was stored with it
+        delta = get_cached_parse(file_hash, PARSER_VERSION)
+        csv_format = delta.attrs.get('csv_format') if delta is not None else None
+        cached = csv_format is not None
+        
+        if cached:
+            st.info("⚡ This file was processed before - loaded the parsed result from cache")
+        else:
+            pipeline_events = CollectingSink()
+            with st.spinner("📂 Processing the new rows..."), use_sink(pipeline_events):
+                delta = smart_load_csv(uploaded_file)
+            
+            render_pipeline_events(pipeline_events)
+            
+            if delta is None:
+                st.error("❌ Could not process this file format")
+                return None
+            csv_format = pipeline_events.stage_note('detect')
+        
+        if csv_format not in APPEND_FORMATS:
+            st.error(f"❌ Only Shopify and purchase-email exports can be appended (this file was read as "
+                     f"{csv_format or 'an unknown format'}). Upload it without append to replace the dataset.")
+            return None
+        
+        # Cached only once accepted: a rejected file is never appended, so its parse is not worth keeping
+        if not cached:
+            put_cached_parse(file_hash, PARSER_VERSION, delta, csv_format=csv_format)
+        
+        # The current table's key index is kept per dataset, so only the new combos are hashed
+        current = st.session_state.data
+        key_index = get_combo_key_index(current, current_dataset_id(current))
+        with span('pipeline:append'):
+            df, updated, added, appended_index = append_combo_frame(current, delta, key_index)
+        
+        st.success(f"✅ Appended {uploaded_file.name}: {updated:,} combos updated, {added:,} new "
+                   f"({len(df):,} combos in total)")
+        
+        # The appended dataset is identified by the dataset it extends plus the new file
+        appended_hash = hashlib.md5((st.session_state.current_file_hash or '').encode() + file_hash.encode()).hexdigest()
+        record_upload(df, f"{uploaded_file.name} (appended)"[:200], appended_hash)
+        st.session_state.last_append = (appended_hash, file_hash)
+        if appended_index is not None:
+            get_combo_key_index(df, appended_hash, derived=appended_index)
+        
+        return df
+        
+    except Exception as e:
+        st.error(f"❌ Error appending file: {str(e)}")
+        with st.expander("🐛 Technical Details"):
+            import traceback
+            st.code(traceback.format_exc())
+        return None
+
+# Messages, previews and stage timings collected while parsing an upload
+def render_pipeline_events(sink):
+    for event in sink.events:
+        if event.level == 'detail':
+            with st.expander(event.message, expanded=event.expanded):
+                for item in event.details:
+                    if isinstance(item, pd.DataFrame):
+                        st.dataframe(item, use_container_width=True)
+                    elif isinstance(item, Code):
+                        st.code(item)
+                    else:
+                        st.write(item)
+        elif event.level != 'stage':
+            getattr(st, event.level)(event.message)
+    
+    timings = sink.stage_timings()
+    if timings:
+        st.caption("⏱️ " + " · ".join(
+            f"{stage} {seconds:.2f}s" + (f" ({rows:,} rows)" if rows is not None else "")
+            for stage, seconds, rows in timings))
+
+# Loaded data preview (rows, column groups, first rows)
+def show_load_preview(df):
+    # Create a clean preview table
+    preview_col1, preview_col2 = st.columns(2)
+    
+    with preview_col1:
+        st.metric("📊 Total Rows", f"{len(df):,}")
+    with preview_col2:
+        st.metric("📋 Total Columns", len(df.columns))
+    
+    # Show column names in an organized way
+    with st.expander("📋 Column Structure", expanded=True):
+        # Split columns into categories
+        metric_cols = []
+        demographic_cols = []
+        other_cols = []
+        
+        for col in df.columns:
+            col_upper = col.upper()
+            if any(x in col_upper for x in ['RANK', 'VISITORS', 'PURCHASERS', 'CONVERSION', 'COMBO']):
+                metric_cols.append(col)
+            elif any(x in col_upper for x in ['AGE', 'GENDER', 'INCOME', 'STATE', 'CREDIT', 'MARRIED', 'HOME']):
+                demographic_cols.append(col)
+            else:
+                other_cols.append(col)
+        
+        col_preview1, col_preview2, col_preview3 = st.columns(3)
+        
+        with col_preview1:
+            st.markdown("**📊 Metrics**")
+            if metric_cols:
+                for col in metric_cols:
+                    st.markdown(f"• {col}")
+            else:
+                st.caption("None")
+        
+        with col_preview2:
+            st.markdown("**👥 Demographics**")
+            if demographic_cols:
+                for col in demographic_cols[:10]:  # Limit to 10
+                    st.markdown(f"• {col}")
+                if len(demographic_cols) > 10:
+                    st.caption(f"...and {len(demographic_cols) - 10} more")
+            else:
+                st.caption("None")
+        
+        with col_preview3:
+            st.markdown("**📁 Other Fields**")
+            if other_cols:
+                for col in other_cols[:10]:  # Limit to 10
+                    st.markdown(f"• {col}")
+                if len(other_cols) > 10:
+                    st.caption(f"...and {len(other_cols) - 10} more")
             else:
-                filtered_df = filtered_df[filtered_df[column] == values]
+                st.caption("None")
     
-    return filtered_df
+    # Show data preview
+    with st.expander("👁️ Data Preview (First 10 Rows)", expanded=True):
+        st.dataframe(
+            df.head(10),
+            use_container_width=True,
+            height=400
+        )
+
+# Make a freshly loaded frame the current dataset and store it in upload history
+def record_upload(df, filename, file_hash):
+    # Update session state
+    st.session_state.current_file_hash = file_hash
+    
+    # Log the upload
+    log_audit(st.session_state.user_email, 'Data Upload', 
+             f'Uploaded file: {filename}, Rows: {len(df)}')
+    
+    # Store in database (do this silently in background)
+    try:
+        content_hash = save_upload_frame(df)
+        
+        conn = get_db_connection()
+        c = conn.cursor()
+        c.execute('''INSERT INTO upload_history 
+                    (user_email, filename, upload_date, row_count, content_hash) 
+                    VALUES (?, ?, ?, ?, ?)''',
+                 (st.session_state.user_email, 
+                  filename, 
+                  datetime.now().isoformat(), 
+                  len(df), 
+                  content_hash))
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        # Don't show error to user, just log it
+        print(f"Database storage error: {e}")
 
 # Main dashboard
 def show_dashboard():
@@ -2009,6 +970,7 @@ def show_dashboard():
                         "🏆 Top Combos", 
                         "🎨 Segment Builder", 
                         "🔍 Buyer Deep Dive",
+                        "🔗 Attribute Affinity",
                         "📤 Uploads",
                         "⚙️ Admin"],
                        label_visibility="collapsed")
@@ -2027,23 +989,29 @@ def show_dashboard():
     
     if st.session_state.data is None:
         st.info("📁 Please upload your buyer data CSV to get started")
-        uploaded_file = st.file_uploader("Upload Buyer Data CSV", type=['csv'], key='main_uploader')
+        combine_files = st.checkbox("📚 Combine several files (e.g. a daily export split into parts)", key='main_combine')
         
-        if uploaded_file:
-            data = load_data(uploaded_file)
-            if data is not None:
-                st.session_state.data = data
-                st.success(f"✅ Loaded {len(data)} rows successfully!")
-                
-                with st.expander("📊 Data Preview"):
-                    st.write("**Column Names:**")
-                    st.write(list(data.columns))
-                    st.write("**First 5 Rows:**")
-                    st.dataframe(data.head())
-                    st.write("**Data Types:**")
-                    st.write(data.dtypes)
-                
-                st.rerun()
+        if combine_files:
+            uploaded_files = st.file_uploader("Upload Buyer Data CSVs", type=['csv'], key='main_multi_uploader',
+                                              accept_multiple_files=True)
+            data = load_data_multi(uploaded_files) if uploaded_files else None
+        else:
+            uploaded_file = st.file_uploader("Upload Buyer Data CSV", type=['csv'], key='main_uploader')
+            data = load_data(uploaded_file) if uploaded_file else None
+        
+        if data is not None:
+            st.session_state.data = data
+            st.success(f"✅ Loaded {len(data)} rows successfully!")
+            
+            with st.expander("📊 Data Preview"):
+                st.write("**Column Names:**")
+                st.write(list(data.columns))
+                st.write("**First 5 Rows:**")
+                st.dataframe(data.head())
+                st.write("**Data Types:**")
+                st.write(data.dtypes)
+            
+            st.rerun()
     
     if st.session_state.data is not None:
         df = st.session_state.data
@@ -2056,14 +1024,18 @@ def show_dashboard():
             show_segment_builder(df)
         elif page == "🔍 Buyer Deep Dive":
             show_buyer_deep_dive(df)
+        elif page == "🔗 Attribute Affinity":
+            show_attribute_affinity(df)
         elif page == "📤 Uploads":
             show_uploads()
         elif page == "⚙️ Admin":
             show_admin()
 
 # Home Dashboard with improved search
+@timed('page:home')
 def show_home_dashboard(df):
     st.title("🏠 Home Dashboard - Buyer Intelligence")
+    dataset_id = current_dataset_id(df)
     
     # ========== STEP 1: VALIDATE REQUIRED COLUMNS ==========
     required_cols = ['Purchasers', 'Conversion %', 'Combo Size']
@@ -2116,16 +1088,19 @@ def show_home_dashboard(df):
             # Normal slider with proper range
             combo_size_range = st.slider("Combo Size", min_combo, max_combo, (min_combo, max_combo))
     
-    filtered_df = df[
+    filter_mask = (
         (df['Purchasers'] >= min_purchasers) &
         (df['Conversion %'] >= min_conversion) &
         (df['Combo Size'] >= combo_size_range[0]) &
         (df['Combo Size'] <= combo_size_range[1])
-    ]
+    ).to_numpy()
+    filtered_df = df[filter_mask]
     
     # ========== STEP 4: KEY METRICS ==========
     st.subheader("📊 Key Metrics")
     kpi1, kpi2, kpi3, kpi4 = st.columns(4)
+    # Filtered views of the dataset's cached rank orders: every top-k below is a slice
+    conversion_top = get_top_k(df, dataset_id, 'Conversion %', filter_mask)
     
     with kpi1:
         total_buyers = int(filtered_df['Purchasers'].sum())
@@ -2133,20 +1108,20 @@ def show_home_dashboard(df):
     
     with kpi2:
         top_50_count = min(50, len(filtered_df))
-        top_50_buyers = int(filtered_df.nlargest(top_50_count, 'Conversion %')['Purchasers'].sum())
+        top_50_buyers = int(conversion_top.purchasers(top_50_count))
         pct_from_top = (top_50_buyers / total_buyers * 100) if total_buyers > 0 else 0
         st.metric(f"% from Top {top_50_count} Combos", f"{pct_from_top:.1f}%")
     
     with kpi3:
         if len(filtered_df) > 0:
-            best_combo = filtered_df.nlargest(1, 'Conversion %').iloc[0]
+            best_combo = df.iloc[conversion_top.top(1)[0]]
             st.metric("Highest Converting Combo", 
                      f"{best_combo['Conversion %']:.1f}%",
                      delta=f"Rank #{int(best_combo['Rank'])}")
     
     with kpi4:
         if len(filtered_df) > 0:
-            best_volume = filtered_df.nlargest(1, 'Purchasers').iloc[0]
+            best_volume = df.iloc[get_top_k(df, dataset_id, 'Purchasers', filter_mask).top(1)[0]]
             st.metric("Best Volume Combo", 
                      f"{int(best_volume['Purchasers'])} buyers",
                      delta=f"Rank #{int(best_volume['Rank'])}")
@@ -2155,19 +1130,22 @@ def show_home_dashboard(df):
     
     # ========== STEP 5: SEARCH ==========
     st.subheader("🔍 Search and Analyze Data")
-    search = st.text_input("Search across all columns", "")
+    search = st.text_input("Search across all columns", "", help="Case-insensitive; several words must all match")
     
-    display_df = filtered_df.copy()
+    filter_values = (min_purchasers, min_conversion, tuple(combo_size_range))
     
     if search:
-        mask = display_df.astype(str).apply(lambda x: x.str.contains(search, case=False, na=False)).any(axis=1)
-        search_result_df = display_df[mask]
+        # Inverted index over the whole dataset (built once per dataset), ANDed with the filters
+        search_index = get_search_index(df, dataset_id)
+        search_mask = filter_mask & search_index.search(search)
+        search_result_df = df[search_mask]
         
         if len(search_result_df) > 0:
             st.success(f"✅ Found {len(search_result_df)} matching rows")
             
             with st.expander("📋 Search Results", expanded=True):
-                st.dataframe(search_result_df, use_container_width=True, height=300)
+                paged_table(df, 'search_table', dataset_id, mask=search_mask,
+                            reset_on=(search, filter_values), height=300)
                 
                 csv_search = search_result_df.to_csv(index=False)
                 st.download_button(
@@ -2202,9 +1180,11 @@ def show_home_dashboard(df):
     
     # ========== STEP 6: TOP COMBOS TABLE ==========
     st.subheader("📈 All Top Converting Combos")
-    st.dataframe(display_df, use_container_width=True, height=400)
+    sort_by, ascending = sort_controls('home_table', df)
+    paged_table(df, 'home_table', dataset_id, mask=filter_mask, sort_by=sort_by, ascending=ascending,
+                reset_on=filter_values)
     
-    csv = display_df.to_csv(index=False)
+    csv = filtered_df.to_csv(index=False)
     st.download_button(
         label="📥 Export Full Data to CSV",
         data=csv,
@@ -2223,6 +1203,7 @@ def show_home_dashboard(df):
         # Create charts dynamically based on available columns
         col1, col2 = st.columns(2)
         chart_count = 0
+        rollup_cube = get_rollup_cube(df, dataset_id)
         
         for standard_name, actual_col in available_demographics.items():
             if actual_col not in df.columns:
@@ -2230,7 +1211,7 @@ def show_home_dashboard(df):
                 
             try:
                 # Get top 10 values for this demographic
-                demo_data = df.groupby(actual_col)['Purchasers'].sum().nlargest(10).reset_index()
+                demo_data = rollup_cube.top(actual_col)
                 
                 if len(demo_data) == 0:
                     continue
@@ -2238,26 +1219,30 @@ def show_home_dashboard(df):
                 # Determine which column to use
                 target_col = col1 if chart_count % 2 == 0 else col2
                 
-                with target_col:
+                with target_col, span('chart:home_demographic'):
                     with st.expander(f"📊 Top {standard_name.replace('_', ' ').title()}", expanded=True):
-                        # Choose chart type based on data
-                        if len(demo_data) <= 5:
-                            fig = px.pie(demo_data, values='Purchasers', names=actual_col,
-                                       title=f'{standard_name.replace("_", " ").title()} Distribution',
-                                       color_discrete_sequence=COLOR_PALETTES['ocean'])
-                        else:
-                            fig = px.bar(demo_data, x=actual_col, y='Purchasers',
-                                       title=f'Top 10 {standard_name.replace("_", " ").title()}',
-                                       color='Purchasers',
-                                       color_continuous_scale=COLOR_PALETTES['purple'])
-                        
-                        fig.update_layout(
-                            plot_bgcolor='rgba(0,0,0,0)',
-                            paper_bgcolor='rgba(0,0,0,0)',
-                            font=dict(family="Inter", size=12),
-                            title_font_size=16,
-                            showlegend=False
-                        )
+                        def build_figure():
+                            # Choose chart type based on data
+                            if len(demo_data) <= 5:
+                                fig = px.pie(demo_data, values='Purchasers', names=actual_col,
+                                           title=f'{standard_name.replace("_", " ").title()} Distribution',
+                                           color_discrete_sequence=COLOR_PALETTES['ocean'])
+                            else:
+                                fig = px.bar(demo_data, x=actual_col, y='Purchasers',
+                                           title=f'Top 10 {standard_name.replace("_", " ").title()}',
+                                           color='Purchasers',
+                                           color_continuous_scale=COLOR_PALETTES['purple'])
+
+                            fig.update_layout(
+                                plot_bgcolor='rgba(0,0,0,0)',
+                                paper_bgcolor='rgba(0,0,0,0)',
+                                font=dict(family="Inter", size=12),
+                                title_font_size=16,
+                                showlegend=False
+                            )
+                            return fig
+
+                        fig = cached_figure(dataset_id, 'home_demographic', actual_col, (standard_name,), build_figure)
                         st.plotly_chart(fig, use_container_width=True)
                 
                 chart_count += 1
@@ -2274,38 +1259,43 @@ def show_home_dashboard(df):
         # Adjust for smaller datasets
         top_n = [n for n in top_n if n <= len(filtered_df)]
         
-        cumulative_buyers = []
-        for n in top_n:
-            buyers = int(filtered_df.nlargest(n, 'Conversion %')['Purchasers'].sum())
-            cumulative_buyers.append(buyers / total_buyers * 100)
-        
-        fig = go.Figure()
-        fig.add_trace(go.Bar(
-            x=[f'Top {n}' for n in top_n],
-            y=cumulative_buyers,
-            text=[f'{val:.1f}%' for val in cumulative_buyers],
-            textposition='auto',
-            hovertemplate='<b>%{x}</b><br>% of Total Buyers: <b>%{y:.1f}%</b><extra></extra>',
-            marker=dict(
-                color=cumulative_buyers,
-                colorscale=[[0, '#667eea'], [0.5, '#764ba2'], [1, '#f093fb']],
-                line=dict(color='rgba(255,255,255,0.5)', width=2)
-            )
-        ))
-        fig.update_layout(
-            title='Cumulative % of Total Buyers by Top Combos',
-            yaxis_title='% of Total Buyers',
-            xaxis_title='Top Combos',
-            plot_bgcolor='rgba(0,0,0,0)',
-            paper_bgcolor='rgba(0,0,0,0)',
-            font=dict(family="Inter", size=12),
-            title_font_size=16
-        )
-        st.plotly_chart(fig, use_container_width=True)
+        with span('chart:concentration'):
+            def build_figure():
+                cumulative_buyers = conversion_top.share(np.array(top_n, dtype=np.int64)).tolist()
+
+                fig = go.Figure()
+                fig.add_trace(go.Bar(
+                    x=[f'Top {n}' for n in top_n],
+                    y=cumulative_buyers,
+                    text=[f'{val:.1f}%' for val in cumulative_buyers],
+                    textposition='auto',
+                    hovertemplate='<b>%{x}</b><br>% of Total Buyers: <b>%{y:.1f}%</b><extra></extra>',
+                    marker=dict(
+                        color=cumulative_buyers,
+                        colorscale=[[0, '#667eea'], [0.5, '#764ba2'], [1, '#f093fb']],
+                        line=dict(color='rgba(255,255,255,0.5)', width=2)
+                    )
+                ))
+                fig.update_layout(
+                    title='Cumulative % of Total Buyers by Top Combos',
+                    yaxis_title='% of Total Buyers',
+                    xaxis_title='Top Combos',
+                    plot_bgcolor='rgba(0,0,0,0)',
+                    paper_bgcolor='rgba(0,0,0,0)',
+                    font=dict(family="Inter", size=12),
+                    title_font_size=16
+                )
+                return fig
+
+            # filtered_df is fully determined by the dataset and the filter values
+            fig = cached_figure(dataset_id, 'concentration', 'Conversion %', filter_values, build_figure)
+            st.plotly_chart(fig, use_container_width=True)
     
 # Detailed insights from data
-def show_detailed_insights(df, title="Data"):
+@timed('page:detailed_insights')
+def show_detailed_insights(df, title="Data", dataset_id=None):
     st.subheader(f"💡 Detailed Insights: {title}")
+    dataset_id = dataset_id or current_dataset_id(df)
     
     col1, col2, col3 = st.columns(3)
     
@@ -2336,6 +1326,7 @@ def show_detailed_insights(df, title="Data"):
                 demographic_cols.append(col)
     
     if demographic_cols:
+        rollup_cube = get_rollup_cube(df, dataset_id)
         color_idx = 0
         num_cols = 2
         for i in range(0, len(demographic_cols), num_cols):
@@ -2343,22 +1334,27 @@ def show_detailed_insights(df, title="Data"):
             for j in range(num_cols):
                 if i + j < len(demographic_cols):
                     col_name = demographic_cols[i + j]
-                    with cols[j]:
+                    with cols[j], span('chart:insights_demographic'):
                         try:
-                            demo_data = df.groupby(col_name)['Purchasers'].sum().nlargest(10).reset_index()
+                            demo_data = rollup_cube.top(col_name)
                             if len(demo_data) > 0:
                                 palette_key = list(COLOR_PALETTES.keys())[color_idx % len(COLOR_PALETTES)]
-                                fig = px.bar(demo_data, x=col_name, y='Purchasers',
-                                           title=f'{col_name} Distribution',
-                                           color='Purchasers',
-                                           color_continuous_scale=COLOR_PALETTES[palette_key])
-                                fig.update_layout(
-                                    plot_bgcolor='rgba(0,0,0,0)',
-                                    paper_bgcolor='rgba(0,0,0,0)',
-                                    font=dict(family="Inter", size=11),
-                                    title_font_size=14,
-                                    showlegend=False
-                                )
+
+                                def build_figure():
+                                    fig = px.bar(demo_data, x=col_name, y='Purchasers',
+                                               title=f'{col_name} Distribution',
+                                               color='Purchasers',
+                                               color_continuous_scale=COLOR_PALETTES[palette_key])
+                                    fig.update_layout(
+                                        plot_bgcolor='rgba(0,0,0,0)',
+                                        paper_bgcolor='rgba(0,0,0,0)',
+                                        font=dict(family="Inter", size=11),
+                                        title_font_size=14,
+                                        showlegend=False
+                                    )
+                                    return fig
+
+                                fig = cached_figure(dataset_id, 'insights_demographic', col_name, (palette_key,), build_figure)
                                 st.plotly_chart(fig, use_container_width=True)
                                 color_idx += 1
                         except:
@@ -2373,49 +1369,61 @@ def show_detailed_insights(df, title="Data"):
     col1, col2 = st.columns(2)
     
     with col1:
-        fig = px.histogram(df, x='Conversion %', nbins=30,
-                          title='Conversion Rate Distribution',
-                          color_discrete_sequence=COLOR_PALETTES['fire'])
-        fig.update_layout(
-            plot_bgcolor='rgba(0,0,0,0)',
-            paper_bgcolor='rgba(0,0,0,0)',
-            font=dict(family="Inter", size=12),
-            title_font_size=16
-        )
-        st.plotly_chart(fig, use_container_width=True)
+        with span('chart:insights_histogram'):
+            def build_histogram():
+                fig = px.histogram(df, x='Conversion %', nbins=30,
+                                  title='Conversion Rate Distribution',
+                                  color_discrete_sequence=COLOR_PALETTES['fire'])
+                fig.update_layout(
+                    plot_bgcolor='rgba(0,0,0,0)',
+                    paper_bgcolor='rgba(0,0,0,0)',
+                    font=dict(family="Inter", size=12),
+                    title_font_size=16
+                )
+                return fig
+
+            fig = cached_figure(dataset_id, 'histogram', 'Conversion %', (30,), build_histogram)
+            st.plotly_chart(fig, use_container_width=True)
         
         st.write("**🏆 Top 10 Converting Combos:**")
         
-        @st.cache_data(ttl=3600, show_spinner=False)  # Cache for 1 hour, no spinner
-        def get_top_10(df):
-            return df.nlargest(10, 'Conversion %')[['Rank', 'Visitors', 'Purchasers', 'Conversion %']].reset_index(drop=True)
-        
-        top_10_cached = get_top_10(df)
+        top_10 = df.iloc[get_top_k(df, dataset_id, 'Conversion %').top(10)]
         st.dataframe(
-            top_10_cached,
+            top_10[['Rank', 'Visitors', 'Purchasers', 'Conversion %']].reset_index(drop=True),
             use_container_width=True,
             hide_index=True,
             height=380
         )
     
     with col2:
-        fig = px.scatter(df, x='Visitors', y='Purchasers', 
-                        color='Conversion %',
-                        title='Visitors vs Purchasers',
-                        hover_data=['Rank'],
-                        color_continuous_scale=COLOR_PALETTES['ocean'])
-        fig.update_layout(
-            plot_bgcolor='rgba(0,0,0,0)',
-            paper_bgcolor='rgba(0,0,0,0)',
-            font=dict(family="Inter", size=12),
-            title_font_size=16
-        )
-        st.plotly_chart(fig, use_container_width=True)
+        with span('chart:insights_scatter'):
+            def build_scatter():
+                # Above the point budget, plot a stratified sample that keeps the top ranks and outliers
+                plot_df = df.iloc[scatter_sample(df)] if len(df) > SCATTER_POINT_BUDGET else df
+                fig = px.scatter(plot_df, x='Visitors', y='Purchasers', 
+                                color='Conversion %',
+                                title='Visitors vs Purchasers',
+                                hover_data=['Rank'],
+                                color_continuous_scale=COLOR_PALETTES['ocean'])
+                fig.update_layout(
+                    plot_bgcolor='rgba(0,0,0,0)',
+                    paper_bgcolor='rgba(0,0,0,0)',
+                    font=dict(family="Inter", size=12),
+                    title_font_size=16
+                )
+                return fig
+
+            fig = cached_figure(dataset_id, 'scatter', 'Purchasers',
+                                ('Visitors', 'Conversion %', SCATTER_POINT_BUDGET), build_scatter)
+            st.plotly_chart(fig, use_container_width=True)
+            if len(df) > SCATTER_POINT_BUDGET:
+                st.caption(f"Showing {len(fig.data[0].x):,} of {len(df):,} combos: the {SCATTER_KEEP_TOP:,} "
+                           f"best-ranked plus a sample spread across the chart")
         
         st.write("**💡 What Visitors Like (High Conversion Insights):**")
         
-        @st.cache_data(ttl=3600, show_spinner=False)
-        def get_high_conversion_insights(df, demographic_cols):
+        @dataset_memo('high_conversion_insights')
+        def get_high_conversion_insights(df, dataset_id, demographic_cols):
             high = df[df['Conversion %'] >= df['Conversion %'].quantile(0.75)]
             insights = []
             for col in demographic_cols[:5]:
@@ -2427,25 +1435,20 @@ def show_detailed_insights(df, title="Data"):
                     pass
             return insights if insights else ["No clear preference detected yet"]
         
-        insights = get_high_conversion_insights(df, demographic_cols)
+        insights = get_high_conversion_insights(df, dataset_id, tuple(demographic_cols))
         for insight in insights:
             st.markdown(f"• {insight}")
 # Top Combos Page
+@timed('page:top_combos')
 def show_top_combos(df):
     st.title("🏆 Top Combos - Full Ranking")
     
-    col1, col2 = st.columns([3, 1])
-    
-    with col1:
-        sort_by = st.selectbox("📊 Sort by", ['Conversion %', 'Purchasers', 'Rank'])
-    with col2:
-        ascending = st.checkbox("⬆️ Ascending order", False)
+    sort_by, ascending = sort_controls('top_combos_table', df, default='Conversion %')
     
-    sorted_df = df.sort_values(by=sort_by, ascending=ascending)
-    
-    st.dataframe(sorted_df, use_container_width=True, height=600)
+    paged_table(df, 'top_combos_table', current_dataset_id(df), sort_by=sort_by, ascending=ascending, height=600)
 
 # Segment Builder
+@timed('page:segment_builder')
 def show_segment_builder(df):
     st.title("🎨 Segment Builder")
     
@@ -2519,14 +1522,16 @@ def show_segment_builder(df):
     with col2:
         st.subheader("📊 Segment Results")
         
-        filtered_data = apply_filters(df, filters)
+        # Resolve the filters on the bitmap index; rows are only copied for the preview/export
+        bitmap_index = get_bitmap_index(df, current_dataset_id(df))
+        segment_positions = bitmap_index.select(filters)
         
         segment_name = st.text_input("💾 Segment Name")
         
-        if len(filtered_data) > 0:
-            total_purchasers = int(filtered_data['Purchasers'].sum())
-            pct_total = (total_purchasers / df['Purchasers'].sum() * 100)
-            avg_conversion = filtered_data['Conversion %'].mean()
+        if len(segment_positions) > 0:
+            total_purchasers = int(bitmap_index.sum('Purchasers', segment_positions))
+            pct_total = (total_purchasers / bitmap_index.sum('Purchasers') * 100)
+            avg_conversion = bitmap_index.mean('Conversion %', segment_positions)
             
             metric1, metric2, metric3 = st.columns(3)
             with metric1:
@@ -2537,6 +1542,7 @@ def show_segment_builder(df):
                 st.metric("📈 Avg Conversion", f"{avg_conversion:.2f}%")
             
             with st.expander("📋 Preview Filtered Data", expanded=True):
+                filtered_data = df.take(segment_positions)
                 st.dataframe(filtered_data, use_container_width=True, height=400)
                 
                 csv_seg = filtered_data.to_csv(index=False)
@@ -2653,7 +1659,7 @@ def show_segment_builder(df):
                         
                         chart_col1, chart_col2 = st.columns(2)
                         
-                        with chart_col1:
+                        with chart_col1, span('chart:segment_purchasers'):
                             # Purchasers comparison bar chart
                             purchasers_chart_data = pd.DataFrame({
                                 'Segment': [seg['name'] for seg in selected_segments],
@@ -2681,7 +1687,7 @@ def show_segment_builder(df):
                             )
                             st.plotly_chart(fig1, use_container_width=True)
                         
-                        with chart_col2:
+                        with chart_col2, span('chart:segment_conversion'):
                             # Conversion rate comparison
                             conversion_chart_data = pd.DataFrame({
                                 'Segment': [seg['name'] for seg in selected_segments],
@@ -2778,8 +1784,10 @@ def show_segment_builder(df):
             # ========== NEW COMPARISON FEATURE ENDS HERE ==========
 
 # Buyer Deep Dive
+@timed('page:deep_dive')
 def show_buyer_deep_dive(df):
     st.title("🔍 Buyer Deep Dive")
+    dataset_id = current_dataset_id(df)
     
     # Add rank selector with slider for easier navigation
     col1, col2 = st.columns([3, 1])
@@ -2806,10 +1814,11 @@ def show_buyer_deep_dive(df):
             combo_rank = jump_rank
     
     if combo_rank:
-        combo_data = df[df['Rank'] == combo_rank]
+        rank_index = get_rank_index(df, dataset_id)
+        combo_position = rank_index.position(combo_rank)
         
-        if len(combo_data) > 0:
-            combo = combo_data.iloc[0]
+        if combo_position is not None:
+            combo = df.iloc[combo_position]
             
             # Header with combo info
             st.markdown(f"### 🎯 Analyzing Combo Rank #{int(combo_rank)}")
@@ -2836,64 +1845,72 @@ def show_buyer_deep_dive(df):
             rank_range = 10
             min_rank = max(1, combo_rank - rank_range)
             max_rank = min(len(df), combo_rank + rank_range)
-            comparison_df = df[(df['Rank'] >= min_rank) & (df['Rank'] <= max_rank)].copy()
+            comparison_df = df.iloc[rank_index.window(min_rank, max_rank)].copy()
             
             # Highlight current combo
-            comparison_df['Highlight'] = comparison_df['Rank'].apply(
-                lambda x: 'Current Combo' if x == combo_rank else 'Other Combos'
-            )
+            comparison_df['Highlight'] = np.where(comparison_df['Rank'].to_numpy() == combo_rank,
+                                                  'Current Combo', 'Other Combos')
             
             # Create two columns for charts
             chart_col1, chart_col2 = st.columns(2)
             
-            with chart_col1:
-                # Visitors comparison chart
-                fig_visitors = px.bar(
-                    comparison_df, 
-                    x='Rank', 
-                    y='Visitors',
-                    color='Highlight',
-                    color_discrete_map={
-                        'Current Combo': '#f5576c',
-                        'Other Combos': '#667eea'
-                    },
-                    title=f'👀 Visitors: Rank {min_rank}-{max_rank}',
-                    hover_data=['Purchasers', 'Conversion %']
-                )
-                fig_visitors.update_layout(
-                    plot_bgcolor='rgba(0,0,0,0)',
-                    paper_bgcolor='rgba(0,0,0,0)',
-                    font=dict(family="Inter", size=12),
-                    showlegend=True,
-                    height=400
-                )
+            with chart_col1, span('chart:deep_dive_visitors'):
+                def build_figure():
+                    # Visitors comparison chart
+                    fig_visitors = px.bar(
+                        comparison_df, 
+                        x='Rank', 
+                        y='Visitors',
+                        color='Highlight',
+                        color_discrete_map={
+                            'Current Combo': '#f5576c',
+                            'Other Combos': '#667eea'
+                        },
+                        title=f'👀 Visitors: Rank {min_rank}-{max_rank}',
+                        hover_data=['Purchasers', 'Conversion %']
+                    )
+                    fig_visitors.update_layout(
+                        plot_bgcolor='rgba(0,0,0,0)',
+                        paper_bgcolor='rgba(0,0,0,0)',
+                        font=dict(family="Inter", size=12),
+                        showlegend=True,
+                        height=400
+                    )
+                    return fig_visitors
+
+                fig_visitors = cached_figure(dataset_id, 'deep_dive_visitors', 'Visitors', (combo_rank,), build_figure)
                 st.plotly_chart(fig_visitors, use_container_width=True)
             
-            with chart_col2:
-                # Purchasers comparison chart
-                fig_purchasers = px.bar(
-                    comparison_df, 
-                    x='Rank', 
-                    y='Purchasers',
-                    color='Highlight',
-                    color_discrete_map={
-                        'Current Combo': '#f5576c',
-                        'Other Combos': '#764ba2'
-                    },
-                    title=f'👥 Purchasers: Rank {min_rank}-{max_rank}',
-                    hover_data=['Visitors', 'Conversion %']
-                )
-                fig_purchasers.update_layout(
-                    plot_bgcolor='rgba(0,0,0,0)',
-                    paper_bgcolor='rgba(0,0,0,0)',
-                    font=dict(family="Inter", size=12),
-                    showlegend=True,
-                    height=400
-                )
+            with chart_col2, span('chart:deep_dive_purchasers'):
+                def build_figure():
+                    # Purchasers comparison chart
+                    fig_purchasers = px.bar(
+                        comparison_df, 
+                        x='Rank', 
+                        y='Purchasers',
+                        color='Highlight',
+                        color_discrete_map={
+                            'Current Combo': '#f5576c',
+                            'Other Combos': '#764ba2'
+                        },
+                        title=f'👥 Purchasers: Rank {min_rank}-{max_rank}',
+                        hover_data=['Visitors', 'Conversion %']
+                    )
+                    fig_purchasers.update_layout(
+                        plot_bgcolor='rgba(0,0,0,0)',
+                        paper_bgcolor='rgba(0,0,0,0)',
+                        font=dict(family="Inter", size=12),
+                        showlegend=True,
+                        height=400
+                    )
+                    return fig_purchasers
+
+                fig_purchasers = cached_figure(dataset_id, 'deep_dive_purchasers', 'Purchasers', (combo_rank,), build_figure)
                 st.plotly_chart(fig_purchasers, use_container_width=True)
-            @st.cache_data(ttl=300)  
-            def build_attributes_df(df, combo, combo_rank):
-                """Builds the attributes dataframe - cached so no flicker"""
+            @dataset_memo('combo_attributes')
+            def build_attributes_df(df, dataset_id, combo_position):
+                """Builds the attributes dataframe - cached per dataset and combo so no flicker"""
+                combo = df.iloc[combo_position]
                 attributes = []
                 ignore_cols = ['Rank', 'Combo Size', 'Visitors', 'Purchasers', 'Conversion %', 'Min Visitors']
 
@@ -2917,55 +1934,63 @@ def show_buyer_deep_dive(df):
             
             chart_col3, chart_col4 = st.columns(2)
             
-            with chart_col3:
-                # Conversion % trend
-                fig_conversion = px.line(
-                    comparison_df, 
-                    x='Rank', 
-                    y='Conversion %',
-                    title=f'📈 Conversion Rate Trend',
-                    markers=True
-                )
-                
-                # Add a scatter point for current combo
-                fig_conversion.add_scatter(
-                    x=[combo_rank],
-                    y=[combo['Conversion %']],
-                    mode='markers',
-                    marker=dict(size=15, color='#f5576c', line=dict(width=2, color='white')),
-                    name='Current Combo',
-                    showlegend=True
-                )
-                
-                fig_conversion.update_layout(
-                    plot_bgcolor='rgba(0,0,0,0)',
-                    paper_bgcolor='rgba(0,0,0,0)',
-                    font=dict(family="Inter", size=12),
-                    height=400
-                )
+            with chart_col3, span('chart:deep_dive_conversion'):
+                def build_figure():
+                    # Conversion % trend
+                    fig_conversion = px.line(
+                        comparison_df, 
+                        x='Rank', 
+                        y='Conversion %',
+                        title=f'📈 Conversion Rate Trend',
+                        markers=True
+                    )
+
+                    # Add a scatter point for current combo
+                    fig_conversion.add_scatter(
+                        x=[combo_rank],
+                        y=[combo['Conversion %']],
+                        mode='markers',
+                        marker=dict(size=15, color='#f5576c', line=dict(width=2, color='white')),
+                        name='Current Combo',
+                        showlegend=True
+                    )
+
+                    fig_conversion.update_layout(
+                        plot_bgcolor='rgba(0,0,0,0)',
+                        paper_bgcolor='rgba(0,0,0,0)',
+                        font=dict(family="Inter", size=12),
+                        height=400
+                    )
+                    return fig_conversion
+
+                fig_conversion = cached_figure(dataset_id, 'deep_dive_conversion', 'Conversion %', (combo_rank,), build_figure)
                 st.plotly_chart(fig_conversion, use_container_width=True)
             
-            with chart_col4:
-                # Visitors vs Purchasers scatter
-                fig_scatter = px.scatter(
-                    comparison_df,
-                    x='Visitors',
-                    y='Purchasers',
-                    color='Highlight',
-                    size='Conversion %',
-                    color_discrete_map={
-                        'Current Combo': '#f5576c',
-                        'Other Combos': '#667eea'
-                    },
-                    title='👥 Visitors vs Purchasers',
-                    hover_data=['Rank', 'Conversion %']
-                )
-                fig_scatter.update_layout(
-                    plot_bgcolor='rgba(0,0,0,0)',
-                    paper_bgcolor='rgba(0,0,0,0)',
-                    font=dict(family="Inter", size=12),
-                    height=400
-                )
+            with chart_col4, span('chart:deep_dive_scatter'):
+                def build_figure():
+                    # Visitors vs Purchasers scatter
+                    fig_scatter = px.scatter(
+                        comparison_df,
+                        x='Visitors',
+                        y='Purchasers',
+                        color='Highlight',
+                        size='Conversion %',
+                        color_discrete_map={
+                            'Current Combo': '#f5576c',
+                            'Other Combos': '#667eea'
+                        },
+                        title='👥 Visitors vs Purchasers',
+                        hover_data=['Rank', 'Conversion %']
+                    )
+                    fig_scatter.update_layout(
+                        plot_bgcolor='rgba(0,0,0,0)',
+                        paper_bgcolor='rgba(0,0,0,0)',
+                        font=dict(family="Inter", size=12),
+                        height=400
+                    )
+                    return fig_scatter
+
+                fig_scatter = cached_figure(dataset_id, 'deep_dive_scatter', 'Purchasers', (combo_rank,), build_figure)
                 st.plotly_chart(fig_scatter, use_container_width=True)
             
             st.divider()
@@ -2976,9 +2001,9 @@ def show_buyer_deep_dive(df):
             st.subheader("🎯 Performance Insights")
             
             # Calculate percentile rankings
-            visitor_percentile = (df['Visitors'] < combo['Visitors']).sum() / len(df) * 100
-            purchaser_percentile = (df['Purchasers'] < combo['Purchasers']).sum() / len(df) * 100
-            conversion_percentile = (df['Conversion %'] < combo['Conversion %']).sum() / len(df) * 100
+            visitor_percentile = rank_index.percentile('Visitors', combo['Visitors'])
+            purchaser_percentile = rank_index.percentile('Purchasers', combo['Purchasers'])
+            conversion_percentile = rank_index.percentile('Conversion %', combo['Conversion %'])
             
             insight_col1, insight_col2, insight_col3 = st.columns(3)
             
@@ -3016,7 +2041,7 @@ def show_buyer_deep_dive(df):
             st.subheader("📋 Complete Combo Attributes")
 
             # Use cached function - this is the magic that stops flickering
-            attr_df = build_attributes_df(df, combo, combo_rank)
+            attr_df = build_attributes_df(df, dataset_id, combo_position)
 
             if not attr_df.empty:
                 # NO 'key' parameter - just pure stable display
@@ -3059,11 +2084,12 @@ def show_buyer_deep_dive(df):
                             demographic_cols.append(col)
 
             if demographic_cols:
+                rollup_cube = get_rollup_cube(df, dataset_id)
                 cols_per_row = 2
                 for i in range(0, len(demographic_cols), cols_per_row):
                     row_cols = st.columns(cols_per_row)
                     for j, col_name in enumerate(demographic_cols[i:i + cols_per_row]):
-                        with row_cols[j]:
+                        with row_cols[j], span('chart:deep_dive_distribution'):
                             actual_value = str(combo[col_name]).strip()
 
                             # Nice title
@@ -3076,51 +2102,54 @@ def show_buyer_deep_dive(df):
                                 unsafe_allow_html=True
                             )
 
-                            # Distribution chart (horizontal for better readability)
-                            value_counts = df[col_name].value_counts().head(10)   # ← Fixed: now defined!
-
-                            fig = px.bar(
-                                x=value_counts.values,
-                                y=value_counts.index.astype(str),
-                                orientation='h',
-                                color=value_counts.values,
-                                color_continuous_scale="purples",
-                                height=340,
-                                labels={'x': 'Number of Combos', 'y': col_name.replace('_', ' ').title()},
-                                hover_data=[]  # We will set custom hover below
-                            )
-                            
-                            # Make hover beautiful and clear
-                            fig.update_traces(
-                                hovertemplate=
-                                "<b>%{y}</b><br>" +
-                                "Combos with this value: <b>%{x}</b><br>" +
-                                "<extra></extra>",  # Removes the ugly "trace 0" box
-                                marker_line_width=[8 if str(idx) == actual_value else 1.5 
-                                                  for idx in value_counts.index],
-                                marker_line_color=["#f5576c" if str(idx) == actual_value else "#ddd"
-                                                  for idx in value_counts.index]
-                            )
-                            
-                            fig.update_layout(
-                                title="",
-                                xaxis_title="Number of Combos Containing This Value",
-                                yaxis_title="",
-                                margin=dict(l=10, r=20, t=20, b=20),
-                                plot_bgcolor='rgba(0,0,0,0)',
-                                paper_bgcolor='rgba(0,0,0,0)',
-                                showlegend=False,
-                                font=dict(family="Inter", size=12)
-                            )
+                            def build_figure():
+                                # Distribution chart (horizontal for better readability)
+                                value_counts = rollup_cube.value_counts(col_name)
+
+                                fig = px.bar(
+                                    x=value_counts.values,
+                                    y=value_counts.index.astype(str),
+                                    orientation='h',
+                                    color=value_counts.values,
+                                    color_continuous_scale="purples",
+                                    height=340,
+                                    labels={'x': 'Number of Combos', 'y': col_name.replace('_', ' ').title()},
+                                    hover_data=[]  # We will set custom hover below
+                                )
 
-                            # Highlight the current combo's value with a thick red border
-                            fig.update_traces(
-                                marker_line_width=[6 if str(idx) == actual_value else 1 
-                                                 for idx in value_counts.index],
-                                marker_line_color=["#f5576c" if str(idx) == actual_value else "#e2e8f0" 
-                                                 for idx in value_counts.index]
-                            )
+                                # Make hover beautiful and clear
+                                fig.update_traces(
+                                    hovertemplate=
+                                    "<b>%{y}</b><br>" +
+                                    "Combos with this value: <b>%{x}</b><br>" +
+                                    "<extra></extra>",  # Removes the ugly "trace 0" box
+                                    marker_line_width=[8 if str(idx) == actual_value else 1.5 
+                                                      for idx in value_counts.index],
+                                    marker_line_color=["#f5576c" if str(idx) == actual_value else "#ddd"
+                                                      for idx in value_counts.index]
+                                )
+
+                                fig.update_layout(
+                                    title="",
+                                    xaxis_title="Number of Combos Containing This Value",
+                                    yaxis_title="",
+                                    margin=dict(l=10, r=20, t=20, b=20),
+                                    plot_bgcolor='rgba(0,0,0,0)',
+                                    paper_bgcolor='rgba(0,0,0,0)',
+                                    showlegend=False,
+                                    font=dict(family="Inter", size=12)
+                                )
+
+                                # Highlight the current combo's value with a thick red border
+                                fig.update_traces(
+                                    marker_line_width=[6 if str(idx) == actual_value else 1 
+                                                     for idx in value_counts.index],
+                                    marker_line_color=["#f5576c" if str(idx) == actual_value else "#e2e8f0" 
+                                                     for idx in value_counts.index]
+                                )
+                                return fig
 
+                            fig = cached_figure(dataset_id, 'deep_dive_distribution', col_name, (actual_value,), build_figure)
                             st.plotly_chart(fig, use_container_width=True)
                             st.caption(f"This combo: **{actual_value}**")
             else:
@@ -3130,34 +2159,99 @@ def show_buyer_deep_dive(df):
             
             
 
+# Attribute Affinity Page
+@timed('page:affinity')
+def show_attribute_affinity(df):
+    st.title("🔗 Attribute Affinity")
+    st.caption("Which attribute values go together among buyers. **Lift** above 1 means two values share more "
+               "purchasers than they would if unrelated; **Conversion Lift** is the pair's conversion rate "
+               "over the overall rate.")
+    dataset_id = current_dataset_id(df)
+    affinity = get_affinity_matrix(df, dataset_id)
+    
+    if affinity.pairs.empty:
+        st.info("Affinity needs at least two attribute columns with values in common")
+        return
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        metric = st.selectbox("📊 Metric", ['Lift', 'Conversion Lift'])
+    with col2:
+        top_values = st.slider("Values shown", 10, 60, 30, 5, help="Attribute values with the most purchasers")
+    with col3:
+        min_purchasers = st.number_input("Min purchasers per pair", min_value=1, value=10, step=1)
+    
+    # ========== HEATMAP ==========
+    st.subheader("🗺️ Affinity Heatmap")
+    with span('chart:affinity_heatmap'):
+        def build_figure():
+            matrix = affinity.matrix(metric, top=top_values, min_purchasers=min_purchasers)
+            fig = px.imshow(matrix, color_continuous_scale='RdBu_r', color_continuous_midpoint=1.0,
+                            aspect='auto', labels=dict(color=metric))
+            fig.update_traces(hovertemplate='<b>%{y}</b><br><b>%{x}</b><br>' + metric + ': %{z:.3f}<extra></extra>')
+            fig.update_layout(
+                plot_bgcolor='rgba(0,0,0,0)',
+                paper_bgcolor='rgba(0,0,0,0)',
+                font=dict(family="Inter", size=11),
+                height=max(500, top_values * 18),
+                xaxis_tickangle=-45
+            )
+            return fig
+
+        fig = cached_figure(dataset_id, 'affinity_heatmap', metric, (top_values, min_purchasers), build_figure)
+        st.plotly_chart(fig, use_container_width=True)
+    st.caption("Blank cells: two values of the same attribute, or pairs below the minimum purchasers")
+    
+    st.divider()
+    
+    # ========== BEST PAIRS ==========
+    st.subheader("🏅 Best Pairs")
+    best_pairs = affinity.best_pairs(by=metric, min_purchasers=min_purchasers)
+    if best_pairs.empty:
+        st.info("No pairs have that many purchasers")
+        return
+    
+    st.dataframe(
+        best_pairs.round({'Conversion %': 2, 'Lift': 3, 'Conversion Lift': 3}),
+        use_container_width=True,
+        hide_index=True,
+        height=400
+    )
+    st.download_button(
+        label="📥 Export Best Pairs",
+        data=best_pairs.to_csv(index=False),
+        file_name=f"best_pairs_{datetime.now().strftime('%Y%m%d')}.csv",
+        mime="text/csv"
+    )
+
 # Uploads Page
+@timed('page:uploads')
 def show_uploads():
     st.title("📤 Upload History")
     
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute('SELECT id, user_email, filename, upload_date, row_count FROM upload_history ORDER BY upload_date DESC')
-    uploads = c.fetchall()
-    conn.close()
+    has_uploads = fetch_uploads_page(limit=1)[0]
     
-    if uploads:
-        upload_df = pd.DataFrame(uploads, columns=['ID', 'User Email', 'Filename', 'Upload Date', 'Row Count'])
-        
-        st.subheader("📊 All Uploads")
-        st.dataframe(upload_df, use_container_width=True)
-        
-        st.divider()
-        
+    if has_uploads:
         st.subheader("🔍 Search Upload History")
-        search_filename = st.text_input("Search by filename")
+        search_filename = st.text_input("Search by filename").strip()
+        
+        # One page at a time, newest first; the filename search runs in SQLite
+        page_key = keyset_pager('uploads_pager', reset_on=search_filename)
+        uploads, next_key = fetch_uploads_page(after=page_key, filename_query=search_filename or None)
+        upload_df = pd.DataFrame(uploads, columns=['Upload Date', 'ID', 'User Email', 'Filename', 'Row Count'])
+        upload_df = upload_df[['ID', 'User Email', 'Filename', 'Upload Date', 'Row Count']]
         
-        if search_filename:
-            filtered_uploads = upload_df[upload_df['Filename'].str.contains(search_filename, case=False, na=False)]
-            st.dataframe(filtered_uploads, use_container_width=True)
+        st.subheader("📊 Matching Uploads" if search_filename else "📊 All Uploads")
+        if upload_df.empty:
+            st.info("No uploads match this filename")
+        else:
+            st.dataframe(upload_df, use_container_width=True)
+        page_controls('uploads_pager', next_key)
         
         st.divider()
         
         st.subheader("👁️ View Stored Upload Data")
+        st.caption("Uploads listed on the page above")
         
         upload_ids = upload_df['ID'].tolist()
         filenames = upload_df['Filename'].tolist()
@@ -3171,27 +2265,36 @@ def show_uploads():
             
             conn = get_db_connection()
             c = conn.cursor()
-            c.execute('SELECT file_data, filename, row_count FROM upload_history WHERE id = ?', (selected_id,))
+            c.execute('SELECT content_hash, file_data, filename, row_count FROM upload_history WHERE id = ?', (selected_id,))
             result = c.fetchone()
             conn.close()
             
-            if result and result[0]:
-                file_data_json, filename, row_count = result
+            if result and (result[0] or result[1]):
+                content_hash, file_data_json, filename, row_count = result
                 
                 try:
-                    stored_df = pd.read_json(file_data_json, orient='records')
+                    if content_hash:
+                        stored_df = load_upload_frame(content_hash)
+                        if stored_df is None:
+                            raise FileNotFoundError(f"stored file for upload {selected_id} is missing")
+                    else:
+                        # Row not migrated yet - fall back to the JSON blob
+                        stored_df = pd.read_json(io.StringIO(file_data_json), orient='records')
+                        content_hash = hashlib.md5(file_data_json.encode()).hexdigest()
                     
                     st.success(f"✅ Loaded stored data from: **{filename}** ({row_count} rows)")
                     
                     with st.expander("📋 Preview Stored Data", expanded=True):
-                        st.dataframe(stored_df, use_container_width=True, height=400)
+                        sort_by, ascending = sort_controls('stored_table', stored_df)
+                        paged_table(stored_df, 'stored_table', content_hash, sort_by=sort_by,
+                                    ascending=ascending, reset_on=selected_id)
                     
                     col1, col2 = st.columns(2)
                     
                     with col1:
                         if st.button("📂 Load This Data as Current Dataset"):
                             st.session_state.data = stored_df
-                            st.session_state.current_file_hash = hashlib.md5(file_data_json.encode()).hexdigest()
+                            st.session_state.current_file_hash = content_hash
                             st.success("✅ Data loaded! Navigate to Home Dashboard to analyze.")
                             st.rerun()
                     
@@ -3205,7 +2308,7 @@ def show_uploads():
                         )
                     
                     if st.button("📊 Create Insights from This Data"):
-                        show_detailed_insights(stored_df, filename)
+                        show_detailed_insights(stored_df, filename, dataset_id=content_hash)
                         
                 except Exception as e:
                     st.error(f"Error loading stored data: {e}")
@@ -3219,31 +2322,52 @@ def show_uploads():
     st.subheader("📤 Upload New File")
     st.caption("Supported formats: CSV files with demographic or purchase data")
     
-    new_file = st.file_uploader(
-        "Choose a CSV file", 
-        type=['csv'], 
-        key='uploads_page_uploader',
-        help="Upload your buyer data CSV file"
-    )
-    
-    if new_file:
+    combine_files = st.checkbox("📚 Combine several files into one dataset", key='uploads_page_combine')
+    append_file = st.session_state.data is not None and not combine_files and st.checkbox(
+        "➕ Append to the current dataset (Shopify / purchase-email exports)", key='uploads_page_append',
+        help="Adds the new rows to the current combos instead of replacing the dataset")
+    
+    if append_file:
+        new_file = st.file_uploader(
+            "Choose a CSV file", 
+            type=['csv'], 
+            key='uploads_page_append_uploader',
+            help="Only the new file is processed; matching combos are updated in place"
+        )
+        data = load_data_append(new_file) if new_file else None
+    elif combine_files:
+        new_files = st.file_uploader(
+            "Choose CSV files", 
+            type=['csv'], 
+            key='uploads_page_multi_uploader',
+            accept_multiple_files=True,
+            help="Files are processed in parallel and their combos merged"
+        )
+        data = load_data_multi(new_files) if new_files else None
+    else:
+        new_file = st.file_uploader(
+            "Choose a CSV file", 
+            type=['csv'], 
+            key='uploads_page_uploader',
+            help="Upload your buyer data CSV file"
+        )
         # Process without excessive messages
-        data = load_data(new_file)
+        data = load_data(new_file) if new_file else None
+    
+    if data is not None:
+        st.session_state.data = data
+        st.balloons()  # Fun success indicator
         
-        if data is not None:
-            st.session_state.data = data
-            st.balloons()  # Fun success indicator
-            
-            # Show quick stats
-            stat_col1, stat_col2, stat_col3 = st.columns(3)
-            with stat_col1:
-                st.metric("✅ Status", "Ready")
-            with stat_col2:
-                st.metric("📊 Rows", f"{len(data):,}")
-            with stat_col3:
-                st.metric("📋 Columns", len(data.columns))
-            
-            st.info("✨ Data loaded! Navigate to **Home Dashboard** to start analyzing.")
+        # Show quick stats
+        stat_col1, stat_col2, stat_col3 = st.columns(3)
+        with stat_col1:
+            st.metric("✅ Status", "Ready")
+        with stat_col2:
+            st.metric("📊 Rows", f"{len(data):,}")
+        with stat_col3:
+            st.metric("📋 Columns", len(data.columns))
+        
+        st.info("✨ Data loaded! Navigate to **Home Dashboard** to start analyzing.")
     
     st.divider()
     
@@ -3255,6 +2379,7 @@ def show_uploads():
         st.rerun()
 
 # Admin Page
+@timed('page:admin')
 def show_admin():
     st.title("⚙️ Admin Panel")
     
@@ -3262,7 +2387,7 @@ def show_admin():
         st.error("❌ You don't have permission to access this page")
         return
     
-    tab1, tab2, tab3 = st.tabs(["👥 Users", "📋 Audit Log", "ℹ️ System Info"])
+    tab1, tab2, tab3, tab4 = st.tabs(["👥 Users", "📋 Audit Log", "ℹ️ System Info", "⏱️ Profiler"])
     
     with tab1:
         st.subheader("👥 User Management")
@@ -3457,15 +2582,15 @@ sender_password = "your-16-char-app-password"
 
     with tab2:
         st.subheader("📋 Audit Log")
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute('SELECT * FROM audit_log ORDER BY timestamp DESC LIMIT 100')
-        logs = c.fetchall()
-        conn.close()
+        get_audit_writer().flush()  # include events still waiting in the writer queue
+        page_key = keyset_pager('audit_pager')
+        logs, next_key = fetch_audit_page(after=page_key)
         
         if logs:
-            logs_df = pd.DataFrame(logs, columns=['ID', 'User Email', 'Action', 'Timestamp', 'Details'])
+            logs_df = pd.DataFrame(logs, columns=['Timestamp', 'ID', 'User Email', 'Action', 'Details'])
+            logs_df = logs_df[['ID', 'User Email', 'Action', 'Timestamp', 'Details']]
             st.dataframe(logs_df, use_container_width=True, height=400)
+            page_controls('audit_pager', next_key)
         else:
             st.info("📝 No audit logs yet")
 
@@ -3490,6 +2615,10 @@ sender_password = "your-16-char-app-password"
         with col3:
             st.metric("📋 Total Audit Logs", total_logs)
         
+        audit_stats = get_audit_writer().stats()
+        st.caption(f"Audit writer: {audit_stats['written']:,} written, {audit_stats['queued']:,} queued, "
+                   f"{audit_stats['failed']:,} failed, {audit_stats['backpressure']:,} written synchronously (queue full)")
+        
         st.divider()
         
         st.info("💡 Email invites work when secrets are configured. Use Gmail + App Password.")
@@ -3512,8 +2641,60 @@ sender_password = "your-16-char-app-password"
         - Enhanced UX/UI elements
         """)
 
+    with tab4:
+        st.subheader("⏱️ Profiler")
+        st.caption(f"Timings are shared by every session of this server process; percentiles cover the "
+                   f"last {ROLLING_WINDOW} samples of each span.")
+        
+        spans = span_snapshot()
+        if spans:
+            st.dataframe(pd.DataFrame(spans), use_container_width=True, hide_index=True, height=400)
+        else:
+            st.info("📝 No spans recorded yet")
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            st.download_button("📥 Export JSON", export_json(), file_name="profiling.json",
+                               mime="application/json", use_container_width=True)
+        with col2:
+            st.button("🗑️ Reset Timings", on_click=reset_spans, use_container_width=True)
+        
+        st.divider()
+        
+        st.subheader("🔬 cProfile")
+        st.caption("Profiles one complete rerun: the one triggered by this button.")
+        st.button("▶️ Profile Next Rerun", on_click=arm_rerun_profile)
+        
+        rerun_profile = st.session_state.get('rerun_profile')
+        if rerun_profile:
+            st.write(f"Captured {rerun_profile['captured_at']} ({rerun_profile['seconds']:.2f}s)")
+            st.code(rerun_profile['report'], language=None)
+            st.download_button("📥 Download .prof", rerun_profile['prof'], file_name="rerun.prof",
+                               mime="application/octet-stream")
+
+def run_app():
+    if not st.session_state.authenticated:
+        show_auth_page()
+    else:
+        show_dashboard()
+
+
+def arm_rerun_profile():
+    # Callbacks run before the rerun they trigger, so that rerun is the one profiled
+    st.session_state.profile_next_rerun = True
+
+
 # Main app logic
-if not st.session_state.authenticated:
-    show_auth_page()
-else:
-    show_dashboard()
+with span('rerun'):
+    if st.session_state.pop('profile_next_rerun', False):
+        with RerunProfile() as profile:
+            run_app()
+        st.session_state.rerun_profile = {
+            'captured_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'seconds': profile.seconds,
+            'report': profile.report(),
+            'prof': profile.dump()
+        }
+        st.rerun()  # the report was stored after the Profiler tab rendered
+    else:
+        run_app()
@@ -0,0 +1,213 @@
+"""
+Headless ingestion: parses a directory of CSV exports without the dashboard.
+
+Every file goes through the same detection and transforms as an upload
+(transforms.smart_load_csv), in worker processes. Each combo table is written
+to the upload store and recorded in upload_history, so it shows up on the
+Uploads page. Parses are also put in the parse cache, so uploading the same
+file in the dashboard later loads instantly.
+
+Re-running over the same directory does not add duplicate history rows: a file
+whose name and processed content are already recorded is skipped.
+
+Usage:
+    python batch_ingest.py exports/ --workers 4
+    python batch_ingest.py exports/ --recursive --merge --user nightly@danhhs.com
+
+Exits with status 1 if any file could not be processed, or with --merge if
+the files do not all have the same attribute columns.
+"""
+import argparse
+import fnmatch
+import hashlib
+import logging
+import os
+import sys
+import time
+from datetime import datetime
+
+from database import DB_PATH, AuditWriter, create_history_indexes, create_tables, get_db_connection
+from events import LoggingSink
+from ingest import PARSER_VERSION
+from storage import (PARSE_CACHE_DIR, UPLOAD_STORE_DIR, get_cached_parse, migrate_upload_history,
+                     put_cached_parse, save_upload_frame)
+from transforms import combo_attribute_columns, merge_combo_frames, parse_paths_parallel
+
+
+BATCH_USER = 'batch@localhost'
+
+HASH_CHUNK_BYTES = 8 * 1024 * 1024
+
+
+def find_csv_files(directory, pattern='*.csv', recursive=False):
+    """Paths of the files in directory matching pattern (case-insensitive), sorted."""
+    pattern = pattern.lower()
+    paths = []
+    for root, dirs, names in os.walk(directory):
+        paths.extend(os.path.join(root, name) for name in names if fnmatch.fnmatch(name.lower(), pattern))
+        if not recursive:
+            break
+    return sorted(paths)
+
+
+def file_md5(path):
+    """MD5 of a file's bytes, the key the dashboard uses for uploads and the parse cache."""
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_CHUNK_BYTES), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def record_batch_upload(df, filename, user_email, db_path=DB_PATH, store_dir=UPLOAD_STORE_DIR):
+    """
+    Stores a combo table and adds its upload_history row, unless the same
+    filename with the same content is already recorded.
+    Returns True if a row was added.
+    """
+    content_hash = save_upload_frame(df, store_dir)
+
+    conn = get_db_connection(db_path)
+    try:
+        c = conn.cursor()
+        c.execute('SELECT 1 FROM upload_history WHERE filename = ? AND content_hash = ? LIMIT 1',
+                  (filename, content_hash))
+        if c.fetchone():
+            return False
+        c.execute('''INSERT INTO upload_history
+                    (user_email, filename, upload_date, row_count, content_hash)
+                    VALUES (?, ?, ?, ?, ?)''',
+                  (user_email, filename, datetime.now().isoformat(), len(df), content_hash))
+        conn.commit()
+        return True
+    finally:
+        conn.close()
+
+
+def ingest_directory(directory, workers=None, pattern='*.csv', recursive=False, merge=False,
+                     user_email=BATCH_USER, db_path=DB_PATH, store_dir=UPLOAD_STORE_DIR,
+                     cache_dir=PARSE_CACHE_DIR, log_events=False):
+    """
+    Parses every matching file in directory and records the results.
+
+    With merge=True the combo tables are merged into one dataset (as a
+    multi-file upload in the dashboard) and recorded as a single upload.
+    With log_events=True each parsed file's pipeline events are written to
+    the `pipeline` logger.
+
+    Returns a list of per-file dicts: path, status, combos, seconds, error.
+    Files that parsed but could not be merged (different attribute columns)
+    get ', not merged' appended to their status and their columns as error.
+    """
+    paths = find_csv_files(directory, pattern, recursive)
+    if not paths:
+        return []
+
+    conn = get_db_connection(db_path)
+    try:
+        create_tables(conn)
+        migrate_upload_history(conn, store_dir)
+        create_history_indexes(conn)
+    finally:
+        conn.close()
+
+    file_hashes = [file_md5(path) for path in paths]
+    frames = [get_cached_parse(file_hash, PARSER_VERSION, cache_dir) for file_hash in file_hashes]
+    results = [{'path': path, 'status': 'cached', 'combos': 0, 'seconds': 0.0, 'error': None}
+               for path in paths]
+
+    pending = [i for i, frame in enumerate(frames) if frame is None]
+    parsed = parse_paths_parallel([paths[i] for i in pending], workers)
+    for i, (path, df, seconds, error, file_events) in zip(pending, parsed):
+        if log_events:
+            sink = LoggingSink(prefix=f'{path} ')
+            for event in file_events:
+                sink.emit(event)
+        frames[i] = df
+        results[i]['seconds'] = seconds
+        if df is None:
+            results[i]['status'] = 'failed'
+            results[i]['error'] = error
+        else:
+            results[i]['status'] = 'parsed'
+            put_cached_parse(file_hashes[i], PARSER_VERSION, df, cache_dir)
+
+    for result, frame in zip(results, frames):
+        result['combos'] = len(frame) if frame is not None else 0
+
+    # Audit rows go to the same database as the uploads
+    audit = AuditWriter(db_path)
+    try:
+        if merge:
+            try:
+                df = merge_combo_frames(frames)
+            except ValueError as e:
+                # Different layouts: nothing is recorded, each file reports its columns
+                logging.error('%s', e)
+                df = None
+                for result, frame in zip(results, frames):
+                    if frame is not None:
+                        result['status'] += ', not merged'
+                        result['error'] = 'attribute columns: ' + ', '.join(combo_attribute_columns(frame))
+            if df is not None:
+                names = [os.path.basename(path) for path, frame in zip(paths, frames) if frame is not None]
+                filename = (f"{len(names)} files: " + ', '.join(names))[:200]
+                if record_batch_upload(df, filename, user_email, db_path, store_dir):
+                    audit.submit(user_email, 'Batch Upload', f'Uploaded file: {filename}, Rows: {len(df)}')
+        else:
+            for result, frame in zip(results, frames):
+                if frame is None:
+                    continue
+                filename = os.path.basename(result['path'])
+                if record_batch_upload(frame, filename, user_email, db_path, store_dir):
+                    audit.submit(user_email, 'Batch Upload', f'Uploaded file: {filename}, Rows: {len(frame)}')
+                else:
+                    result['status'] += ', already recorded'
+    finally:
+        audit.stop()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('directory', help='directory containing the CSV exports')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes (default: one per file, up to the CPU count)')
+    parser.add_argument('--pattern', default='*.csv', help='filename glob (default: *.csv)')
+    parser.add_argument('--recursive', action='store_true', help='include subdirectories')
+    parser.add_argument('--merge', action='store_true', help='merge all files into one dataset')
+    parser.add_argument('--user', default=BATCH_USER, help='user_email recorded for the uploads')
+    parser.add_argument('--db', default=DB_PATH, help='SQLite database (default: %(default)s)')
+    parser.add_argument('--store-dir', default=UPLOAD_STORE_DIR, help='upload store (default: %(default)s)')
+    parser.add_argument('--cache-dir', default=PARSE_CACHE_DIR, help='parse cache (default: %(default)s)')
+    parser.add_argument('--verbose', action='store_true', help='log each file\'s detection and transform events')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, format='%(levelname)s %(message)s')
+
+    if not os.path.isdir(args.directory):
+        parser.error(f"not a directory: {args.directory}")
+
+    start = time.perf_counter()
+    results = ingest_directory(args.directory, workers=args.workers, pattern=args.pattern,
+                               recursive=args.recursive, merge=args.merge, user_email=args.user,
+                               db_path=args.db, store_dir=args.store_dir, cache_dir=args.cache_dir,
+                               log_events=args.verbose)
+    if not results:
+        print(f"No files matching {args.pattern} in {args.directory}")
+        return 0
+
+    for result in results:
+        line = f"{result['status']:<28} {result['combos']:>10,} combos {result['seconds']:>8.2f}s  {result['path']}"
+        if result['error']:
+            line += f"  ({result['error']})"
+        print(line)
+
+    failed = sum(result['status'] == 'failed' or result['status'].endswith('not merged') for result in results)
+    print(f"{len(results) - failed} of {len(results)} files processed in {time.perf_counter() - start:.1f}s")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,390 @@
+"""
+Benchmark: end-to-end smart_load_csv for every upload format.
+
+Writes a synthetic export in each layout detect_csv_format() recognizes, then
+loads it with transforms.smart_load_csv in a fresh process and records wall
+time, per-stage time, peak RSS and rows per second. Every case also checks the
+file is detected as the format it was generated for (see EXPECTED_DETECTION).
+
+With --check-streaming, the row-level formats are also loaded through the
+chunked streaming path and the result must equal the in-memory parse (same
+combos, values and dtypes), so merging the two never splits a combo.
+
+Results are compared against a stored baseline (benchmarks/baseline_formats.json);
+a case regresses when its rows/s drops or its peak RSS grows by more than the
+tolerance. Baselines are machine-specific: save one on the machine that runs
+the comparison.
+
+Usage:
+    python benchmarks/bench_formats.py --rows 1000 100000 1000000
+    python benchmarks/bench_formats.py --formats shopify uuid_enriched --rows 10000000
+    python benchmarks/bench_formats.py --save-baseline
+    python benchmarks/bench_formats.py --check-streaming --rows 100000
+
+Exits with status 1 if a case regresses, fails to load or is misdetected.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_ingest import AGE_RANGES, GENDERS, INCOME_RANGES, STATES, make_combo_frame  # noqa: E402
+
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline_formats.json')
+
+DEFAULT_ROWS = [1_000, 100_000, 1_000_000]
+
+# Allowed slowdown / memory growth against the baseline
+DEFAULT_TOLERANCE = 0.25
+
+# Differences below these are noise, whatever the ratio
+MIN_SECONDS_DELTA = 0.05
+MIN_RSS_DELTA_MB = 16
+
+# Rows generated and written per to_csv call
+WRITE_CHUNK_ROWS = 500_000
+
+CREDIT_RATINGS = ['A', 'B', 'C', 'D', 'E', 'F', 'G']
+MARRIED = ['Y', 'N']
+
+ATTRIBUTE_TABLES = ['AGE_RANGE', 'INCOME_RANGE', 'GENDER', 'PERSONAL_STATE', 'SKIPTRACE_CREDIT_RATING']
+
+
+# ============================================
+# SYNTHETIC EXPORTS
+# ============================================
+
+def _write_frames(f, make_chunk, rows, seed):
+    """Writes rows rows produced chunk by chunk by make_chunk(rng, start, n), header once."""
+    rng = np.random.default_rng(seed)
+    for start in range(0, rows, WRITE_CHUNK_ROWS):
+        n = min(WRITE_CHUNK_ROWS, rows - start)
+        make_chunk(rng, start, n).to_csv(f, header=start == 0, index=False)
+
+
+def _demographics(rng, n):
+    return {
+        'AGE_RANGE': rng.choice(AGE_RANGES, n),
+        'GENDER': rng.choice(GENDERS, n),
+        'INCOME_RANGE': rng.choice(INCOME_RANGES, n),
+    }
+
+
+def _emails(start, n, customers):
+    return pd.Series(np.arange(start, start + n) % customers).map('customer{}@example.com'.format)
+
+
+def _conversion_table(rng, start, n):
+    visitors = rng.integers(40, 5000, n)
+    purchasers = rng.binomial(visitors, 0.04)
+    return pd.DataFrame({
+        'Value': pd.Series(np.arange(start, start + n)).map('V{:08d}'.format),
+        'Visitors': visitors,
+        'Purchasers': purchasers,
+        'Conversion %': pd.Series(np.round(purchasers / visitors * 100, 2)).map('{}%'.format),
+    })
+
+
+def write_combo(f, rows, seed):
+    _write_frames(f, lambda rng, start, n: make_combo_frame(n, seed=seed + start), rows, seed)
+
+
+def write_excel_multi_header(f, rows, seed):
+    f.write('Top Buyer Combos,,,,,,,,,\nMin Visitors: 400,,,,,,,,,\n,,,,,,,,,\n')
+    write_combo(f, rows, seed)
+
+
+def write_multi_table_attributes(f, rows, seed):
+    f.write('Attribute Conversion Tables,,,\nMin Visitors: 40,,,\n')
+    rng = np.random.default_rng(seed)
+    per_table = np.diff(np.linspace(0, rows, len(ATTRIBUTE_TABLES) + 1).astype(int))
+    start = 0
+    for name, n in zip(ATTRIBUTE_TABLES, per_table):
+        f.write(f'{name},,,\n')
+        _conversion_table(rng, start, n).to_csv(f, index=False)
+        f.write(',,,\n')
+        start += n
+
+
+def write_gender_analysis(f, rows, seed):
+    def chunk(rng, start, n):
+        visitors = rng.integers(40, 5000, n)
+        purchasers = rng.binomial(visitors, 0.04)
+        return pd.DataFrame({
+            'Segment': pd.Series(np.arange(start, start + n)).map('S{:08d}'.format),
+            'Attribute Visitors': visitors,
+            'Purchasers': purchasers,
+            'Conversion Rate': pd.Series(np.round(purchasers / visitors * 100, 2)).map('{}%'.format),
+        })
+    _write_frames(f, chunk, rows, seed)
+
+
+def write_purchase_email(f, rows, seed):
+    def chunk(rng, start, n):
+        return pd.DataFrame({
+            'Purchase': rng.integers(1, 4, n),
+            'Email': _emails(start, n, max(rows // 3, 1)),
+            **_demographics(rng, n),
+            'MARRIED': rng.choice(MARRIED, n),
+            'CHILDREN': rng.integers(0, 4, n),
+        })
+    _write_frames(f, chunk, rows, seed)
+
+
+def write_uuid_enriched(f, rows, seed):
+    def chunk(rng, start, n):
+        return pd.DataFrame({
+            'UUID': pd.Series(np.arange(start, start + n)).map('00000000-0000-4000-8000-{:012d}'.format),
+            'FIRST_NAME': rng.choice(['Ann', 'Bob', 'Cy', 'Dee', 'Eve'], n),
+            **_demographics(rng, n),
+            'PERSONAL_STATE': rng.choice(STATES, n),
+            'SKIPTRACE_CREDIT_RATING': rng.choice(CREDIT_RATINGS, n),
+        })
+    _write_frames(f, chunk, rows, seed)
+
+
+def write_shopify(f, rows, seed):
+    def chunk(rng, start, n):
+        return pd.DataFrame({
+            'Name': pd.Series(np.arange(start, start + n)).map('#{}'.format),
+            'Email': _emails(start, n, max(rows // 2, 1)),
+            'Paid at': '2024-01-01 10:00:00 -0500',
+            'Lineitem quantity': rng.integers(1, 4, n),
+            'Lineitem name': rng.choice(['Starter Kit', 'Refill', 'Bundle'], n),
+            'Billing Province': rng.choice(STATES, n),
+            'Shipping Method': rng.choice(['Standard', 'Express'], n),
+        })
+    _write_frames(f, chunk, rows, seed)
+
+
+def write_attribute_conversion(f, rows, seed):
+    _write_frames(f, _conversion_table, rows, seed)
+
+
+# detect_csv_format() checks the gender/analysis layout first, and it claims any
+# table with a Purchasers column, so a plain Value/Visitors/Purchasers table loads
+# through transform_gender_analysis_to_combo
+EXPECTED_DETECTION = {
+    'attribute_conversion': 'gender_analysis',
+}
+
+FORMATS = {
+    'combo': write_combo,
+    'excel_multi_header': write_excel_multi_header,
+    'multi_table_attributes': write_multi_table_attributes,
+    'gender_analysis': write_gender_analysis,
+    'purchase_email': write_purchase_email,
+    'uuid_enriched': write_uuid_enriched,
+    'shopify': write_shopify,
+    'attribute_conversion': write_attribute_conversion,
+}
+
+
+def write_export(path, csv_format, rows, seed=0):
+    with open(path, 'w', newline='') as f:
+        FORMATS[csv_format](f, rows, seed)
+    return os.path.getsize(path)
+
+
+# ============================================
+# MEASUREMENT
+# ============================================
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, kilobytes elsewhere
+    return peak / 1024**2 if sys.platform == 'darwin' else peak / 1024
+
+
+def run_case(path):
+    """Loads one file with smart_load_csv in this process; returns the measurements."""
+    from events import CollectingSink, use_sink
+    from transforms import smart_load_csv
+
+    sink = CollectingSink()
+    start_rss = peak_rss_mb()
+    start = time.perf_counter()
+    with open(path, 'rb') as f, use_sink(sink):
+        df = smart_load_csv(f)
+    seconds = time.perf_counter() - start
+
+    stages = {}
+    detected = None
+    for event in sink.events:
+        if event.level == 'stage':
+            stages[event.stage] = round(stages.get(event.stage, 0) + event.seconds, 4)
+            if event.stage == 'detect':
+                detected = event.message
+    return {
+        'seconds': round(seconds, 4),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'import_rss_mb': round(start_rss, 1),
+        'combos': None if df is None else len(df),
+        'detected': detected,
+        'stages': stages,
+        'error': sink.errors[-1] if df is None and sink.errors else None,
+    }
+
+
+def check_streaming(path):
+    """
+    Differences between the in-memory and the streamed parse of one file
+    (empty if they are identical).
+    """
+    import transforms
+    from transforms import smart_load_csv
+
+    with open(path, 'rb') as f:
+        in_memory = smart_load_csv(f)
+    threshold = transforms.STREAM_THRESHOLD_BYTES
+    transforms.STREAM_THRESHOLD_BYTES = 0
+    try:
+        with open(path, 'rb') as f:
+            streamed = smart_load_csv(f)
+    finally:
+        transforms.STREAM_THRESHOLD_BYTES = threshold
+
+    if in_memory is None or streamed is None:
+        return ['streamed parse failed' if streamed is None else 'in-memory parse failed']
+    problems = [f"{col}: {in_memory[col].dtype} in memory, {streamed[col].dtype} streamed"
+                for col in in_memory.columns if col in streamed.columns and in_memory[col].dtype != streamed[col].dtype]
+    if list(in_memory.columns) != list(streamed.columns):
+        problems.append(f"columns {list(in_memory.columns)} in memory, {list(streamed.columns)} streamed")
+    if not problems:
+        keys = [col for col in in_memory.columns if col not in ('Rank', 'Conversion %')]
+        try:
+            pd.testing.assert_frame_equal(in_memory.sort_values(keys).drop(columns='Rank').reset_index(drop=True),
+                                          streamed.sort_values(keys).drop(columns='Rank').reset_index(drop=True))
+        except AssertionError as e:
+            problems.append(str(e).splitlines()[0])
+    return problems
+
+
+def measure(path):
+    """run_case() in a fresh interpreter, so peak RSS covers this file only."""
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--run-case', path],
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def case_key(csv_format, rows):
+    return f'{csv_format}@{rows}'
+
+
+def compare(result, baseline, tolerance):
+    """Regression messages for one case (empty if within tolerance or no baseline)."""
+    if not baseline:
+        return []
+    problems = []
+    slower = result['seconds'] - baseline['seconds']
+    if result['rows_per_s'] < baseline['rows_per_s'] * (1 - tolerance) and slower > MIN_SECONDS_DELTA:
+        problems.append(f"rows/s {baseline['rows_per_s']:,.0f} -> {result['rows_per_s']:,.0f}")
+    grown = result['peak_rss_mb'] - baseline['peak_rss_mb']
+    if result['peak_rss_mb'] > baseline['peak_rss_mb'] * (1 + tolerance) and grown > MIN_RSS_DELTA_MB:
+        problems.append(f"peak RSS {baseline['peak_rss_mb']:,.0f} -> {result['peak_rss_mb']:,.0f} MB")
+    return problems
+
+
+def machine_info():
+    return {
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def run_streaming_checks(formats, row_counts):
+    from ingest import STREAMING_FORMATS
+
+    failures = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in row_counts:
+            for csv_format in formats:
+                if csv_format not in STREAMING_FORMATS:
+                    continue
+                path = os.path.join(tmp, f'{csv_format}_{rows}.csv')
+                write_export(path, csv_format, rows)
+                problems = check_streaming(path)
+                os.remove(path)
+                failures += bool(problems)
+                print(f"{csv_format:<24} {rows:>10,}  {'; '.join(problems) if problems else 'streamed = in memory'}")
+    return 1 if failures else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--formats', nargs='+', choices=list(FORMATS), default=list(FORMATS))
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROWS)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the baseline')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument('--check-streaming', action='store_true',
+                        help='check the streamed parse of the row-level formats equals the in-memory parse')
+    parser.add_argument('--run-case', metavar='PATH', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        print(json.dumps(run_case(args.run_case)))
+        return 0
+
+    if args.check_streaming:
+        return run_streaming_checks(args.formats, args.rows)
+
+    stored = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            stored = json.load(f)
+    baseline = stored.get('results', {})
+
+    print(f"{'format':<24} {'rows':>10} {'MB':>7} {'seconds':>8} {'rows/s':>11} {'peak MB':>8}  result")
+    results, failures = {}, 0
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in args.rows:
+            for csv_format in args.formats:
+                path = os.path.join(tmp, f'{csv_format}_{rows}.csv')
+                size = write_export(path, csv_format, rows)
+                result = measure(path)
+                os.remove(path)
+
+                result['file_mb'] = round(size / 1024**2, 1)
+                result['rows_per_s'] = round(rows / max(result['seconds'], 1e-9))
+                key = case_key(csv_format, rows)
+                results[key] = result
+
+                if result['combos'] is None:
+                    problems = [f"failed: {result['error']}"]
+                elif result['detected'] != EXPECTED_DETECTION.get(csv_format, csv_format):
+                    problems = [f"detected as {result['detected']}"]
+                else:
+                    problems = compare(result, baseline.get(key), args.tolerance)
+                failures += bool(problems)
+
+                status = '; '.join(problems) if problems else ('ok' if key in baseline else 'ok (no baseline)')
+                print(f"{csv_format:<24} {rows:>10,} {result['file_mb']:>7.1f} {result['seconds']:>8.2f} "
+                      f"{result['rows_per_s']:>11,} {result['peak_rss_mb']:>8.0f}  {status}")
+
+    if args.save_baseline:
+        stored = {'machine': machine_info(), 'results': {**baseline, **results}}
+        with open(args.baseline, 'w') as f:
+            json.dump(stored, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"\nBaseline saved to {args.baseline}")
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,124 @@
+"""
+Benchmark: single-pass CSV ingestion vs the previous multi-read loader.
+
+Generates synthetic combo exports of several sizes, then times
+ingest.read_csv_single_pass against the old strategy (one header=None read
+plus a second read with the chosen header, restarted for every encoding
+that fails). Both paths must produce identical frames.
+
+Usage:
+    python benchmarks/bench_ingest.py --sizes-mb 100 300
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from ingest import ENCODINGS, detect_excel_style_headers, read_csv_single_pass  # noqa: E402
+
+
+AGE_RANGES = ['18-24', '25-34', '35-44', '45-54', '55-64', '65+']
+GENDERS = ['M', 'F', 'U']
+INCOME_RANGES = ['<50K', '50K-75K', '75K-100K', '100K-150K', '150K+']
+STATES = ['CA', 'TX', 'NY', 'FL', 'IL', 'PA', 'OH', 'GA', 'NC', 'MI']
+
+
+def legacy_read_csv(uploaded_file):
+    """The encoding/header loop smart_load_csv used before the single-pass engine."""
+    for encoding in ENCODINGS:
+        try:
+            uploaded_file.seek(0)
+            df_raw = pd.read_csv(uploaded_file, encoding=encoding, low_memory=False, header=None)
+
+            is_excel_style, header_row, metadata = detect_excel_style_headers(df_raw)
+
+            if is_excel_style:
+                uploaded_file.seek(0)
+                return pd.read_csv(uploaded_file, encoding=encoding, low_memory=False, header=None)
+
+            first_row = df_raw.iloc[0].astype(str)
+            first_row_text_count = first_row.str.contains('[A-Za-z]', regex=True, na=False).sum()
+
+            uploaded_file.seek(0)
+            if first_row_text_count <= 2 and len(df_raw) > 1:
+                return pd.read_csv(uploaded_file, encoding=encoding, low_memory=False, header=1)
+            return pd.read_csv(uploaded_file, encoding=encoding, low_memory=False, header=0)
+        except UnicodeDecodeError:
+            continue
+    return None
+
+
+def make_combo_frame(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    visitors = rng.integers(40, 5000, rows)
+    purchasers = rng.binomial(visitors, 0.04)
+    return pd.DataFrame({
+        'Rank': np.arange(1, rows + 1),
+        'Combo Size': rng.integers(1, 6, rows),
+        'Visitors': visitors,
+        'Purchasers': purchasers,
+        'Conversion %': np.round(purchasers / visitors * 100, 2),
+        'Min Visitors': 40,
+        'AGE_RANGE': rng.choice(AGE_RANGES, rows),
+        'GENDER': rng.choice(GENDERS, rows),
+        'INCOME_RANGE': rng.choice(INCOME_RANGES, rows),
+        'STATE': rng.choice(STATES, rows),
+    })
+
+
+def write_variant(path, variant, size_mb):
+    """Writes a synthetic file of roughly size_mb megabytes."""
+    sample = make_combo_frame(10_000).to_csv(index=False).encode()
+    rows = max(1_000, int(size_mb * 1024 * 1024 / (len(sample) / 10_000)))
+    body = make_combo_frame(rows).to_csv(index=False).encode()
+
+    with open(path, 'wb') as f:
+        if variant == 'excel_multi_header':
+            f.write(b'Top Buyer Combos,,,,,,,,,\nMin Visitors: 400,,,,,,,,,\n,,,,,,,,,\n')
+        f.write(body)
+        if variant == 'latin1_tail':
+            # A non UTF-8 byte at the very end forces the encoding fallback
+            f.write('1,1,50,2,4.0,40,18-24,F,<50K,Bogot\xe1\n'.encode('latin1'))
+    return rows
+
+
+def time_loader(loader, raw):
+    buffer = io.BytesIO(raw)
+    start = time.perf_counter()
+    result = loader(buffer)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes-mb', type=float, nargs='+', default=[50, 200])
+    parser.add_argument('--variants', nargs='+', default=['combo', 'excel_multi_header', 'latin1_tail'])
+    args = parser.parse_args()
+
+    print(f"{'variant':<20} {'size MB':>8} {'rows':>10} {'legacy s':>10} {'single s':>10} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size_mb in args.sizes_mb:
+            for variant in args.variants:
+                path = os.path.join(tmp, f'{variant}_{size_mb}.csv')
+                rows = write_variant(path, variant, size_mb)
+                with open(path, 'rb') as f:
+                    raw = f.read()
+
+                legacy_s, legacy_df = time_loader(legacy_read_csv, raw)
+                single_s, (single_df, _) = time_loader(read_csv_single_pass, raw)
+                pd.testing.assert_frame_equal(legacy_df, single_df)
+
+                print(f"{variant:<20} {len(raw) / 1024 / 1024:>8.1f} {rows:>10,} "
+                      f"{legacy_s:>10.2f} {single_s:>10.2f} {legacy_s / single_s:>7.1f}x")
+                os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
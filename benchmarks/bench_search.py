@@ -0,0 +1,66 @@
+"""
+Benchmark: Home Dashboard free-text search, inverted index vs full scan.
+
+Times the old per-keystroke scan (astype(str) + str.contains over every
+column) against analytics.SearchIndex on a synthetic combo table, and
+checks both return the same rows.
+
+Usage:
+    python benchmarks/bench_search.py --rows 1000000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from analytics import SearchIndex  # noqa: E402
+from bench_ingest import make_combo_frame  # noqa: E402
+
+
+QUERIES = ['CA', '25-34', '150K+', '4.5', '1', 'nomatch', '18-24 ca', 'f 55 tx']
+
+
+def scan_search(df, query):
+    """The search the Home Dashboard ran on every rerun, one pass per term."""
+    mask = np.ones(len(df), dtype=bool)
+    for term in query.split():
+        mask &= df.astype(str).apply(
+            lambda x: x.str.contains(term, case=False, na=False, regex=False)).any(axis=1).to_numpy()
+    return mask
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=5, help='index queries per term (best time is reported)')
+    args = parser.parse_args()
+
+    df = make_combo_frame(args.rows)
+
+    start = time.perf_counter()
+    index = SearchIndex(df)
+    print(f"index build: {time.perf_counter() - start:.2f}s for {args.rows:,} rows (once per dataset)\n")
+
+    print(f"{'query':<12} {'hits':>10} {'scan ms':>10} {'index ms':>10} {'speedup':>9}")
+    for query in QUERIES:
+        start = time.perf_counter()
+        expected = scan_search(df, query)
+        scan_ms = (time.perf_counter() - start) * 1000
+
+        best = float('inf')
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            got = index.search(query)
+            best = min(best, (time.perf_counter() - start) * 1000)
+
+        assert (got == expected).all(), query
+        print(f"{query:<12} {int(got.sum()):>10,} {scan_ms:>10.1f} {best:>10.2f} {scan_ms / max(best, 1e-3):>8.0f}x")
+
+
+if __name__ == '__main__':
+    main()
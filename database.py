@@ -0,0 +1,504 @@
+"""
+SQLite connection pool for the dashboard database.
+
+Connections are opened once per process (up to POOL_SIZE idle ones are
+kept) and set up with the PRAGMAs below a single time. Callers keep the
+usual pattern - get_db_connection(), cursor(), commit(), close() - and
+close() hands the connection back to the pool instead of closing it, so
+sqlite3's per-connection statement cache keeps the fixed queries prepared
+across calls.
+
+Audit events are written by a background AuditWriter in batches, so a log
+call only enqueues a row.
+
+Every statement run through a pooled connection is timed as a profiling
+span named after its verb and table (e.g. "sql:SELECT upload_history").
+"""
+import atexit
+import functools
+import queue
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from profiling import record
+
+
+DB_PATH = 'buyers_dashboard.db'
+
+# Idle connections kept per database file
+POOL_SIZE = 8
+
+# Statements sqlite3 keeps prepared per connection
+STATEMENT_CACHE_SIZE = 256
+
+CONNECTION_PRAGMAS = [
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA cache_size=-16000',      # 16 MB page cache
+    'PRAGMA mmap_size=268435456',    # 256 MB memory-mapped I/O
+    'PRAGMA busy_timeout=10000'
+]
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+_SQL_TARGETS = {
+    'SELECT': re.compile(r'\bFROM\s+(\w+)', re.IGNORECASE),
+    'DELETE': re.compile(r'\bFROM\s+(\w+)', re.IGNORECASE),
+    'INSERT': re.compile(r'\bINTO\s+(\w+)', re.IGNORECASE),
+    'UPDATE': re.compile(r'^\s*UPDATE\s+(\w+)', re.IGNORECASE),
+    'CREATE': re.compile(r'\b(?:TABLE|INDEX|TRIGGER)\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)', re.IGNORECASE),
+}
+
+
+@functools.lru_cache(maxsize=512)
+def sql_span_name(sql):
+    """'sql:<VERB> <table>' for a statement (just the verb when there is no table)."""
+    words = sql.split(None, 1)
+    if not words:
+        return 'sql:'
+    verb = words[0].upper()
+    pattern = _SQL_TARGETS.get(verb)
+    match = pattern.search(sql) if pattern else None
+    return f'sql:{verb} {match.group(1)}' if match else f'sql:{verb}'
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that records each execute, plus the fetches that follow it, as a span."""
+
+    _span = 'sql:'
+
+    def execute(self, sql, parameters=()):
+        self._span = sql_span_name(sql)
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            record(self._span, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._span = sql_span_name(sql)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            record(self._span, time.perf_counter() - start)
+
+    def fetchall(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            record(self._span, time.perf_counter() - start)
+
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection whose close() returns it to its pool."""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    # Connection.execute* would bypass cursor(), so route them through it
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def close(self):
+        _release(self)
+
+    def close_for_real(self):
+        super().close()
+
+
+def _pool_for(db_path):
+    with _pools_lock:
+        if db_path not in _pools:
+            _pools[db_path] = queue.LifoQueue(maxsize=POOL_SIZE)
+            # WAL mode is stored in the database file, so it is set once per process
+            conn = _connect(db_path)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.idle = True
+            _pools[db_path].put_nowait(conn)
+        return _pools[db_path]
+
+
+def _connect(db_path):
+    conn = sqlite3.connect(db_path, check_same_thread=False, timeout=10.0,
+                           factory=PooledConnection, cached_statements=STATEMENT_CACHE_SIZE)
+    conn.db_path = db_path
+    conn.idle = False
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def _release(conn):
+    """Puts a connection back in its pool; closes it if the pool is full or it is broken."""
+    if conn.idle:
+        return  # already returned (close() called twice)
+    try:
+        if conn.in_transaction:
+            conn.rollback()
+        conn.idle = True
+        _pools[conn.db_path].put_nowait(conn)
+    except (queue.Full, sqlite3.Error):
+        conn.idle = False
+        conn.close_for_real()
+
+
+def get_db_connection(db_path=DB_PATH):
+    """Get a database connection from the pool (a new one if none is idle)"""
+    try:
+        conn = _pool_for(db_path).get_nowait()
+    except queue.Empty:
+        return _connect(db_path)
+    conn.idle = False
+    return conn
+
+
+def close_all_connections():
+    """Closes every idle pooled connection (called at interpreter exit)."""
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        while True:
+            try:
+                pool.get_nowait().close_for_real()
+            except queue.Empty:
+                break
+
+
+atexit.register(close_all_connections)
+
+
+# ============================================
+# SCHEMA
+# ============================================
+
+def create_tables(conn):
+    """Creates the dashboard's tables if they do not exist yet."""
+    c = conn.cursor()
+
+    # Users table
+    c.execute('''CREATE TABLE IF NOT EXISTS users
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  email TEXT UNIQUE NOT NULL,
+                  password TEXT NOT NULL,
+                  role TEXT DEFAULT 'Viewer',
+                  created_at TEXT,
+                  last_login TEXT)''')
+
+    # Magic links table
+    c.execute('''CREATE TABLE IF NOT EXISTS magic_links
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  email TEXT NOT NULL,
+                  token TEXT UNIQUE NOT NULL,
+                  created_at TEXT,
+                  expires_at TEXT,
+                  used INTEGER DEFAULT 0)''')
+
+    # Audit log table
+    c.execute('''CREATE TABLE IF NOT EXISTS audit_log
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  user_email TEXT,
+                  action TEXT,
+                  timestamp TEXT,
+                  details TEXT)''')
+
+    # Upload history table (frames live in the upload store, addressed by content_hash;
+    # file_data only holds JSON for rows that predate the store)
+    c.execute('''CREATE TABLE IF NOT EXISTS upload_history
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  user_email TEXT,
+                  filename TEXT,
+                  upload_date TEXT,
+                  row_count INTEGER,
+                  file_data TEXT,
+                  content_hash TEXT,
+                  migration_error TEXT)''')
+
+    # Saved segments table
+    c.execute('''CREATE TABLE IF NOT EXISTS saved_segments
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  user_email TEXT,
+                  segment_name TEXT,
+                  filters TEXT,
+                  created_at TEXT)''')
+
+    conn.commit()
+
+
+# ============================================
+# AUDIT LOG WRITER
+# ============================================
+
+# Events waiting to be written; when full, callers write their event themselves
+AUDIT_QUEUE_SIZE = 10000
+
+# A batch is flushed when it has this many events or its oldest event is this old
+AUDIT_BATCH_SIZE = 200
+AUDIT_FLUSH_SECONDS = 1.0
+
+
+class AuditWriter:
+    """
+    Queues audit events and inserts them from one background thread with
+    executemany, one transaction per batch.
+
+    - submit() never touches the database unless the queue is full; those
+      events are written synchronously and counted in `backpressure`
+    - flush() writes everything queued so far and waits for it to commit
+    - the queue is flushed at interpreter exit
+    """
+
+    def __init__(self, db_path=DB_PATH, batch_size=AUDIT_BATCH_SIZE,
+                 flush_seconds=AUDIT_FLUSH_SECONDS, queue_size=AUDIT_QUEUE_SIZE):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stopping = threading.Event()
+
+        self._stats_lock = threading.Lock()
+        self.written = 0
+        self.failed = 0
+        self.backpressure = 0
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+                self._thread.start()
+
+    def submit(self, user_email, action, details=''):
+        row = (user_email, action, datetime.now().isoformat(), details)
+        if self._stopping.is_set():
+            self._write([row])
+            return
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            with self._stats_lock:
+                self.backpressure += 1
+            self._write([row])
+
+    def _take_batch(self):
+        """Blocks for the first event, then collects more until the batch is full or due."""
+        try:
+            batch = [self._queue.get(timeout=self.flush_seconds)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_seconds
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stopping.is_set():
+            batch = self._take_batch()
+            if not batch:
+                continue
+            try:
+                self._write(batch)
+            except Exception as e:
+                # Anything _write() does not handle must not kill the thread (or leave flush() waiting)
+                with self._stats_lock:
+                    self.failed += len(batch)
+                print(f"Audit writer error: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, rows):
+        conn = None
+        try:
+            conn = get_db_connection(self.db_path)
+            conn.executemany('INSERT INTO audit_log (user_email, action, timestamp, details) VALUES (?, ?, ?, ?)',
+                             rows)
+            conn.commit()
+            with self._stats_lock:
+                self.written += len(rows)
+        except sqlite3.Error as e:
+            with self._stats_lock:
+                self.failed += len(rows)
+            print(f"Audit log error: {e}")
+        finally:
+            if conn:
+                conn.close()
+
+    def flush(self):
+        """Writes all queued events now and waits until the writer thread has committed its batch."""
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            for start in range(0, len(batch), self.batch_size):
+                self._write(batch[start:start + self.batch_size])
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+        # A dead writer thread would never finish its batch
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+
+    def stop(self):
+        self._stopping.set()
+        self.flush()
+
+    def stats(self):
+        return {
+            'queued': self._queue.qsize(),
+            'written': self.written,
+            'failed': self.failed,
+            'backpressure': self.backpressure
+        }
+
+
+_audit_writer = AuditWriter()
+atexit.register(_audit_writer.stop)
+
+
+def get_audit_writer():
+    return _audit_writer
+
+
+# ============================================
+# PAGINATED HISTORY QUERIES
+# ============================================
+
+UPLOADS_PAGE_SIZE = 50
+AUDIT_PAGE_SIZE = 100
+
+
+def create_history_indexes(conn):
+    """
+    Indexes behind the newest-first pages and per-user lookups, plus a
+    trigram FTS5 table over upload filenames (kept in sync by triggers).
+    Safe to run on every start.
+    """
+    c = conn.cursor()
+    c.execute('CREATE INDEX IF NOT EXISTS idx_upload_history_date ON upload_history (upload_date, id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_upload_history_user ON upload_history (user_email)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_upload_history_filename ON upload_history (filename COLLATE NOCASE)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_audit_log_timestamp ON audit_log (timestamp, id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_audit_log_user ON audit_log (user_email)')
+    conn.commit()
+
+    if _has_filename_search(conn):
+        return
+    try:
+        c.execute('''CREATE VIRTUAL TABLE upload_history_fts USING fts5
+                     (filename, content='upload_history', content_rowid='id', tokenize='trigram')''')
+    except sqlite3.OperationalError as e:
+        # SQLite built without FTS5 / trigram: searches fall back to LIKE
+        print(f"Filename search index unavailable: {e}")
+        return
+    c.execute('''CREATE TRIGGER IF NOT EXISTS upload_history_fts_insert AFTER INSERT ON upload_history BEGIN
+                     INSERT INTO upload_history_fts (rowid, filename) VALUES (new.id, new.filename);
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS upload_history_fts_delete AFTER DELETE ON upload_history BEGIN
+                     INSERT INTO upload_history_fts (upload_history_fts, rowid, filename)
+                     VALUES ('delete', old.id, old.filename);
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS upload_history_fts_update AFTER UPDATE OF filename ON upload_history BEGIN
+                     INSERT INTO upload_history_fts (upload_history_fts, rowid, filename)
+                     VALUES ('delete', old.id, old.filename);
+                     INSERT INTO upload_history_fts (rowid, filename) VALUES (new.id, new.filename);
+                 END''')
+    c.execute("INSERT INTO upload_history_fts (upload_history_fts) VALUES ('rebuild')")
+    conn.commit()
+
+
+def _has_filename_search(conn):
+    c = conn.cursor()
+    c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'upload_history_fts'")
+    return c.fetchone() is not None
+
+
+def _like_pattern(text):
+    escaped = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+def _keyset_page(conn, sql, params, limit):
+    """Runs a newest-first query fetching limit + 1 rows; returns (rows, key of the next page or None)."""
+    c = conn.cursor()
+    c.execute(sql, params + [limit + 1])
+    rows = c.fetchall()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, rows[-1][0:2]
+
+
+def fetch_uploads_page(after=None, filename_query=None, limit=UPLOADS_PAGE_SIZE, db_path=DB_PATH):
+    """
+    One page of upload history, newest first, optionally limited to filenames
+    containing filename_query (case-insensitive).
+
+    Rows are (upload_date, id, user_email, filename, row_count). `after` is the
+    (upload_date, id) key returned for the previous page.
+    Returns (rows, next_key) where next_key is None on the last page.
+    """
+    conditions, params = [], []
+    if after is not None:
+        conditions.append('(upload_date, id) < (?, ?)')
+        params.extend(after)
+
+    conn = get_db_connection(db_path)
+    try:
+        if filename_query:
+            # Trigram index for terms of 3+ characters, plain LIKE scan otherwise
+            if len(filename_query) >= 3 and _has_filename_search(conn):
+                conditions.append('id IN (SELECT rowid FROM upload_history_fts WHERE upload_history_fts MATCH ?)')
+                params.append('"{}"'.format(filename_query.replace('"', '""')))
+            else:
+                conditions.append("filename LIKE ? ESCAPE '\\'")
+                params.append(_like_pattern(filename_query))
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        return _keyset_page(conn, f'''SELECT upload_date, id, user_email, filename, row_count
+                                      FROM upload_history {where}
+                                      ORDER BY upload_date DESC, id DESC LIMIT ?''', params, limit)
+    finally:
+        conn.close()
+
+
+def fetch_audit_page(after=None, limit=AUDIT_PAGE_SIZE, db_path=DB_PATH):
+    """
+    One page of the audit log, newest first. Rows are (timestamp, id,
+    user_email, action, details); `after` and the returned next_key work like
+    fetch_uploads_page().
+    """
+    conditions, params = [], []
+    if after is not None:
+        conditions.append('(timestamp, id) < (?, ?)')
+        params.extend(after)
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    conn = get_db_connection(db_path)
+    try:
+        return _keyset_page(conn, f'''SELECT timestamp, id, user_email, action, details
+                                      FROM audit_log {where}
+                                      ORDER BY timestamp DESC, id DESC LIMIT ?''', params, limit)
+    finally:
+        conn.close()
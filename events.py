@@ -0,0 +1,193 @@
+"""
+Progress events emitted by the upload pipeline.
+
+The transforms never call a UI. They report what they found and did through
+info() / success() / warning() / error() / detail(), and time their work with
+stage(). Each call becomes an Event handed to the current sink:
+
+- NullSink (the default) drops events, for workers and benchmarks
+- CollectingSink keeps them; the dashboard renders them after the parse and
+  worker processes send them back with their result
+- LoggingSink writes them to the `pipeline` logger, for batch jobs
+
+The sink is held in a context variable, so concurrent dashboard sessions
+(one thread each) never see each other's events:
+
+    sink = CollectingSink()
+    with use_sink(sink):
+        df = smart_load_csv(uploaded_file)
+"""
+import contextlib
+import contextvars
+import logging
+import time
+
+import pandas as pd
+
+import profiling
+
+
+LEVELS = ('info', 'success', 'warning', 'error')
+
+logger = logging.getLogger('pipeline')
+
+
+class Code(str):
+    """Detail item shown as a code block (tracebacks, raw file lines)."""
+
+
+class Event:
+    """
+    One pipeline event.
+
+    level is one of LEVELS, 'detail' (message is a title for `details`, a
+    tuple of DataFrames, Code blocks and plain values) or 'stage' (a finished
+    stage: `seconds` is its duration, `rows` the rows it produced if known and
+    message its note, e.g. the detected format, or else the stage name).
+    """
+
+    __slots__ = ('stage', 'level', 'message', 'rows', 'seconds', 'details', 'expanded', 'at')
+
+    def __init__(self, stage, level, message, rows=None, seconds=None, details=(), expanded=False):
+        self.stage = stage
+        self.level = level
+        self.message = message
+        self.rows = rows
+        self.seconds = seconds
+        self.details = details
+        self.expanded = expanded
+        self.at = time.perf_counter()
+
+    def __repr__(self):
+        return f'Event({self.stage!r}, {self.level!r}, {self.message!r})'
+
+
+class NullSink:
+    """Discards every event."""
+
+    def emit(self, event):
+        pass
+
+
+class CollectingSink(NullSink):
+    """Keeps events in order of emission."""
+
+    def __init__(self):
+        self.events = []
+
+    def emit(self, event):
+        self.events.append(event)
+
+    @property
+    def errors(self):
+        return [event.message for event in self.events if event.level == 'error']
+
+    def stage_timings(self):
+        """(stage, seconds, rows) for every finished stage."""
+        return [(event.stage, event.seconds, event.rows) for event in self.events if event.level == 'stage']
+
+    def stage_note(self, name):
+        """Note of the last finished stage `name` (e.g. the format from 'detect'), or None."""
+        for event in reversed(self.events):
+            if event.level == 'stage' and event.stage == name:
+                return event.message if event.message != name else None
+        return None
+
+
+class LoggingSink(NullSink):
+    """Writes events to a logger; detail payloads are summarized, not dumped."""
+
+    LOG_LEVELS = {'info': logging.INFO, 'success': logging.INFO, 'warning': logging.WARNING,
+                  'error': logging.ERROR, 'detail': logging.DEBUG, 'stage': logging.INFO}
+
+    def __init__(self, log=logger, prefix=''):
+        self.log = log
+        self.prefix = prefix
+
+    def emit(self, event):
+        message = event.message
+        if event.level == 'stage':
+            message = f"{event.stage} finished in {event.seconds:.2f}s"
+            if event.rows is not None:
+                message += f" ({event.rows:,} rows)"
+            if event.message != event.stage:
+                message += f": {event.message}"
+        elif event.level == 'detail':
+            message += ' ' + ', '.join(_describe(item) for item in event.details)
+        self.log.log(self.LOG_LEVELS.get(event.level, logging.INFO), '%s[%s] %s', self.prefix, event.stage, message)
+
+
+def _describe(item):
+    if isinstance(item, pd.DataFrame):
+        return f'<{len(item)} rows x {len(item.columns)} columns>'
+    if isinstance(item, Code):
+        return '<code>'
+    return str(item)
+
+
+_sink = contextvars.ContextVar('pipeline_sink', default=NullSink())
+_stage = contextvars.ContextVar('pipeline_stage', default='load')
+
+
+@contextlib.contextmanager
+def use_sink(sink):
+    """Sends the events emitted inside the block to sink."""
+    token = _sink.set(sink)
+    try:
+        yield sink
+    finally:
+        _sink.reset(token)
+
+
+class _StageRecord:
+    __slots__ = ('rows', 'note')
+
+    def __init__(self):
+        self.rows = None
+        self.note = None
+
+
+@contextlib.contextmanager
+def stage(name):
+    """
+    Tags the events emitted inside the block with stage `name` and emits a
+    'stage' event with its duration when the block exits. Set `.rows` on the
+    yielded record to report how many rows the stage produced, and `.note`
+    for a short outcome (it becomes the stage event's message). The duration
+    is also recorded as profiling span 'pipeline:<name>'.
+    """
+    token = _stage.set(name)
+    record = _StageRecord()
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        seconds = time.perf_counter() - start
+        _stage.reset(token)
+        profiling.record(f'pipeline:{name}', seconds)
+        _sink.get().emit(Event(name, 'stage', record.note or name, rows=record.rows, seconds=seconds))
+
+
+def emit(level, message, rows=None):
+    _sink.get().emit(Event(_stage.get(), level, message, rows=rows))
+
+
+def info(message, rows=None):
+    emit('info', message, rows)
+
+
+def success(message, rows=None):
+    emit('success', message, rows)
+
+
+def warning(message, rows=None):
+    emit('warning', message, rows)
+
+
+def error(message, rows=None):
+    emit('error', message, rows)
+
+
+def detail(title, *items, expanded=False):
+    """Supporting material (column lists, frame previews, tracebacks) shown collapsed under title."""
+    _sink.get().emit(Event(_stage.get(), 'detail', title, details=items, expanded=expanded))
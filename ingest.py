@@ -0,0 +1,523 @@
+"""
+CSV ingestion engine for the buyer dashboard.
+
+Uploaded files are parsed in a single pass: the encoding and the header
+layout are sniffed from a bounded prefix of the raw bytes, then the whole
+file is handed to pandas exactly once.
+
+Row-level exports too large to hold in memory (Shopify orders, purchase
+emails, enriched visitor files) are instead aggregated chunk by chunk into
+combo counts with ComboAccumulator.
+"""
+import codecs
+import re
+
+import numpy as np
+import pandas as pd
+
+
+# Bump whenever detection or transform output changes; cached parses of
+# older versions are ignored and age out of the parse cache
+PARSER_VERSION = 2
+
+# Encodings tried in order (same order the dashboard has always used)
+ENCODINGS = ['utf-8', 'latin1', 'iso-8859-1', 'cp1252']
+
+# How much of the file is used to sniff the encoding
+SNIFF_BYTES = 64 * 1024
+
+# detect_excel_style_headers() never looks past the first 5 rows
+SNIFF_ROWS = 5
+
+# Row-level exports above this size are aggregated in chunks instead of loaded whole
+STREAM_THRESHOLD_BYTES = 256 * 1024 * 1024
+
+# Detected formats whose transform is a plain groupby over rows, so they can be streamed
+STREAMING_FORMATS = ('shopify', 'purchase_email', 'uuid_enriched')
+
+# Rows read to detect the format and pick grouping columns before streaming
+STREAM_SAMPLE_ROWS = 50000
+
+# Rows per chunk while streaming
+STREAM_CHUNK_ROWS = 200000
+
+# Partial group rows kept before they are merged into one table
+STREAM_COMPACT_ROWS = 1000000
+
+# Count metrics stored as integers when every value is whole
+COUNT_METRIC_COLUMNS = ['Rank', 'Combo Size', 'Visitors', 'Purchasers', 'Min Visitors']
+
+# A text column becomes categorical when it has at most this share of distinct values
+MAX_CATEGORY_RATIO = 0.5
+
+
+def detect_excel_style_headers(df):
+    """
+    Detects if CSV has Excel-style multi-row headers with metadata rows above the actual headers
+
+    Pattern to detect:
+    - Row 1: Descriptive text or merged cell content
+    - Row 2: May contain metadata like "Min Visitors: 400"
+    - Row 3: Empty or spacer
+    - Row 4+: Actual column headers
+
+    Returns: (is_excel_style, header_row_index, metadata)
+    """
+    if len(df) < 4:
+        return False, None, {}
+
+    metadata = {}
+
+    # Check first 5 rows for patterns
+    for idx in range(min(5, len(df))):
+        row = df.iloc[idx]
+        row_str = ' '.join(row.astype(str).tolist()).upper()
+
+        # Pattern 1: Check if row contains "RANK" + other combo-related columns
+        if 'RANK' in row_str and 'VISITORS' in row_str and 'PURCHASERS' in row_str:
+            # Found the actual header row!
+            if idx > 0:  # Headers are NOT in first row = Excel style
+                # Extract metadata from rows above
+                for meta_idx in range(idx):
+                    meta_row = df.iloc[meta_idx]
+                    meta_text = ' '.join(meta_row.astype(str).tolist())
+
+                    # Look for "Min Visitors" or similar metadata
+                    if 'MIN' in meta_text.upper() and 'VISITOR' in meta_text.upper():
+                        # Extract the number
+                        numbers = re.findall(r'\d+', meta_text)
+                        if numbers:
+                            metadata['min_visitors'] = int(numbers[0])
+
+                return True, idx, metadata
+
+    return False, None, {}
+
+
+def sniff_encoding(prefix):
+    """
+    Returns the first encoding from ENCODINGS that can decode the byte prefix.
+    A multi-byte character cut off at the end of the prefix is not an error.
+    """
+    for encoding in ENCODINGS:
+        try:
+            codecs.getincrementaldecoder(encoding)().decode(prefix, final=False)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return None
+
+
+def sniff_header(head_df):
+    """
+    Decides which row holds the column names, using only the first rows of the
+    file read with header=None.
+
+    Returns None for Excel-style exports (headers are located later by the
+    transform), 1 for merged two-row headers, otherwise 0.
+    """
+    is_excel_style, _, _ = detect_excel_style_headers(head_df)
+    if is_excel_style:
+        return None
+
+    # Check for merged headers
+    first_row = head_df.iloc[0].astype(str)
+    first_row_text_count = first_row.str.contains('[A-Za-z]', regex=True, na=False).sum()
+
+    if first_row_text_count <= 2 and len(head_df) > 1:
+        return 1
+    return 0
+
+
+def upload_size(uploaded_file):
+    """Size in bytes of an uploaded file (or any seekable file object)."""
+    size = getattr(uploaded_file, 'size', None)
+    if size is None:
+        position = uploaded_file.tell()
+        size = uploaded_file.seek(0, 2)
+        uploaded_file.seek(position)
+    return size
+
+
+def read_csv_single_pass(uploaded_file, nrows=None):
+    """
+    Reads an uploaded CSV with one full parse (or only its first nrows rows).
+
+    Only the first SNIFF_BYTES bytes and SNIFF_ROWS rows are inspected before
+    the real read. If a byte further down the file does not decode, the parse
+    is retried with the next encoding, exactly like the old per-encoding loop.
+
+    Returns (df, encoding), or (None, None) when no encoding works.
+    """
+    uploaded_file.seek(0)
+    prefix = uploaded_file.read(SNIFF_BYTES)
+
+    encoding = sniff_encoding(prefix)
+    if encoding is None:
+        return None, None
+
+    for encoding in ENCODINGS[ENCODINGS.index(encoding):]:
+        try:
+            uploaded_file.seek(0)
+            head_df = pd.read_csv(uploaded_file, encoding=encoding, header=None, nrows=SNIFF_ROWS)
+            header = sniff_header(head_df)
+
+            uploaded_file.seek(0)
+            df = pd.read_csv(uploaded_file, encoding=encoding, low_memory=False, header=header, nrows=nrows)
+            return df, encoding
+        except UnicodeDecodeError:
+            continue
+
+    return None, None
+
+
+def clean_column_names(columns):
+    """Strips line breaks, doubled spaces and punctuation from raw CSV column names."""
+    columns = pd.Index(columns).astype(str)
+    return (columns
+            .str.strip()
+            .str.replace('\n', ' ', regex=False)
+            .str.replace('\r', ' ', regex=False)
+            .str.replace('  ', ' ', regex=True)
+            .str.replace('[^A-Za-z0-9_\s%]', '', regex=True)
+            .str.strip())
+
+
+def clean_raw_frame(df):
+    """
+    Tidies a freshly read CSV: cleans column names, drops empty rows and
+    columns, promotes the first row to the header when most columns are
+    unnamed, and makes column names unique.
+
+    Returns (df, renamed) where renamed is True when columns were renamed
+    beyond clean_column_names() (header promotion or de-duplication).
+    """
+    renamed = False
+    df.columns = clean_column_names(df.columns)
+
+    # Remove empty rows/columns
+    df = df.dropna(axis=1, how='all')
+    df = df.dropna(how='all')
+
+    # Fix unnamed columns
+    unnamed_count = sum(1 for col in df.columns if 'Unnamed' in str(col))
+
+    if unnamed_count > len(df.columns) * 0.5:
+        new_columns = df.iloc[0].astype(str).str.strip().tolist()
+        df.columns = new_columns
+        df = df.iloc[1:].reset_index(drop=True)
+        renamed = True
+
+    # Remove nan columns
+    df = df.loc[:, ~df.columns.astype(str).str.contains('nan|unnamed', case=False, regex=False)]
+    df = df.dropna(axis=1, how='all')
+    df = df.dropna(how='all')
+
+    # Make columns unique
+    if df.columns.duplicated().any():
+        cols = pd.Series(df.columns)
+        for dup in df.columns[df.columns.duplicated(keep=False)]:
+            cols[df.columns.get_loc(dup)] = [f'{dup}_{d_idx}' if d_idx != 0 else dup
+                                            for d_idx in range(sum(df.columns == dup))]
+        df.columns = cols
+        renamed = True
+
+    return df, renamed
+
+
+# Keywords that mark the attribute-name row above each stacked table
+ATTRIBUTE_NAME_KEYWORDS = [
+    'SKIPTRACE', 'DEPARTMENT', 'SENIORITY', 'AGE', 'INCOME',
+    'CREDIT', 'ETHNIC', 'GENDER', 'STATE', 'MARRIED'
+]
+
+# Keywords that end a table's data block when they show up in a data row
+TABLE_STOP_KEYWORDS = [
+    'HOMEOWNER', 'CREDIT', 'ETHNIC', 'MARITAL', 'MARRIED',
+    'CHILDREN', 'EDUCATION', 'VEHICLE', 'LANGUAGE', 'OCCUPATION'
+]
+
+
+def build_row_text(df):
+    """
+    Returns one uppercase string per row: the row's cells joined by spaces,
+    the same text ' '.join(row.astype(str)) gives, built column by column.
+    """
+    if df.shape[1] == 0:
+        return pd.Series('', index=df.index)
+
+    cells = df.astype(str)
+    row_text = cells.iloc[:, 0]
+    for col_idx in range(1, cells.shape[1]):
+        row_text = row_text + ' ' + cells.iloc[:, col_idx]
+    return row_text.str.upper().reset_index(drop=True)
+
+
+def _contains_any(row_text, keywords):
+    return row_text.str.contains('|'.join(re.escape(k) for k in keywords), regex=True).to_numpy()
+
+
+def detect_multi_table_attribute_format(df):
+    """
+    Detects multi-table attribute conversion format where multiple demographic
+    tables are stacked vertically in one CSV.
+
+    Pattern:
+    - Row 1: Main title (e.g., "Attribute Conversion Tables")
+    - Rows 2-X: Metadata rows
+    - Multiple tables, each with:
+      - Attribute name row (e.g., "SKIPTRACE_CREDIT_RATING")
+      - Header row ("Value | Visitors | Purchasers | Conversion %")
+      - Data rows
+
+    Rows are classified with boolean masks over one row-text column, and each
+    table's data_end (first empty row or next attribute name) is computed here
+    so the transform does not have to scan rows again.
+
+    Returns: (is_multi_table, table_starts, metadata)
+    """
+    if len(df) < 10:
+        return False, [], {}
+
+    metadata = {}
+    row_text = build_row_text(df)
+
+    is_name_row = _contains_any(row_text, ATTRIBUTE_NAME_KEYWORDS)
+    is_header_row = (row_text.str.contains('VALUE', regex=False)
+                     & row_text.str.contains('VISITORS', regex=False)
+                     & row_text.str.contains('PURCHASERS', regex=False)).to_numpy()
+
+    # An attribute name row immediately followed by a Value/Visitors/Purchasers header
+    starts = np.flatnonzero(is_name_row[:-1] & is_header_row[1:])
+
+    # Rows that end a data block: blank rows or rows naming another attribute
+    stripped = row_text.str.strip()
+    is_stop_row = ((stripped == '') | (stripped == 'NAN')).to_numpy() | _contains_any(row_text, TABLE_STOP_KEYWORDS)
+    stop_rows = np.flatnonzero(is_stop_row)
+
+    first_col = df.iloc[:, 0]
+    table_starts = []
+    for i, idx in enumerate(starts):
+        idx = int(idx)
+        attribute_name = first_col.iloc[idx] if pd.notna(first_col.iloc[idx]) else f"ATTRIBUTE_{idx}"
+        data_start = idx + 2
+
+        # The table can run at most up to the next table's attribute name row
+        data_end = int(starts[i + 1]) if i + 1 < len(starts) else len(df)
+        next_stop = np.searchsorted(stop_rows, data_start)
+        if next_stop < len(stop_rows):
+            data_end = min(data_end, int(stop_rows[next_stop]))
+
+        table_starts.append({
+            'attribute_name': str(attribute_name).strip(),
+            'header_row': idx + 1,
+            'data_start': data_start,
+            'data_end': max(data_end, data_start)
+        })
+
+    # Extract metadata from top rows if available
+    if len(table_starts) > 0:
+        first_table_start = table_starts[0]['header_row']
+        for meta_idx in range(min(first_table_start, 10)):
+            meta_text = row_text.iloc[meta_idx]
+
+            # Look for "# unique p" or similar metadata
+            if 'UNIQUE' in meta_text:
+                numbers = re.findall(r'\d+', meta_text)
+                if numbers:
+                    metadata['unique_purchasers'] = int(numbers[0])
+
+    is_multi_table = len(table_starts) >= 2
+
+    return is_multi_table, table_starts, metadata
+
+
+def normalize_combo_dtypes(df, max_category_ratio=MAX_CATEGORY_RATIO):
+    """
+    Shrinks a combo frame in memory once, right after parsing.
+
+    - string columns with few distinct values (demographics) -> Categorical
+    - whole-number count metrics -> int32 when they fit (float64 with NaN stays)
+    - other int64 columns -> int32 when they fit
+
+    Fractional metrics such as Conversion % keep float64 so threshold filters
+    compare exactly as before.
+
+    Returns (df, report) where report has bytes_before, bytes_after and the
+    lists of columns converted to categorical and downcast.
+    """
+    report = {
+        'bytes_before': int(df.memory_usage(deep=True).sum()),
+        'categorical': [],
+        'downcast': []
+    }
+    df = df.copy()
+    int32 = np.iinfo(np.int32)
+
+    for col in df.columns:
+        column = df[col]
+        if isinstance(column, pd.DataFrame) or len(column) == 0:
+            continue
+
+        if column.dtype == object:
+            # Only pure-string columns; mixed types stay object for storage fallback
+            if pd.api.types.infer_dtype(column, skipna=True) != 'string':
+                continue
+            if column.nunique(dropna=True) <= max_category_ratio * len(column):
+                df[col] = column.astype('category')
+                report['categorical'].append(col)
+
+        elif pd.api.types.is_integer_dtype(column.dtype) or (
+                col in COUNT_METRIC_COLUMNS and pd.api.types.is_float_dtype(column.dtype)):
+            values = column.to_numpy()
+            if pd.api.types.is_float_dtype(column.dtype):
+                if np.isnan(values).any() or not np.array_equal(values, np.floor(values)):
+                    continue
+            if column.dtype.itemsize > 4 and values.min() >= int32.min and values.max() <= int32.max:
+                df[col] = column.astype(np.int32)
+                report['downcast'].append(col)
+
+    report['bytes_after'] = int(df.memory_usage(deep=True).sum())
+    return df, report
+
+
+# ============================================
+# STREAMING AGGREGATION
+# ============================================
+
+def iter_csv_chunks(uploaded_file, encoding, columns, chunk_rows=STREAM_CHUNK_ROWS):
+    """
+    Yields the file in chunks of chunk_rows rows, keeping only `columns`
+    (names as clean_column_names() spells them), read as text.
+    """
+    wanted = set(columns)
+    uploaded_file.seek(0)
+    head_df = pd.read_csv(uploaded_file, encoding=encoding, header=None, nrows=SNIFF_ROWS)
+    header = sniff_header(head_df)
+
+    uploaded_file.seek(0)
+    reader = pd.read_csv(uploaded_file, encoding=encoding, header=header, chunksize=chunk_rows, dtype=str,
+                         usecols=lambda col: clean_column_names([col])[0] in wanted)
+    for chunk in reader:
+        chunk.columns = clean_column_names(chunk.columns)
+        yield chunk
+
+
+class ComboAccumulator:
+    """
+    Running partial groupby for row-level exports, keyed by the tuple of
+    demographic values (missing values form their own group, like
+    groupby(dropna=False)).
+
+    Per group it keeps the number of rows (Purchasers) and, for visitor_col:
+    - visitor_mode='count': the number of non-missing values
+    - visitor_mode='nunique': the number of distinct values, tracked exactly
+      as (group hash, value hash) pairs of 64-bit ints
+    Partials are merged whenever they grow past compact_rows.
+    """
+
+    def __init__(self, group_cols, visitor_col=None, visitor_mode=None, compact_rows=STREAM_COMPACT_ROWS):
+        self.group_cols = list(group_cols)
+        self.visitor_col = visitor_col
+        self.visitor_mode = visitor_mode if visitor_col is not None else None
+        self.compact_rows = compact_rows
+        self.rows = 0
+        self._partials = []
+        self._partial_rows = 0
+        self._pairs = []
+        self._pair_rows = 0
+
+    def add(self, chunk):
+        self.rows += len(chunk)
+        groups = chunk[self.group_cols]
+        columns = {'Purchasers': np.ones(len(chunk), dtype=np.int64)}
+        if self.visitor_mode == 'count':
+            columns['Visitors'] = chunk[self.visitor_col].notna().to_numpy(dtype=np.int64)
+        partial = (groups.assign(**columns)
+                   .groupby(self.group_cols, dropna=False, sort=False).sum().reset_index())
+        self._partials.append(partial)
+        self._partial_rows += len(partial)
+        if self._partial_rows > self.compact_rows:
+            self._compact_partials()
+
+        if self.visitor_mode == 'nunique':
+            present = chunk[self.visitor_col].notna().to_numpy()
+            pairs = pd.DataFrame({
+                'group': pd.util.hash_pandas_object(groups[present], index=False).to_numpy(),
+                'visitor': pd.util.hash_pandas_object(chunk.loc[present, self.visitor_col], index=False).to_numpy()
+            }).drop_duplicates()
+            self._pairs.append(pairs)
+            self._pair_rows += len(pairs)
+            if self._pair_rows > self.compact_rows:
+                self._compact_pairs()
+
+    def _compact_partials(self):
+        merged = pd.concat(self._partials, ignore_index=True)
+        merged = merged.groupby(self.group_cols, dropna=False, sort=False).sum().reset_index()
+        self._partials = [merged]
+        self._partial_rows = len(merged)
+
+    def _compact_pairs(self):
+        merged = pd.concat(self._pairs, ignore_index=True).drop_duplicates()
+        self._pairs = [merged]
+        self._pair_rows = len(merged)
+
+    def result(self):
+        """One row per group: the group columns, Purchasers and (with a visitor column) Visitors."""
+        if not self._partials:
+            columns = self.group_cols + ['Purchasers'] + (['Visitors'] if self.visitor_mode else [])
+            return pd.DataFrame(columns=columns)
+
+        self._compact_partials()
+        grouped = self._partials[0]
+
+        if self.visitor_mode == 'nunique':
+            pairs = pd.concat(self._pairs, ignore_index=True).drop_duplicates() if self._pairs else \
+                pd.DataFrame({'group': [], 'visitor': []}, dtype=np.uint64)
+            visitors = pairs.groupby('group').size()
+            group_hash = pd.util.hash_pandas_object(grouped[self.group_cols], index=False)
+            grouped['Visitors'] = visitors.reindex(group_hash.to_numpy()).fillna(0).astype(np.int64).to_numpy()
+
+        # Chunks are read as text; give the keys the types a whole-file read would
+        for col in self.group_cols:
+            grouped[col] = infer_text_column(grouped[col])
+        return grouped.sort_values(self.group_cols, na_position='last').reset_index(drop=True)
+
+
+def infer_text_column(column):
+    """
+    The dtype read_csv would have inferred for a column read as text: numbers
+    become int64 (float64 with missing values), True/False become bool, and
+    anything else (including a mix) stays as strings.
+    """
+    present = column.dropna()
+    if present.empty:
+        return column
+    lowered = present.str.lower()
+    if lowered.isin(['true', 'false']).all():
+        mapped = column.str.lower().map({'true': True, 'false': False})
+        return mapped.astype(bool) if len(present) == len(column) else mapped
+    try:
+        return pd.to_numeric(column)
+    except (ValueError, TypeError):
+        return column
+
+
+def aggregate_csv_chunks(uploaded_file, encoding, group_cols, visitor_col=None, visitor_mode=None,
+                         chunk_rows=STREAM_CHUNK_ROWS):
+    """
+    Streams an uploaded CSV through a ComboAccumulator. A byte that does not
+    decode restarts the pass with the next encoding, like read_csv_single_pass().
+
+    Returns (grouped, row_count).
+    """
+    columns = list(group_cols) + ([visitor_col] if visitor_col is not None else [])
+    for encoding in ENCODINGS[ENCODINGS.index(encoding):]:
+        accumulator = ComboAccumulator(group_cols, visitor_col, visitor_mode)
+        try:
+            for chunk in iter_csv_chunks(uploaded_file, encoding, columns, chunk_rows):
+                accumulator.add(chunk)
+        except UnicodeDecodeError:
+            continue
+        return accumulator.result(), accumulator.rows
+    raise ValueError("Could not read file with any encoding")
@@ -0,0 +1,182 @@
+"""
+Named timing spans for the dashboard.
+
+Code paths worth watching are wrapped in span('kind:name') (or decorated
+with @timed('kind:name')); each exit records the elapsed time. Spans are
+kept per process, shared by every session, with the last ROLLING_WINDOW
+samples per name for p50/p95 plus lifetime count/total/max. Kinds in use:
+
+- rerun: one full script run
+- page: a show_* page
+- chart: building and sending one chart
+- build: a per-dataset structure (search index, bitmaps, rollup cube)
+- sql: one SQLite statement, named by verb and table
+- pipeline: an upload parse stage (read, detect, transform, normalize)
+
+RerunProfile wraps cProfile for a one-off capture of a single rerun.
+
+Forked children (the upload parse workers) start with a fresh lock and
+recording off: the fork may happen while another session thread holds the
+lock, and a child's samples would never reach the dashboard anyway.
+"""
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+
+
+# Samples kept per span for the rolling percentiles
+ROLLING_WINDOW = 500
+
+_spans = {}
+_lock = threading.Lock()
+
+# Set to False to make span() and record() no-ops
+enabled = True
+
+
+class SpanStats:
+    """Timings of one span: a rolling sample window plus lifetime totals."""
+
+    __slots__ = ('samples', 'count', 'total', 'max', 'last')
+
+    def __init__(self):
+        self.samples = deque(maxlen=ROLLING_WINDOW)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+        self.last = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+
+def _after_fork_in_child():
+    global _lock, enabled
+    _lock = threading.Lock()
+    _spans.clear()
+    enabled = False
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def record(name, seconds):
+    if not enabled:
+        return
+    with _lock:
+        stats = _spans.get(name)
+        if stats is None:
+            stats = _spans[name] = SpanStats()
+        stats.add(seconds)
+
+
+@contextmanager
+def span(name):
+    """Times the block as one sample of span `name`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def timed(name):
+    """Decorator form of span()."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def span_snapshot():
+    """One dict per span (milliseconds), slowest total first."""
+    with _lock:
+        items = [(name, list(stats.samples), stats.count, stats.total, stats.max, stats.last)
+                 for name, stats in _spans.items()]
+
+    rows = []
+    for name, samples, count, total, longest, last in items:
+        p50, p95 = np.percentile(samples, [50, 95]) if samples else (0.0, 0.0)
+        rows.append({
+            'span': name,
+            'count': count,
+            'p50_ms': round(p50 * 1000, 3),
+            'p95_ms': round(p95 * 1000, 3),
+            'max_ms': round(longest * 1000, 3),
+            'last_ms': round(last * 1000, 3),
+            'total_s': round(total, 3),
+        })
+    rows.sort(key=lambda row: row['total_s'], reverse=True)
+    return rows
+
+
+def export_json():
+    return json.dumps({
+        'exported_at': datetime.now().isoformat(),
+        'pid': os.getpid(),
+        'rolling_window': ROLLING_WINDOW,
+        'spans': span_snapshot()
+    }, indent=2)
+
+
+def reset_spans():
+    with _lock:
+        _spans.clear()
+
+
+class RerunProfile:
+    """
+    cProfile capture of one block (a whole rerun):
+
+        with RerunProfile() as profile:
+            ...
+        text = profile.report()
+    """
+
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+        self.seconds = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.disable()
+        self.seconds = time.perf_counter() - self._start
+        return False
+
+    def report(self, limit=40, sort='cumulative'):
+        """pstats text of the top `limit` functions."""
+        stream = io.StringIO()
+        pstats.Stats(self.profiler, stream=stream).sort_stats(sort).print_stats(limit)
+        return stream.getvalue()
+
+    def dump(self):
+        """Raw .prof bytes (for snakeviz, pstats, etc.)."""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'rerun.prof')
+            self.profiler.dump_stats(path)
+            with open(path, 'rb') as f:
+                return f.read()
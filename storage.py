@@ -0,0 +1,214 @@
+"""
+On-disk storage for processed uploads.
+
+Each processed combo frame is written once as an uncompressed Arrow IPC
+(Feather v2) file named after the SHA-256 of its bytes. SQLite only keeps
+the metadata row plus the content hash, and reloading an upload is a
+memory-mapped read of that file: Arrow reads its buffers straight from the
+page cache. (A compressed file cannot be mapped - every read would allocate
+and decompress the whole table - so the store trades disk space for that.)
+
+The parse cache uses the same file format, keyed by the MD5 of the raw
+uploaded file and the parser version, so re-uploading a file in any
+session skips detection and transforms entirely.
+"""
+import hashlib
+import io
+import os
+import threading
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+
+UPLOAD_STORE_DIR = 'upload_store'
+UPLOAD_COMPRESSION = 'uncompressed'
+
+PARSE_CACHE_DIR = 'parse_cache'
+PARSE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+
+def _to_arrow_table(df):
+    """Converts a frame to Arrow, turning mixed-type object columns into strings."""
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        df = df.copy()
+        for col in df.columns[df.dtypes == object]:
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+        return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def _write_arrow_file(df, path, metadata=None):
+    """Writes a frame to path atomically (temp file + rename), with optional extra schema metadata."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    table = _to_arrow_table(df)
+    if metadata:
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}),
+                                               **{key.encode(): value.encode() for key, value in metadata.items()}})
+    feather.write_feather(table, tmp_path, compression=UPLOAD_COMPRESSION)
+    os.replace(tmp_path, path)
+
+
+def upload_path(content_hash, store_dir=UPLOAD_STORE_DIR):
+    return os.path.join(store_dir, f'{content_hash}.arrow')
+
+
+def save_upload_frame(df, store_dir=UPLOAD_STORE_DIR):
+    """
+    Writes a processed frame to the store and returns its content hash.
+    Identical frames share one file.
+    """
+    sink = io.BytesIO()
+    feather.write_feather(_to_arrow_table(df), sink, compression=UPLOAD_COMPRESSION)
+    payload = sink.getvalue()
+    content_hash = hashlib.sha256(payload).hexdigest()
+
+    path = upload_path(content_hash, store_dir)
+    if not os.path.exists(path):
+        os.makedirs(store_dir, exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+
+    return content_hash
+
+
+def load_upload_frame(content_hash, store_dir=UPLOAD_STORE_DIR):
+    """Memory-maps a stored upload and returns it as a DataFrame (None if missing)."""
+    path = upload_path(content_hash, store_dir)
+    if not os.path.exists(path):
+        return None
+    return feather.read_table(path, memory_map=True).to_pandas()
+
+
+# (database file, store dir) pairs already migrated by this process
+_migrated = set()
+_migrated_lock = threading.Lock()
+
+
+def migrate_upload_history(conn, store_dir=UPLOAD_STORE_DIR):
+    """
+    Adds the content_hash and migration_error columns to upload_history and
+    moves every legacy JSON blob in file_data into the upload store, one row
+    at a time.
+
+    Rows whose JSON cannot be parsed keep their file_data and get the error in
+    migration_error, so later runs do not retry them.
+    Returns the number of rows migrated.
+    """
+    c = conn.cursor()
+    c.execute('PRAGMA table_info(upload_history)')
+    columns = [row[1] for row in c.fetchall()]
+    for column in ['content_hash', 'migration_error']:
+        if column not in columns:
+            c.execute(f'ALTER TABLE upload_history ADD COLUMN {column} TEXT')
+            conn.commit()
+
+    c.execute('''SELECT id FROM upload_history
+                 WHERE content_hash IS NULL AND file_data IS NOT NULL AND migration_error IS NULL''')
+    pending_ids = [row[0] for row in c.fetchall()]
+
+    migrated = 0
+    for upload_id in pending_ids:
+        c.execute('SELECT file_data FROM upload_history WHERE id = ?', (upload_id,))
+        file_data_json = c.fetchone()[0]
+        try:
+            df = pd.read_json(io.StringIO(file_data_json), orient='records')
+        except ValueError as e:
+            print(f"Upload migration skipped id {upload_id}: {e}")
+            c.execute('UPDATE upload_history SET migration_error = ? WHERE id = ?', (str(e)[:500], upload_id))
+            conn.commit()
+            continue
+
+        content_hash = save_upload_frame(df, store_dir)
+        c.execute('UPDATE upload_history SET content_hash = ?, file_data = NULL WHERE id = ?',
+                  (content_hash, upload_id))
+        conn.commit()
+        migrated += 1
+
+    return migrated
+
+
+def migrate_upload_history_once(conn, store_dir=UPLOAD_STORE_DIR):
+    """
+    migrate_upload_history(), run only on the first call per database file
+    and store in this process (the dashboard calls it on every rerun).
+    Returns the number of rows migrated (0 on later calls).
+    """
+    database_file = conn.execute('PRAGMA database_list').fetchone()[2]
+    key = (database_file, os.path.abspath(store_dir))
+    with _migrated_lock:
+        if key in _migrated:
+            return 0
+        migrated = migrate_upload_history(conn, store_dir)
+        _migrated.add(key)
+        return migrated
+
+
+def parse_cache_path(file_hash, parser_version, cache_dir=PARSE_CACHE_DIR):
+    return os.path.join(cache_dir, f'{file_hash}-v{parser_version}.arrow')
+
+
+def get_cached_parse(file_hash, parser_version, cache_dir=PARSE_CACHE_DIR):
+    """
+    Returns the combo frame previously parsed from a file with this MD5, or
+    None on a miss. A hit refreshes the entry's position in the LRU order.
+    The format the file was detected as, if it was stored, is in
+    df.attrs['csv_format'].
+    """
+    path = parse_cache_path(file_hash, parser_version, cache_dir)
+    try:
+        os.utime(path)
+        table = feather.read_table(path, memory_map=True)
+        df = table.to_pandas()
+        csv_format = (table.schema.metadata or {}).get(b'csv_format')
+        if csv_format is not None:
+            df.attrs['csv_format'] = csv_format.decode()
+        return df
+    except FileNotFoundError:
+        return None
+    except (OSError, pa.ArrowException) as e:
+        print(f"Parse cache read error: {e}")
+        return None
+
+
+def put_cached_parse(file_hash, parser_version, df, cache_dir=PARSE_CACHE_DIR,
+                     max_bytes=PARSE_CACHE_MAX_BYTES, csv_format=None):
+    """
+    Stores a parsed combo frame (and the format it was detected as, if
+    given), then evicts least recently used entries over max_bytes.
+    """
+    try:
+        _write_arrow_file(df, parse_cache_path(file_hash, parser_version, cache_dir),
+                          {'csv_format': csv_format} if csv_format else None)
+    except (OSError, pa.ArrowException) as e:
+        print(f"Parse cache write error: {e}")
+        return
+    evict_parse_cache(cache_dir, max_bytes)
+
+
+def evict_parse_cache(cache_dir=PARSE_CACHE_DIR, max_bytes=PARSE_CACHE_MAX_BYTES):
+    """Deletes the least recently used cache files until the cache fits in max_bytes."""
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith('.arrow'):
+            continue
+        try:
+            stat = os.stat(os.path.join(cache_dir, name))
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, name))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except FileNotFoundError:
+            pass
+        total -= size
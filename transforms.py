@@ -0,0 +1,1493 @@
+"""
+Format detection and combo transforms for uploaded CSVs.
+
+smart_load_csv() turns any supported export into the combo table the
+dashboard works on. It never touches a UI: progress, previews and stage
+timings are emitted as events (see events.py) to whatever sink the caller
+installed, and are dropped when there is none.
+
+parse_files_parallel() runs smart_load_csv over several files in a process
+pool (parse_paths_parallel() over files on disk, for batch_ingest.py) and
+merge_combo_frames() combines the results into one combo table.
+append_combo_frame() folds a new day's export into an existing combo table,
+touching only the combos it contains.
+"""
+import io
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_all_start_methods, get_context
+
+import numpy as np
+import pandas as pd
+
+import events
+from events import CollectingSink, Code, use_sink
+from ingest import (STREAM_SAMPLE_ROWS, STREAM_THRESHOLD_BYTES, STREAMING_FORMATS, aggregate_csv_chunks,
+                    clean_raw_frame, detect_excel_style_headers, detect_multi_table_attribute_format,
+                    normalize_combo_dtypes, read_csv_single_pass, upload_size)
+
+
+# ============================================
+# ENHANCED CSV DETECTION AND detect_exc
+# ============================================
+
+def detect_csv_format(df, uploaded_file, multi_table=None):
+    """
+    Detects which format the CSV is and returns format type
+    Supports multiple formats from your images
+
+    multi_table: result of detect_multi_table_attribute_format(df) if the
+    caller already computed it
+    """
+    columns = [col.strip().upper() for col in df.columns]
+    columns_str = ' '.join(columns)
+    
+    # ========== NEW: Check for Excel-style multi-header format FIRST ==========
+    is_excel_style, header_row, metadata = detect_excel_style_headers(df)
+    if is_excel_style:
+        events.info(f"🔧 Detected Excel-style format with headers at row {header_row + 1}")
+        return 'excel_multi_header'
+     # ========== NEW: Check for multi-table attribute format ==========
+    if multi_table is None:
+        multi_table = detect_multi_table_attribute_format(df)
+    is_multi_table, table_starts, metadata = multi_table
+    if is_multi_table:
+        events.info(f"🔧 Detected multi-table format with {len(table_starts)} attribute tables")
+        return 'multi_table_attributes'
+    
+    # Format 4: Original Combo Format (Rank, Combo Size, Visitors, Purchasers) - CHECK FIRST
+    combo_indicators = ['RANK', 'COMBO SIZE', 'VISITORS', 'PURCHASERS']
+    if all(ind in columns for ind in combo_indicators):
+        return 'combo'
+    
+    # Format 2: Gender Analysis Format (Attribute Visitors, Purchasers, Conversion Rate)
+    gender_indicators = ['ATTRIBUTE VISITORS', 'PURCHASERS', 'CONVERSION']
+    if any(ind in columns_str for ind in gender_indicators):
+        return 'gender_analysis'
+    
+    # Format 3: Purchase Email Format (Purchase, Email, Age_Range, Gender)
+    if 'PURCHASE' in columns and any(demo in columns_str for demo in ['AGE_RANGE', 'GENDER', 'INCOME']):
+        return 'purchase_email'
+    
+    # Format 5: UUID Format (with SKIPTRACE, COMPANY fields)
+    if 'UUID' in columns or 'SKIPTRACE' in columns_str or 'FIRST_NAME' in columns:
+        return 'uuid_enriched'
+    
+    # Format 1: Shopify Export Format (Order #, Billing Name, Lineitem, etc.)
+    shopify_indicators = ['ORDER', 'BILLING', 'LINEITEM', 'PAID', 'SHIPPING']
+    if sum(1 for ind in shopify_indicators if ind in columns_str) >= 2:
+        return 'shopify'
+    
+    # Check if it has demographic + numeric data (generic e-commerce/purchase data)
+    has_demographics = any(demo in columns_str for demo in ['AGE', 'GENDER', 'INCOME', 'STATE', 'MARRIED'])
+    has_order_data = any(order in columns_str for order in ['ORDER', 'PURCHASE', 'QUANTITY', 'TOTAL', 'PRICE'])
+    
+    if has_demographics and has_order_data:
+        return 'shopify'  # Treat as shopify-like format
+    
+    if has_demographics:
+        return 'purchase_email'  # Generic demographic data
+    
+    # ========== ADD THIS SECTION HERE (BEFORE 'unknown') ==========
+    # Format 6: Attribute Conversion Table (Value, Visitors, Purchasers, Conversion %)
+    attribute_conversion_indicators = ['VALUE', 'VISITORS', 'PURCHASERS', 'CONVERSION']
+    has_value_col = 'VALUE' in columns or 'ATTRIBUTE VALUE' in columns_str
+    has_metrics = all(ind in columns_str for ind in ['VISITORS', 'PURCHASERS'])
+    
+    # Check if there's a demographic attribute name before the table
+    if has_value_col and has_metrics:
+        return 'attribute_conversion'
+    
+    # Alternative: Check if columns match the exact pattern
+    if len(df.columns) >= 3 and len(df.columns) <= 5:
+        col_names = [c.upper() for c in df.columns if 'NAN' not in str(c).upper()]
+        if any('VALUE' in c for c in col_names) and 'VISITORS' in ' '.join(col_names) and 'PURCHASERS' in ' '.join(col_names):
+            return 'attribute_conversion'
+    # ========== END OF ADDITION ==========
+    
+    return 'unknown'
+
+def fix_duplicate_columns(df):
+    """
+    FIXES DUPLICATE COLUMN NAMES
+    This handles 'nan', 'Unnamed', and duplicate columns
+    """
+    # Step 1: Replace 'nan' strings with empty
+    df.columns = df.columns.astype(str)
+    
+    # Step 2: Remove actual 'nan' and 'Unnamed' columns
+    df = df.loc[:, ~df.columns.str.contains('nan|Unnamed', case=False, na=False)]
+    
+    # Step 3: Make column names unique by adding suffix to duplicates
+    cols = pd.Series(range(len(df.columns)))
+    for dup in df.columns[df.columns.duplicated(keep=False)]:
+        cols[df.columns == dup] = (df.columns == dup).cumsum()
+    df.columns = [f"{x}_{y}" if y != 0 else x for x, y in zip(df.columns, cols)]
+    
+    # Step 4: Drop completely empty columns
+    df = df.loc[:, (df.astype(str).applymap(lambda x: x.strip()) != '').any(axis=0)]
+    
+    return df
+def transform_shopify_to_combo(df, stream=None):
+    """
+    Transforms Shopify export format to combo format
+
+    stream: (uploaded_file, encoding) to aggregate the whole file in chunks;
+    df is then only a sample used to pick the grouping columns
+    """
+    events.info("🔄 Detected Shopify format - transforming to combo format...")
+    
+    # Clean column names
+    df.columns = df.columns.str.strip()
+    
+    # Show what columns we found
+    events.detail("🔍 Columns found in your file", list(df.columns))
+    
+    # Group by demographic attributes and calculate metrics
+    demographic_cols = []
+    for col in df.columns:
+        col_upper = col.upper()
+        if any(keyword in col_upper for keyword in ['AGE_RANGE', 'AGE', 'GENDER', 'MARRIED', 'INCOME_RANGE', 
+                                                      'INCOME', 'NET_WORTH', 'HOMEOWNER', 'CHILDREN', 
+                                                      'STATE', 'PROVINCE', 'CREDIT', 'SKIPTRACE']):
+            demographic_cols.append(col)
+    
+    if not demographic_cols:
+        events.warning("⚠️ No demographic columns found. Searching for any groupable columns...")
+        # Find any non-order columns to group by
+        skip_cols = ['Order #', 'Order', 'Paid at', 'Subtotal', 'Total', 'Discount Code', 
+                     'Discount Amount', 'Shipping Method', 'Order Date', 'Lineitem quantity',
+                     'Lineitem name', 'Lineitem price', 'Quantity', 'Sale Price', 'SKU',
+                     'Billing Phone', 'Shipping Phone', 'Notes', 'Payment Method', 'Tags',
+                     'Phone', 'UUID', 'FIRST_NAME', 'LAST_NAME']
+        
+        for col in df.columns:
+            if col not in skip_cols and not any(skip in col for skip in skip_cols):
+                if df[col].nunique() < len(df) * 0.8:  # Column has some repeated values
+                    demographic_cols.append(col)
+                    if len(demographic_cols) >= 5:  # Limit to 5 columns
+                        break
+    
+    if not demographic_cols:
+        events.error("❌ Could not find any columns to group by. Using first column.")
+        demographic_cols = [df.columns[0]]
+    
+    events.info(f"📊 Grouping by: {', '.join(demographic_cols)}")
+    
+    # Count unique orders/purchases
+    df['_Purchasers'] = 1  # Each row is a purchase
+    
+    # Find a column to count as visitors (prefer Email, Order #, or any unique identifier)
+    visitor_col = None
+    for possible_col in ['Email', 'email', 'Order #', 'Order', df.columns[0]]:
+        if possible_col in df.columns:
+            visitor_col = possible_col
+            break
+    
+    if visitor_col is None:
+        visitor_col = df.columns[0]
+    
+    events.info(f"📈 Using '{visitor_col}' to count visitors")
+    
+    # Group by demographics
+    agg_dict = {'_Purchasers': 'sum'}
+    if visitor_col in df.columns:
+        agg_dict[visitor_col] = 'count'
+    
+    if stream is not None:
+        visitor_mode = 'count' if visitor_col in agg_dict and visitor_col not in demographic_cols else None
+        grouped, row_count = aggregate_csv_chunks(*stream, demographic_cols, visitor_col, visitor_mode)
+    else:
+        grouped = df.groupby(demographic_cols, dropna=False).agg(agg_dict).reset_index()
+        row_count = len(df)
+        
+        grouped.rename(columns={'_Purchasers': 'Purchasers'}, inplace=True)
+        
+        if visitor_col in grouped.columns:
+            grouped.rename(columns={visitor_col: 'Visitors'}, inplace=True)
+    
+    if 'Visitors' not in grouped.columns:
+        grouped['Visitors'] = grouped['Purchasers'] * 20  # Estimate visitors
+    
+    # Calculate conversion
+    grouped['Conversion %'] = (grouped['Purchasers'] / grouped['Visitors'] * 100).round(2)
+    
+    # Add required columns
+    grouped['Rank'] = range(1, len(grouped) + 1)
+    grouped['Combo Size'] = len(demographic_cols)
+    grouped['Min Visitors'] = 40
+    
+    # Sort by conversion
+    grouped = grouped.sort_values('Conversion %', ascending=False).reset_index(drop=True)
+    grouped['Rank'] = range(1, len(grouped) + 1)
+    
+    events.success(f"✅ Transformed {row_count} Shopify orders into {len(grouped)} combo segments!")
+    
+    return grouped
+
+def transform_gender_analysis_to_combo(df):
+    """
+    Transforms Gender/Income analysis format to combo format
+    FIXED: Handles summary rows and duplicate columns properly
+    """
+    events.info("🔄 Detected analysis format - transforming to combo format...")
+    
+    df.columns = df.columns.str.strip()
+    
+    # ========== STEP 1: REMOVE DUPLICATE/NAN COLUMNS ==========
+    # Remove columns named 'nan' or 'Unnamed'
+    df = df.loc[:, ~df.columns.astype(str).str.contains('nan|unnamed', case=False, regex=False)]
+    
+    # Show what columns we found
+    events.detail("🔍 Analysis format columns found", list(df.columns), df.head(3))
+    
+    # ========== STEP 2: IDENTIFY THE GROUPING COLUMN ==========
+    group_col = None
+    skip_columns = ['Attribute Visitors', 'Purchasers', 'Conversion Rate', 'Conversion Visitors', 
+                    'Conversion', 'Conversion [Female]', 'Purchasers [Female]', 'Visitors', 
+                    'Attribute Visitors (Female)', 'Conversion Visitors (Female)', 
+                    'Conversion Visitors [Female]']
+    
+    for col in df.columns:
+        if col not in skip_columns and not any(skip in col for skip in ['Visitors', 'Purchasers', 'Conversion']):
+            group_col = col
+            break
+    
+    if group_col is None:
+        group_col = df.columns[0]
+    
+    events.info(f"📊 Using '{group_col}' as the grouping column")
+    
+    # ========== STEP 3: REMOVE SUMMARY/TOTAL ROWS EARLY ==========
+    # Remove rows with summary values BEFORE processing
+    summary_keywords = ['total', 'sum', 'average', 'conversion (total)', 'grand total', 
+                       'subtotal', 'all', 'overall']
+    
+    if group_col in df.columns:
+        mask = df[group_col].astype(str).str.lower().str.contains('|'.join(summary_keywords), na=False)
+        rows_before = len(df)
+        df = df[~mask]
+        rows_removed = rows_before - len(df)
+        if rows_removed > 0:
+            events.info(f"🗑️ Removed {rows_removed} summary/total rows")
+    
+    # ========== STEP 4: STANDARDIZE COLUMN NAMES ==========
+    column_mapping = {}
+    for col in df.columns:
+        col_upper = col.upper()
+        if 'ATTRIBUTE VISITORS' in col_upper and 'Visitors' not in column_mapping:
+            column_mapping[col] = 'Visitors'
+        elif col_upper == 'PURCHASERS' or (col_upper.startswith('PURCHASERS') and 'Purchasers' not in column_mapping):
+            column_mapping[col] = 'Purchasers'
+        elif 'CONVERSION RATE' in col_upper or col_upper == 'CONVERSION':
+            column_mapping[col] = 'Conversion %'
+    
+    df = df.rename(columns=column_mapping)
+    
+    events.info(f"🔄 Renamed columns to: {list(df.columns)}")
+    
+    # ========== STEP 5: ENSURE VISITORS COLUMN ==========
+    if 'Visitors' not in df.columns:
+        visitor_col = None
+        for col in df.columns:
+            if 'visitor' in col.lower() or 'visits' in col.lower():
+                visitor_col = col
+                break
+        
+        if visitor_col:
+            df.rename(columns={visitor_col: 'Visitors'}, inplace=True)
+            events.info(f"✅ Using '{visitor_col}' as Visitors column")
+        else:
+            events.warning("⚠️ No Visitors column found - will estimate from Purchasers")
+    
+    # ========== STEP 6: ENSURE PURCHASERS COLUMN ==========
+    if 'Purchasers' not in df.columns:
+        purchaser_col = None
+        for col in df.columns:
+            if 'purchaser' in col.lower() and col != group_col:
+                purchaser_col = col
+                break
+        
+        if purchaser_col:
+            df.rename(columns={purchaser_col: 'Purchasers'}, inplace=True)
+            events.info(f"✅ Using '{purchaser_col}' as Purchasers column")
+        else:
+            events.error("❌ Could not find Purchasers column")
+            return None
+    
+    # ========== STEP 7: HANDLE CONVERSION % COLUMN ==========
+    if 'Conversion %' not in df.columns:
+        conversion_col = None
+        for col in df.columns:
+            if 'conversion' in col.lower() and col != group_col:
+                conversion_col = col
+                break
+        
+        if conversion_col:
+            df.rename(columns={conversion_col: 'Conversion %'}, inplace=True)
+            events.info(f"✅ Using '{conversion_col}' as Conversion % column")
+    
+    # ========== STEP 8: CONVERT NUMERIC COLUMNS WITH ERROR HANDLING ==========
+    # Convert Purchasers
+    if 'Purchasers' in df.columns:
+        df['Purchasers'] = pd.to_numeric(df['Purchasers'], errors='coerce')
+    
+    # Convert Visitors
+    if 'Visitors' in df.columns:
+        df['Visitors'] = pd.to_numeric(df['Visitors'], errors='coerce')
+    elif 'Purchasers' in df.columns:
+        # Estimate visitors if not present (assume 5% conversion)
+        df['Visitors'] = (df['Purchasers'] / 0.05).fillna(0).astype(int)
+        events.info("📈 Estimated Visitors column from Purchasers (assuming 5% baseline conversion)")
+    
+    # Handle Conversion % with proper error handling
+    if 'Conversion %' in df.columns:
+        if df['Conversion %'].dtype == 'object':
+            # Clean percentage values more carefully
+            df['Conversion %'] = (df['Conversion %']
+                                 .astype(str)
+                                 .str.replace('%', '', regex=False)
+                                 .str.replace(',', '', regex=False)
+                                 .str.strip())
+            # Convert to numeric, coercing errors to NaN
+            df['Conversion %'] = pd.to_numeric(df['Conversion %'], errors='coerce')
+        else:
+            df['Conversion %'] = pd.to_numeric(df['Conversion %'], errors='coerce')
+    else:
+        # Calculate conversion if we have both Visitors and Purchasers
+        if 'Visitors' in df.columns and 'Purchasers' in df.columns:
+            df['Conversion %'] = (df['Purchasers'] / df['Visitors'] * 100).round(2)
+            events.info("📊 Calculated Conversion % from Visitors and Purchasers")
+    
+    # ========== STEP 9: REMOVE ROWS WITH MISSING CRITICAL DATA ==========
+    rows_before = len(df)
+    df = df.dropna(subset=['Purchasers'])
+    
+    # Also remove rows where Conversion % couldn't be converted
+    if 'Conversion %' in df.columns:
+        df = df.dropna(subset=['Conversion %'])
+    
+    rows_after = len(df)
+    if rows_before - rows_after > 0:
+        events.info(f"🗑️ Removed {rows_before - rows_after} rows with invalid data")
+    
+    # ========== STEP 10: ADD REQUIRED COLUMNS ==========
+    df['Combo Size'] = 1
+    df['Min Visitors'] = 40
+    
+    # Rename the group column to a standard name if it exists
+    if group_col and group_col in df.columns:
+        df.rename(columns={group_col: 'Attribute'}, inplace=True)
+    
+    # ========== STEP 11: FINAL CLEANUP - REMOVE ANY REMAINING SUMMARY ROWS ==========
+    if 'Attribute' in df.columns:
+        df = df[~df['Attribute'].astype(str).str.contains('Total|total|TOTAL|conversion', 
+                                                         na=False, case=False, regex=True)]
+    
+    # ========== STEP 12: SORT AND RANK ==========
+    if 'Conversion %' in df.columns and len(df) > 0:
+        df = df.sort_values('Conversion %', ascending=False).reset_index(drop=True)
+    
+    df['Rank'] = range(1, len(df) + 1)
+    
+    # ========== STEP 13: FINAL VALIDATION ==========
+    if len(df) == 0:
+        events.error("❌ No valid data rows found after cleaning")
+        return None
+    
+    events.success(f"✅ Transformed analysis data into {len(df)} combo segments!")
+    
+    # Show final structure
+    events.detail("✅ Final transformed data preview", df.head(5))
+    
+    return df
+
+def transform_purchase_email_to_combo(df, stream=None):
+    """
+    Transforms Purchase/Email format to combo format
+    FIXED VERSION - Creates proper top combos table
+
+    stream: (uploaded_file, encoding) to aggregate the whole file in chunks;
+    df is then only a sample used to pick the grouping columns
+    """
+    events.info("🔄 Detected purchase/demographic data - transforming to combo format...")
+    
+    # Clean column names
+    df.columns = df.columns.str.strip()
+    
+    if stream is None:
+        events.info(f"📊 Found {len(df)} purchase records")
+    
+    # ========== IDENTIFY DEMOGRAPHIC COLUMNS ==========
+    demographic_keywords = [
+        'AGE', 'GENDER', 'INCOME', 'STATE', 'MARRIED', 'CHILDREN', 
+        'HOMEOWNER', 'HOME_OWNER', 'CREDIT', 'NET_WORTH', 
+        'EDUCATION', 'OCCUPATION', 'ETHNICITY'
+    ]
+    
+    demographic_cols = []
+    skip_cols = ['Purchase', 'Email', 'Order', 'Paid', 'Subtotal', 'Total', 
+                 'Discount', 'Shipping', 'Billing', 'Lineitem', 'Quantity',
+                 'Product', 'Sale', 'Price', 'SKU', 'Zip', 'Phone', 'Notes',
+                 'UUID', 'FIRST_NAME', 'LAST_NAME', 'ADDRESS', 'CITY']
+    
+    for col in df.columns:
+        col_upper = col.upper()
+        # Check if column matches demographic keywords and isn't in skip list
+        if any(keyword in col_upper for keyword in demographic_keywords):
+            if not any(skip in col_upper for skip in skip_cols):
+                demographic_cols.append(col)
+    
+    # If no demographics found, try to find ANY categorical columns
+    if not demographic_cols:
+        events.warning("⚠️ No demographic columns detected. Using all categorical columns...")
+        for col in df.columns:
+            if col not in skip_cols and df[col].dtype == 'object':
+                if df[col].nunique() < len(df) * 0.8:  # Has some repeated values
+                    demographic_cols.append(col)
+                    if len(demographic_cols) >= 5:
+                        break
+    
+    # Fallback: use first 3 columns if still nothing found
+    if not demographic_cols:
+        demographic_cols = [df.columns[0], df.columns[1], df.columns[2]]
+        events.warning(f"⚠️ Using first 3 columns: {', '.join(demographic_cols)}")
+    else:
+        # Limit to top 5 most important demographics
+        demographic_cols = demographic_cols[:5]
+    
+    events.info(f"📊 Grouping by these attributes: **{', '.join(demographic_cols)}**")
+    
+    # ========== COUNT PURCHASES AND VISITORS ==========
+    # Each row = 1 purchase
+    df['_temp_purchase'] = 1
+    
+    # Count unique emails as visitors
+    if 'Email' in df.columns:
+        visitor_col = 'Email'
+    elif 'email' in df.columns:
+        visitor_col = 'email'
+    else:
+        # Use first column if no email column
+        visitor_col = df.columns[0]
+        events.info(f"📧 No email column found, using '{visitor_col}' to count visitors")
+    
+    # ========== GROUP BY DEMOGRAPHICS ==========
+    if stream is not None:
+        grouped, row_count = aggregate_csv_chunks(*stream, demographic_cols, visitor_col, 'nunique')
+    else:
+        grouped = df.groupby(demographic_cols, dropna=False).agg({
+            '_temp_purchase': 'sum',           # Count purchases
+            visitor_col: 'nunique'              # Count unique visitors
+        }).reset_index()
+        row_count = len(df)
+        
+        # Rename columns
+        grouped.rename(columns={
+            '_temp_purchase': 'Purchasers',
+            visitor_col: 'Visitors'
+        }, inplace=True)
+    
+    # ========== CALCULATE CONVERSION RATE ==========
+    grouped['Conversion %'] = (grouped['Purchasers'] / grouped['Visitors'] * 100).round(2)
+    
+    # ========== ADD REQUIRED COLUMNS ==========
+    grouped['Combo Size'] = len(demographic_cols)
+    grouped['Min Visitors'] = 40
+    
+    # ========== SORT BY CONVERSION RATE ==========
+    grouped = grouped.sort_values('Conversion %', ascending=False).reset_index(drop=True)
+    
+    # ========== ADD RANK ==========
+    grouped['Rank'] = range(1, len(grouped) + 1)
+    
+    # ========== REORDER COLUMNS (RANK FIRST) ==========
+    cols = ['Rank', 'Combo Size', 'Visitors', 'Purchasers', 'Conversion %', 'Min Visitors'] + demographic_cols
+    grouped = grouped[cols]
+    
+    events.success(f"✅ Created {len(grouped)} combo segments from {row_count} purchase records!")
+    
+    # Show preview
+    events.detail("✅ Preview of Top 5 Combos", grouped.head(5))
+    
+    return grouped
+
+def transform_uuid_to_combo(df, stream=None):
+    """
+    Transforms UUID/enriched data format to combo format
+
+    stream: (uploaded_file, encoding) to aggregate the whole file in chunks;
+    df is then only a sample used to pick the grouping columns
+    """
+    events.info("🔄 Detected enriched data format - transforming to combo format...")
+    
+    df.columns = df.columns.str.strip()
+    
+    # Select key demographic columns
+    demographic_cols = []
+    priority_cols = ['AGE_RANGE', 'GENDER', 'INCOME_RANGE', 'NET_WORTH', 'MARRIED', 
+                     'HOMEOWNER', 'CHILDREN', 'PERSONAL_STATE', 'COMPANY_INDUSTRY',
+                     'SKIPTRACE_CREDIT_RATING', 'SKIPTRACE_ETHNIC_CODE']
+    
+    for col in priority_cols:
+        if col in df.columns:
+            demographic_cols.append(col)
+    
+    if not demographic_cols:
+        # Fallback to any demographic-like columns
+        for col in df.columns:
+            if any(keyword in col.upper() for keyword in ['AGE', 'GENDER', 'INCOME', 'STATE']):
+                demographic_cols.append(col)
+    
+    if not demographic_cols:
+        events.warning("⚠️ No demographic columns found. Using first available column.")
+        demographic_cols = [df.columns[0]]
+    
+    # Limit to top 5 demographic attributes
+    demographic_cols = demographic_cols[:5]
+    
+    # Group by demographics
+    if stream is not None:
+        grouped, row_count = aggregate_csv_chunks(*stream, demographic_cols)
+    else:
+        grouped = df.groupby(demographic_cols, dropna=False).size().reset_index(name='Purchasers')
+        row_count = len(df)
+    
+    # Estimate visitors (assume 5% conversion rate baseline)
+    grouped['Visitors'] = (grouped['Purchasers'] / 0.05).astype(int)
+    
+    # Calculate conversion
+    grouped['Conversion %'] = (grouped['Purchasers'] / grouped['Visitors'] * 100).round(2)
+    
+    # Add required columns
+    grouped['Rank'] = range(1, len(grouped) + 1)
+    grouped['Combo Size'] = len(demographic_cols)
+    grouped['Min Visitors'] = 40
+    
+    # Sort by conversion
+    grouped = grouped.sort_values('Conversion %', ascending=False).reset_index(drop=True)
+    grouped['Rank'] = range(1, len(grouped) + 1)
+    
+    events.success(f"✅ Transformed {row_count} enriched records into {len(grouped)} combo segments!")
+    
+    return grouped
+def transform_attribute_conversion_to_combo(df):
+    """
+    Transforms Attribute Conversion Tables to combo format
+    
+    Input format (from your images):
+    - Column 1: "Value" (e.g., A, U, B for Credit Rating)
+    - Column 2: "Visitors" 
+    - Column 3: "Purchasers"
+    - Column 4: "Conversion %"
+    
+    The attribute name (like SKIPTRACE_CREDIT_RATING) is often in a row above the headers
+    """
+    events.info("🔄 Detected Attribute Conversion Table format - transforming...")
+    
+    # Clean column names
+    df.columns = df.columns.str.strip().str.upper()
+    
+    events.detail("🔍 Detected Attribute Conversion Table", "**Columns found:**", list(df.columns), df.head(10))
+    
+    # Try to detect the attribute name from the data
+    # Often it's in the first few rows or in the filename
+    attribute_name = "DEMOGRAPHIC_ATTRIBUTE"
+    
+    # Check if first row contains the attribute name (common pattern)
+    first_row_text = ' '.join(df.iloc[0].astype(str).tolist()).upper()
+    if any(keyword in first_row_text for keyword in ['SKIPTRACE', 'AGE', 'CREDIT', 'ETHNIC', 'INCOME']):
+        # Found attribute name in first row - extract it
+        potential_name = df.iloc[0, 0] if pd.notna(df.iloc[0, 0]) else "ATTRIBUTE"
+        attribute_name = str(potential_name).strip().replace(' ', '_').upper()
+        events.info(f"📋 Detected attribute name: **{attribute_name}**")
+        
+        # Remove the attribute name row and reset
+        df = df.iloc[1:].reset_index(drop=True)
+        
+        # Re-clean column names after removing first row
+        df.columns = df.columns.str.strip().str.upper()
+
+    # Alternative: Check if columns match the exact pattern from your images
+    if len(df.columns) >= 3 and len(df.columns) <= 5:
+        col_names = [c.upper() for c in df.columns if 'NAN' not in str(c).upper()]
+        if any('VALUE' in c for c in col_names) and 'VISITORS' in ' '.join(col_names) and 'PURCHASERS' in ' '.join(col_names):
+            return 'attribute_conversion'
+    
+    # Standardize column names
+    column_mapping = {}
+    for col in df.columns:
+        col_upper = col.upper()
+        if col_upper in ['VALUE', 'VAL', 'ATTRIBUTE VALUE']:
+            column_mapping[col] = 'Value'
+        elif 'VISITOR' in col_upper:
+            column_mapping[col] = 'Visitors'
+        elif 'PURCHASER' in col_upper:
+            column_mapping[col] = 'Purchasers'
+        elif 'CONVERSION' in col_upper:
+            column_mapping[col] = 'Conversion %'
+    
+    df = df.rename(columns=column_mapping)
+    
+    # Ensure required columns exist
+    required = ['Value', 'Visitors', 'Purchasers']
+    missing = [col for col in required if col not in df.columns]
+    
+    if missing:
+        events.error(f"❌ Missing required columns: {', '.join(missing)}")
+        events.info("💡 Expected columns: Value, Visitors, Purchasers, Conversion %")
+        return None
+    
+    # Convert numeric columns
+    df['Visitors'] = pd.to_numeric(df['Visitors'], errors='coerce')
+    df['Purchasers'] = pd.to_numeric(df['Purchasers'], errors='coerce')
+    
+    # Handle Conversion %
+    if 'Conversion %' in df.columns:
+        if df['Conversion %'].dtype == 'object':
+            df['Conversion %'] = (df['Conversion %']
+                                  .str.replace('%', '', regex=False)
+                                  .str.replace(',', '', regex=False)
+                                  .astype(float))
+        else:
+            df['Conversion %'] = pd.to_numeric(df['Conversion %'], errors='coerce')
+    else:
+        # Calculate conversion if not present
+        df['Conversion %'] = (df['Purchasers'] / df['Visitors'] * 100).round(2)
+    
+    # Remove rows with missing data
+    df = df.dropna(subset=['Visitors', 'Purchasers'])
+    
+    # Remove summary rows (like "Blank/Unk", "Total", etc.)
+    df = df[~df['Value'].astype(str).str.contains('blank|unk|total|sum', case=False, na=False)]
+    
+    # Add the attribute name as a column (so we know what demographic this represents)
+    df[attribute_name] = df['Value']
+    
+    # Add required combo format columns
+    df['Rank'] = range(1, len(df) + 1)
+    df['Combo Size'] = 1  # Single attribute analysis
+    df['Min Visitors'] = 40
+    
+    # Sort by conversion rate
+    df = df.sort_values('Conversion %', ascending=False).reset_index(drop=True)
+    df['Rank'] = range(1, len(df) + 1)
+    
+    # Reorder columns to match combo format
+    cols = ['Rank', 'Combo Size', 'Visitors', 'Purchasers', 'Conversion %', 'Min Visitors', attribute_name]
+    df = df[cols]
+    
+    events.success(f"✅ Transformed {len(df)} attribute values into combo format!")
+    
+    events.detail("✅ Preview of transformed data", df.head(10))
+    
+    return df
+def transform_excel_multi_header_to_combo(df):
+    """
+    Transforms Excel-style multi-header CSV to combo format
+    
+    Handles:
+    - Metadata rows before headers (like "Min Visitors: 400")
+    - Empty spacer rows
+    - Actual data headers buried in row 3-5
+    - Merged cell artifacts
+    """
+    events.info("🔄 Detected Excel export format with multi-row headers - restructuring...")
+    
+    # ========== STEP 1: Find the actual header row ==========
+    is_excel_style, header_row_idx, metadata = detect_excel_style_headers(df)
+    
+    if not is_excel_style or header_row_idx is None:
+        events.error("❌ Could not locate header row in Excel format")
+        return None
+    
+    events.info(f"📋 Found column headers at row {header_row_idx + 1}")
+    
+    # ========== STEP 2: Extract metadata from top rows ==========
+    if metadata.get('min_visitors'):
+        events.success(f"✅ Extracted metadata: Min Visitors = {metadata['min_visitors']}")
+    
+    # Show what we're skipping
+    events.detail("🔍 Rows being skipped (metadata/empty rows)", df.iloc[:header_row_idx])
+    
+    # ========== STEP 3: Rebuild dataframe with correct headers ==========
+    # Use the detected row as column names
+    new_columns = df.iloc[header_row_idx].tolist()
+    
+    # Clean column names
+    new_columns = [str(col).strip() for col in new_columns]
+    
+    # Get data starting from row AFTER the headers
+    new_df = df.iloc[header_row_idx + 1:].copy()
+    new_df.columns = new_columns
+    
+    # Reset index
+    new_df = new_df.reset_index(drop=True)
+    
+    # ========== STEP 4: Remove any remaining empty rows ==========
+    new_df = new_df.dropna(how='all')
+    
+    # ========== STEP 5: Clean column names (remove special characters) ==========
+    new_df.columns = (new_df.columns
+                      .str.strip()
+                      .str.replace('\n', ' ', regex=False)
+                      .str.replace('\r', ' ', regex=False)
+                      .str.replace('  ', ' ', regex=True))
+    
+    # Show cleaned structure
+    events.detail("✅ Cleaned column structure",
+                  "**New Column Names:**", Code(', '.join(new_df.columns.tolist())),
+                  "**First 5 rows of cleaned data:**", new_df.head(), expanded=True)
+    
+    # ========== STEP 6: Validate it's actually combo format now ==========
+    required_cols = ['Rank', 'Combo Size', 'Visitors', 'Purchasers']
+    missing = [col for col in required_cols if col not in new_df.columns]
+    
+    if missing:
+        events.info(f"Available columns: {', '.join(df.columns.tolist())}")
+        events.detail("Raw File Preview (first 10 lines)", df.head(10))
+        return None
+    
+    # ========== STEP 7: Convert numeric columns ==========
+    numeric_cols = ['Rank', 'Combo Size', 'Visitors', 'Purchasers', 'Conversion %', 'Min Visitors']
+    
+    for col in numeric_cols:
+        if col in new_df.columns:
+            if new_df[col].dtype == 'object':
+                # Clean percentage signs, dollar signs, commas
+                new_df[col] = (new_df[col].astype(str)
+                              .str.replace('%', '', regex=False)
+                              .str.replace('$', '', regex=False)
+                              .str.replace(',', '', regex=False)
+                              .str.strip())
+            
+            # Convert to numeric
+            new_df[col] = pd.to_numeric(new_df[col], errors='coerce')
+    
+    # ========== STEP 8: Add Min Visitors from metadata if missing ==========
+    if 'Min Visitors' not in new_df.columns or new_df['Min Visitors'].isna().all():
+        if metadata.get('min_visitors'):
+            new_df['Min Visitors'] = metadata['min_visitors']
+            events.info(f"✅ Added Min Visitors column from metadata: {metadata['min_visitors']}")
+        else:
+            new_df['Min Visitors'] = 40  # Default
+    
+    # ========== STEP 9: Calculate Conversion % if missing ==========
+    if 'Conversion %' not in new_df.columns or new_df['Conversion %'].isna().all():
+        if 'Visitors' in new_df.columns and 'Purchasers' in new_df.columns:
+            new_df['Conversion %'] = (new_df['Purchasers'] / new_df['Visitors'] * 100).round(2)
+            events.info("📊 Calculated Conversion % from Visitors and Purchasers")
+    
+    # ========== STEP 10: Remove rows with missing critical data ==========
+    rows_before = len(new_df)
+    new_df = new_df.dropna(subset=['Rank', 'Purchasers'])
+    rows_after = len(new_df)
+    
+    if rows_before - rows_after > 0:
+        events.info(f"🗑️ Removed {rows_before - rows_after} rows with invalid data")
+    
+    # ========== STEP 11: Ensure Rank is properly sorted ==========
+    new_df = new_df.sort_values('Rank').reset_index(drop=True)
+    
+    # ========== STEP 12: Final validation ==========
+    if len(new_df) == 0:
+        events.error("❌ No valid data rows after cleaning")
+        return None
+    
+    events.success(f"✅ Successfully transformed Excel format into {len(new_df)} combo rows!")
+    
+    # Show final preview
+    events.detail("✅ Final transformed data preview", new_df.head(10))
+    
+    return new_df
+def transform_multi_table_attributes_to_combo(df, multi_table=None):
+    """
+    FIXED VERSION: Transforms multi-table attribute format to combo format
+    
+    Handles the structure from your images:
+    - Row with attribute name (e.g., "Income Range")
+    - Row with headers: "Attribute Value | Visitors (T) | Purchasers | Conversion Rate | Visitors (M) | ..."
+    - Data rows
+    - Blank row or separator
+    - Next attribute section
+
+    multi_table: result of detect_multi_table_attribute_format(df), reused
+    (with its precomputed table boundaries) instead of scanning again
+    """
+    events.info("🔄 Detected multi-table attribute format - parsing all tables...")
+    
+    if multi_table is None:
+        multi_table = detect_multi_table_attribute_format(df)
+    is_multi, table_starts, metadata = multi_table
+    
+    if not is_multi or len(table_starts) == 0:
+        events.error("❌ Could not detect multiple attribute tables")
+        return None
+    
+    events.info(f"📊 Found {len(table_starts)} attribute tables to parse")
+    
+    # Show detected tables
+    events.detail("🔍 Detected Attribute Tables",
+                  *[f"{i}. **{table_info['attribute_name']}** (header at row {table_info['header_row'] + 1})"
+                    for i, table_info in enumerate(table_starts, 1)])
+    
+    # ===== PARSE EACH TABLE =====
+    all_tables = {}
+    
+    for i, table_info in enumerate(table_starts):
+        attr_name = table_info['attribute_name']
+        header_row_idx = table_info['header_row']
+        data_start_idx = table_info['data_start']
+        
+        # Table ends at the first empty row or new attribute name (found by the detector)
+        data_end_idx = table_info['data_end']
+        
+        # ===== EXTRACT TABLE DATA =====
+        try:
+            # Get header row
+            header_row = df.iloc[header_row_idx]
+            header_names = [str(col).strip() for col in header_row.tolist()]
+            
+            # Get data rows
+            table_data = df.iloc[data_start_idx:data_end_idx].copy()
+            
+            # Apply headers
+            table_data.columns = header_names
+            
+            # Reset index
+            table_data = table_data.reset_index(drop=True)
+            
+            # ===== CLEAN UP COLUMNS =====
+            # Standardize column names with fuzzy matching
+            column_mapping = {}
+            
+            for col in table_data.columns:
+                col_upper = col.upper().strip()
+                
+                # Match "Attribute Value" or "Value"
+                if 'VALUE' in col_upper or 'ATTRIBUTE' in col_upper:
+                    if 'Value' not in column_mapping.values():
+                        column_mapping[col] = 'Value'
+                
+                # Match visitor columns - handle (T), (M), (F) suffixes
+                elif 'VISITOR' in col_upper:
+                    # For now, prefer the first visitors column
+                    if 'Visitors' not in column_mapping.values():
+                        column_mapping[col] = 'Visitors'
+                
+                # Match purchaser columns
+                elif 'PURCHASER' in col_upper:
+                    if 'Purchasers' not in column_mapping.values():
+                        column_mapping[col] = 'Purchasers'
+                
+                # Match conversion columns
+                elif 'CONVERSION' in col_upper:
+                    if 'Conversion %' not in column_mapping.values():
+                        column_mapping[col] = 'Conversion %'
+            
+            table_data = table_data.rename(columns=column_mapping)
+            
+            events.info(f"📋 {attr_name} columns: {list(table_data.columns)[:5]}...")
+            
+            # ===== ENSURE REQUIRED COLUMNS EXIST =====
+            required = ['Value', 'Visitors', 'Purchasers']
+            
+            # Check if we have them
+            missing = [col for col in required if col not in table_data.columns]
+            
+            if missing:
+                # Try to find alternatives
+                events.warning(f"⚠️ {attr_name}: Missing columns {missing}")
+                
+                # Try to find any numeric columns to use as substitute
+                numeric_cols = table_data.select_dtypes(include=[np.number]).columns.tolist()
+                
+                if len(numeric_cols) < 2:
+                    events.warning(f"❌ {attr_name}: Not enough numeric columns, skipping table")
+                    continue
+            
+            # ===== CONVERT NUMERIC COLUMNS =====
+            for col in ['Visitors', 'Purchasers', 'Conversion %']:
+                if col in table_data.columns:
+                    # More robust conversion
+                    if table_data[col].dtype == 'object':
+                        table_data[col] = (table_data[col].astype(str)
+                                          .str.replace('%', '', regex=False)
+                                          .str.replace(',', '', regex=False)
+                                          .str.strip())
+                    
+                    # Use pandas to_numeric with coercion
+                    table_data[col] = pd.to_numeric(table_data[col], errors='coerce')
+            
+            # ===== REMOVE INVALID ROWS =====
+            # Remove rows with NaN in critical columns
+            before_count = len(table_data)
+            table_data = table_data.dropna(subset=['Value'])
+            
+            if 'Visitors' in table_data.columns and 'Purchasers' in table_data.columns:
+                table_data = table_data.dropna(subset=['Visitors', 'Purchasers'])
+            
+            after_count = len(table_data)
+            
+            if before_count - after_count > 0:
+                events.info(f"🗑️ {attr_name}: Removed {before_count - after_count} invalid rows")
+            
+            # ===== REMOVE SUMMARY ROWS =====
+            summary_keywords = ['blank', 'unk', 'unknown', 'total', 'sum', 'average', 'all']
+            
+            if 'Value' in table_data.columns:
+                initial_len = len(table_data)
+                table_data = table_data[
+                    ~table_data['Value'].astype(str).str.lower().str.contains(
+                        '|'.join(summary_keywords), 
+                        na=False, 
+                        regex=True
+                    )
+                ]
+                if len(table_data) < initial_len:
+                    events.info(f"🗑️ {attr_name}: Removed {initial_len - len(table_data)} summary rows")
+            
+            if len(table_data) == 0:
+                events.warning(f"⚠️ {attr_name}: No valid data rows after cleaning, skipping")
+                continue
+            
+            # ===== RENAME VALUE COLUMN TO ATTRIBUTE NAME =====
+            if 'Value' in table_data.columns:
+                table_data = table_data.rename(columns={'Value': attr_name})
+            
+            # Store the cleaned table
+            all_tables[attr_name] = table_data
+            
+            events.success(f"✅ Parsed {attr_name}: {len(table_data)} values")
+            
+        except Exception as e:
+            events.error(f"❌ Error parsing {attr_name}: {e}")
+            import traceback
+            events.detail(f"🐛 Error details for {attr_name}", Code(traceback.format_exc()))
+            continue
+    
+    if len(all_tables) == 0:
+        events.error("❌ No tables could be parsed successfully")
+        return None
+    
+    # ===== COMBINE ALL TABLES INTO WIDE FORMAT =====
+    events.info("🔄 Creating combined wide-format table...")
+    
+    final_rows = []
+    
+    for attr_name, table_df in all_tables.items():
+        for _, row in table_df.iterrows():
+            final_row = {
+                'Visitors': row.get('Visitors', 0),
+                'Purchasers': row.get('Purchasers', 0),
+                'Conversion %': row.get('Conversion %', 0.0),
+                attr_name: row.get(attr_name, '')
+            }
+            final_rows.append(final_row)
+    
+    # Create DataFrame from all rows
+    final_df = pd.DataFrame(final_rows)
+    
+    # Fill NaN values
+    for attr_name in all_tables.keys():
+        if attr_name not in final_df.columns:
+            final_df[attr_name] = ''
+        else:
+            final_df[attr_name] = final_df[attr_name].fillna('').astype(str)
+    
+    # ===== ADD REQUIRED COLUMNS =====
+    final_df['Combo Size'] = 1
+    final_df['Min Visitors'] = 40
+    
+    # Sort by conversion rate
+    final_df = final_df.sort_values('Conversion %', ascending=False).reset_index(drop=True)
+    final_df['Rank'] = range(1, len(final_df) + 1)
+    
+    # ===== REORDER COLUMNS =====
+    attribute_columns = list(all_tables.keys())
+    base_columns = ['Rank', 'Combo Size', 'Visitors', 'Purchasers', 'Conversion %', 'Min Visitors']
+    final_columns = base_columns + attribute_columns
+    
+    final_df = final_df[final_columns]
+    
+    events.success(f"✅ Created {len(final_df)} combo rows from {len(all_tables)} attribute tables!")
+    
+    events.detail("✅ Final combined table preview",
+                  f"**Total Rows:** {len(final_df)}",
+                  f"**Attribute Columns:** {', '.join(attribute_columns)}",
+                  final_df.head(20))
+    
+    return final_df
+def smart_load_csv(uploaded_file):
+    """
+    FIXED VERSION - Less verbose, cleaner output
+    """
+    try:
+        # Sniff encoding and header row from the start of the file, then parse once
+        # Very large files: read a sample first, row-level exports are then aggregated in chunks
+        with events.stage('read') as read_stage:
+            streaming = upload_size(uploaded_file) > STREAM_THRESHOLD_BYTES
+            df, encoding = read_csv_single_pass(uploaded_file, nrows=STREAM_SAMPLE_ROWS if streaming else None)
+            
+            if df is None:
+                events.error("❌ Could not read file with any encoding")
+                return None
+            
+            # Clean column names, empty rows/columns and duplicate names (silently)
+            df, renamed = clean_raw_frame(df)
+            read_stage.rows = len(df)
+        
+        # Detect format (SILENTLY - no events.info calls here)
+        with events.stage('detect') as detect_stage:
+            multi_table = detect_multi_table_attribute_format(df)
+            csv_format = detect_csv_format(df, uploaded_file, multi_table=multi_table)
+            detect_stage.note = csv_format
+        
+        if streaming and (csv_format not in STREAMING_FORMATS or renamed):
+            # This layout needs the whole file in memory
+            with events.stage('read') as read_stage:
+                df, encoding = read_csv_single_pass(uploaded_file)
+                df, renamed = clean_raw_frame(df)
+                read_stage.rows = len(df)
+            with events.stage('detect') as detect_stage:
+                multi_table = detect_multi_table_attribute_format(df)
+                csv_format = detect_csv_format(df, uploaded_file, multi_table=multi_table)
+                detect_stage.note = csv_format
+            streaming = False
+        
+        # Row-level transforms group the sample's columns over the whole file
+        stream = (uploaded_file, encoding) if streaming else None
+        
+        with events.stage('transform') as transform_stage:
+            combo_df = _transform_by_format(df, csv_format, multi_table, stream)
+            transform_stage.rows = len(combo_df) if combo_df is not None else None
+        
+        if combo_df is None:
+            return None
+        
+        # Categorical demographics + narrower metric dtypes for every format
+        with events.stage('normalize') as normalize_stage:
+            combo_df, memory_report = normalize_combo_dtypes(combo_df)
+            normalize_stage.rows = len(combo_df)
+            if memory_report['bytes_before'] > memory_report['bytes_after']:
+                saved = memory_report['bytes_before'] - memory_report['bytes_after']
+                events.info(f"🗜️ Memory: {memory_report['bytes_before'] / 1024**2:.1f} MB → "
+                            f"{memory_report['bytes_after'] / 1024**2:.1f} MB "
+                            f"({saved / memory_report['bytes_before']:.0%} saved, "
+                            f"{len(memory_report['categorical'])} categorical columns)")
+        
+        return combo_df
+            
+    except Exception as e:
+        events.error(f"❌ Error processing file: {e}")
+        import traceback
+        events.detail("🐛 Error Details", Code(traceback.format_exc()))
+        return None
+
+
+def _transform_by_format(df, csv_format, multi_table, stream):
+    """Runs the transform for csv_format; returns the combo frame or None."""
+    if csv_format == 'excel_multi_header':
+        combo_df = transform_excel_multi_header_to_combo(df)
+    elif csv_format == 'multi_table_attributes':
+        combo_df = transform_multi_table_attributes_to_combo(df, multi_table=multi_table)
+    elif csv_format == 'combo':
+        # Standardize columns
+        df.columns = df.columns.str.strip()
+        
+        for col in ['Rank', 'Combo Size', 'Visitors', 'Purchasers', 'Conversion %', 'Min Visitors']:
+            if col in df.columns:
+                if df[col].dtype == 'object':
+                    df[col] = (df[col].astype(str)
+                              .str.replace('%', '', regex=False)
+                              .str.replace(',', '', regex=False)
+                              .str.replace('$', '', regex=False)
+                              .str.strip())
+                df[col] = pd.to_numeric(df[col], errors='coerce')
+        
+        combo_df = df.dropna(subset=['Rank'])
+    elif csv_format == 'shopify':
+        combo_df = transform_shopify_to_combo(df, stream=stream)
+    elif csv_format == 'gender_analysis':
+        combo_df = transform_gender_analysis_to_combo(df)
+    elif csv_format == 'purchase_email':
+        combo_df = transform_purchase_email_to_combo(df, stream=stream)
+    elif csv_format == 'uuid_enriched':
+        combo_df = transform_uuid_to_combo(df, stream=stream)
+    elif csv_format == 'attribute_conversion':
+        combo_df = transform_attribute_conversion_to_combo(df)
+    else:
+        # Generic fallback
+        numeric_cols = df.select_dtypes(include=[np.number]).columns.tolist()
+        categorical_cols = [col for col in df.columns if col not in numeric_cols][:5]
+        
+        if not categorical_cols:
+            events.error("❌ Cannot process this file format")
+            events.info("💡 Please ensure your CSV has proper column headers")
+            return None
+        
+        grouped = df.groupby(categorical_cols, dropna=False).size().reset_index(name='Purchasers')
+        grouped['Visitors'] = (grouped['Purchasers'] / 0.05).astype(int)
+        grouped['Conversion %'] = (grouped['Purchasers'] / grouped['Visitors'] * 100).round(2)
+        grouped['Rank'] = range(1, len(grouped) + 1)
+        grouped['Combo Size'] = len(categorical_cols)
+        grouped['Min Visitors'] = 40
+        
+        combo_df = grouped
+    
+    return combo_df
+
+
+# ============================================
+# PARALLEL MULTI-FILE LOADING
+# ============================================
+
+# Upper bound on worker processes for one multi-file upload
+MAX_PARSE_WORKERS = 8
+
+METRIC_COLUMNS = ['Rank', 'Combo Size', 'Visitors', 'Purchasers', 'Conversion %', 'Min Visitors']
+
+
+def combo_attribute_columns(df):
+    """The attribute (non-metric) columns of a combo frame, in frame order."""
+    return [col for col in df.columns if col not in METRIC_COLUMNS]
+
+
+def parse_file_job(name, content):
+    """
+    Runs smart_load_csv on one file's bytes, collecting its events.
+
+    Returns (name, combo_df or None, seconds, error message or None, events).
+    """
+    return _parse_job(name, io.BytesIO(content))
+
+
+def parse_path_job(path):
+    """parse_file_job() for a file on disk; the worker opens and reads it itself."""
+    with open(path, 'rb') as f:
+        return _parse_job(path, f)
+
+
+def _parse_job(name, file_obj):
+    sink = CollectingSink()
+    start = time.perf_counter()
+    with use_sink(sink):
+        df = smart_load_csv(file_obj)
+    seconds = time.perf_counter() - start
+
+    error = None
+    if df is None:
+        error = sink.errors[-1] if sink.errors else "Could not process this file format"
+    return name, df, seconds, error, sink.events
+
+
+def parse_files_parallel(files, max_workers=None):
+    """
+    Parses several files at once, one process per file up to max_workers.
+
+    files: list of (name, bytes). Returns parse_file_job() results in the
+    same order.
+
+    Workers are forked: under `streamlit run` the __main__ module is the app
+    script itself, which spawned workers would re-execute. Where fork is not
+    available the files are parsed one after another in this process.
+    """
+    if not files:
+        return []
+
+    if 'fork' not in get_all_start_methods():
+        return [parse_file_job(name, content) for name, content in files]
+
+    max_workers = max_workers or min(len(files), os.cpu_count() or 1, MAX_PARSE_WORKERS)
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=get_context('fork')) as pool:
+        futures = [pool.submit(parse_file_job, name, content) for name, content in files]
+        return [future.result() for future in futures]
+
+
+def parse_paths_parallel(paths, max_workers=None):
+    """
+    Batch counterpart of parse_files_parallel() for files on disk: only the
+    paths are sent to the workers, which read the files themselves. Returns
+    parse_path_job() results in the same order; with a single worker the
+    files are parsed in this process.
+    """
+    if not paths:
+        return []
+
+    max_workers = max_workers or min(len(paths), os.cpu_count() or 1, MAX_PARSE_WORKERS)
+    if max_workers <= 1:
+        return [parse_path_job(path) for path in paths]
+
+    context = get_context('fork') if 'fork' in get_all_start_methods() else get_context()
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as pool:
+        return list(pool.map(parse_path_job, paths))
+
+
+def merge_combo_frames(frames):
+    """
+    Combines combo tables from several files into one.
+
+    Rows with the same attribute values (every non-metric column, missing
+    values included) are merged by summing Visitors and Purchasers; Conversion %
+    is recomputed from the sums and Rank reassigned by conversion, highest first.
+
+    Raises ValueError when the frames do not all have the same attribute
+    columns: their combos cannot be matched, and concatenating them would
+    fill the missing columns with NaN keys.
+    """
+    # Positions count from 1 over the frames as passed in, failed (None) ones included
+    layouts = {}
+    for position, frame in enumerate(frames, 1):
+        if frame is not None and len(frame) > 0:
+            layouts.setdefault(frozenset(combo_attribute_columns(frame)), []).append(position)
+
+    frames = [frame for frame in frames if frame is not None and len(frame) > 0]
+    if not frames:
+        return None
+    if len(layouts) > 1:
+        raise ValueError("The files have different attribute columns and cannot be merged: " + "; ".join(
+            f"file{'s' if len(positions) > 1 else ''} {', '.join(map(str, positions))}: "
+            f"{', '.join(sorted(columns)) or 'none'}" for columns, positions in layouts.items()))
+
+    # Categoricals with different categories per file would not concatenate cleanly
+    frames = [frame.astype({col: object for col in frame.columns if isinstance(frame[col].dtype, pd.CategoricalDtype)})
+              for frame in frames]
+    combined = pd.concat(frames, ignore_index=True)
+
+    attribute_cols = combo_attribute_columns(combined)
+    for col in ['Visitors', 'Purchasers']:
+        combined[col] = pd.to_numeric(combined[col], errors='coerce').fillna(0)
+
+    agg_dict = {'Visitors': 'sum', 'Purchasers': 'sum'}
+    for col in ['Combo Size', 'Min Visitors']:
+        if col in combined.columns:
+            agg_dict[col] = 'max'
+
+    if attribute_cols:
+        merged = combined.groupby(attribute_cols, dropna=False, sort=False).agg(agg_dict).reset_index()
+    else:
+        merged = combined[list(agg_dict)].copy()
+
+    merged['Conversion %'] = np.where(merged['Visitors'] > 0,
+                                      (merged['Purchasers'] / merged['Visitors'] * 100).round(2), 0.0)
+    merged = merged.sort_values(['Conversion %', 'Purchasers'], ascending=False, kind='stable').reset_index(drop=True)
+    merged['Rank'] = range(1, len(merged) + 1)
+
+    cols = [col for col in METRIC_COLUMNS if col in merged.columns] + attribute_cols
+    merged, _ = normalize_combo_dtypes(merged[cols])
+    return merged
+
+
+# ============================================
+# INCREMENTAL APPENDS
+# ============================================
+
+# Formats whose combos are plain counts of raw rows, so a new export's combos can be added to the old ones
+APPEND_FORMATS = ('shopify', 'purchase_email')
+
+
+def _attribute_keys(df, attribute_cols):
+    """One 64-bit hash per row of the attribute values, compared as strings (so 25 matches '25')."""
+    columns = {}
+    for col in attribute_cols:
+        column = df[col]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            # Only the categories need converting; codes are reused
+            columns[col] = column.cat.rename_categories(column.cat.categories.astype(str))
+        else:
+            columns[col] = column.astype(str).where(column.notna())
+    return pd.util.hash_pandas_object(pd.DataFrame(columns), index=False).to_numpy()
+
+
+class ComboKeyIndex:
+    """
+    Attribute key -> row position for one combo table, so an append only
+    hashes the new file's combos.
+
+    Keys map to stable ids: the original table's keys through a pd.Index
+    (position = id), keys added by appends through a dict. Both are shared,
+    append-only, by every table derived from the same original; ids below
+    `count` belong to this table and `row_of` gives each id's row. extended()
+    derives the index of an appended table in O(delta) dict work plus one
+    vectorized remap of row_of.
+    """
+
+    # Shared dicts are extended by dashboard sessions on different threads
+    _extend_lock = threading.Lock()
+
+    def __init__(self, columns, base, added, count, row_of):
+        self.columns = tuple(columns)
+        self._base = base
+        self._added = added
+        self.count = count
+        self.row_of = row_of
+
+    @classmethod
+    def build(cls, df, attribute_cols=None):
+        """Index of df, keyed on attribute_cols (default: every attribute column); None if keys repeat."""
+        attribute_cols = combo_attribute_columns(df) if attribute_cols is None else list(attribute_cols)
+        base = pd.Index(_attribute_keys(df, attribute_cols))
+        if not base.is_unique:
+            return None
+        return cls(attribute_cols, base, {}, len(base), np.arange(len(base)))
+
+    def lookup(self, keys):
+        """Row positions of keys (-1 where absent)."""
+        ids = self._base.get_indexer(keys)
+        missing = np.flatnonzero(ids < 0)
+        if len(missing) and self._added:
+            ids[missing] = [self._added.get(key, -1) for key in keys[missing].tolist()]
+        ids[ids >= self.count] = -1  # added by another table derived from the same original
+        positions = np.full(len(keys), -1, dtype=np.int64)
+        positions[ids >= 0] = self.row_of[ids[ids >= 0]]
+        return positions
+
+    def extended(self, new_keys, row_at_rank):
+        """
+        Index of the table built by appending new_keys as rows n, n + 1, ...
+        and then taking rows in row_at_rank order.
+        """
+        with self._extend_lock:
+            added = self._added
+            if len(self._base) + len(added) != self.count:
+                # Another table already extended the shared dict: branch off a private copy
+                added = {key: i for key, i in added.items() if i < self.count}
+            added.update(zip(new_keys.tolist(), range(self.count, self.count + len(new_keys))))
+
+        new_row = np.empty(len(row_at_rank), dtype=np.int64)
+        new_row[row_at_rank] = np.arange(len(row_at_rank))
+        n = len(self.row_of)
+        row_of = new_row[np.concatenate([self.row_of, n + np.arange(len(new_keys))])]
+        return ComboKeyIndex(self.columns, self._base, added, self.count + len(new_keys), row_of)
+
+
+def _metric_values(df, col):
+    values = pd.to_numeric(df[col], errors='coerce').fillna(0).to_numpy()
+    return values.astype(np.int64) if np.array_equal(values, np.floor(values)) else values.astype(float)
+
+
+def append_combo_frame(existing, delta, key_index=None):
+    """
+    Merges the combos of a new export (delta) into an existing combo table,
+    touching only the combos the export has:
+
+    - combos already in the table get the delta's Visitors and Purchasers
+      added and their Conversion % recomputed
+    - new combos are added
+    - Rank is repaired around the moved combos: every other combo keeps its
+      relative order and only shifts by the number of moved combos now ranked
+      above it (ties keep existing combos first)
+
+    key_index is existing's ComboKeyIndex, if the caller keeps one; without it
+    every existing combo is hashed.
+
+    The existing frame is not modified. Returns (merged, updated, added,
+    merged_key_index). Raises ValueError when the two tables have different
+    attribute columns. If the existing table is not a clean ranking (rows in
+    Rank order 1..n, Conversion % non-increasing, unique combos) it is merged
+    in full with merge_combo_frames() instead, and merged_key_index is None.
+    """
+    attribute_cols = combo_attribute_columns(existing)
+    delta_cols = combo_attribute_columns(delta)
+    if not attribute_cols or set(attribute_cols) != set(delta_cols):
+        raise ValueError(f"The new file's attributes ({', '.join(delta_cols) or 'none'}) do not match the "
+                         f"current dataset's ({', '.join(attribute_cols) or 'none'})")
+
+    agg_dict = {'Visitors': 'sum', 'Purchasers': 'sum'}
+    for col in ['Combo Size', 'Min Visitors']:
+        if col in existing.columns and col in delta.columns:
+            agg_dict[col] = 'max'
+    delta = delta.groupby(attribute_cols, dropna=False, sort=False, observed=True).agg(agg_dict).reset_index()
+    if key_index is None or key_index.columns != tuple(attribute_cols) or key_index.count != len(existing):
+        key_index = ComboKeyIndex.build(existing, attribute_cols)
+    delta_keys = _attribute_keys(delta, attribute_cols)
+    positions = key_index.lookup(delta_keys) if key_index is not None else None
+
+    n = len(existing)
+    ranks = pd.to_numeric(existing['Rank'], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+    conversion = pd.to_numeric(existing['Conversion %'], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+    if (positions is None or not np.array_equal(ranks, np.arange(1, n + 1))
+            or np.isnan(conversion).any() or (np.diff(conversion) > 0).any()):
+        merged = merge_combo_frames([existing, delta])
+        return merged, int((positions >= 0).sum()) if positions is not None else 0, len(merged) - n, None
+
+    hit = positions >= 0
+    updated_rows = positions[hit]
+    new_rows = delta.loc[~hit].reset_index(drop=True)
+
+    # Updated and new combos, with their totals
+    visitors = _metric_values(existing, 'Visitors')
+    purchasers = _metric_values(existing, 'Purchasers')
+    delta_visitors = _metric_values(delta, 'Visitors')
+    delta_purchasers = _metric_values(delta, 'Purchasers')
+    moved_visitors = np.concatenate([visitors[updated_rows] + delta_visitors[hit], delta_visitors[~hit]])
+    moved_purchasers = np.concatenate([purchasers[updated_rows] + delta_purchasers[hit], delta_purchasers[~hit]])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        moved_conversion = np.where(moved_visitors > 0, np.round(moved_purchasers / moved_visitors * 100, 2), 0.0)
+
+    # Combos that did not move keep their order; each moved combo slots in after the last
+    # unmoved combo with at least its conversion
+    unmoved = np.ones(n, dtype=bool)
+    unmoved[updated_rows] = False
+    unmoved_rows = np.flatnonzero(unmoved)
+    moved_order = np.argsort(-moved_conversion, kind='stable')
+    slots = np.searchsorted(-conversion[unmoved_rows], -moved_conversion[moved_order], side='right')
+
+    total = n + len(new_rows)
+    moved_ranks = np.empty(len(moved_order), dtype=np.int64)
+    moved_ranks[moved_order] = slots + np.arange(len(moved_order)) + 1
+    # Unmoved combos ranked above every slot are untouched
+    unmoved_ranks = np.arange(1, len(unmoved_rows) + 1)
+    first = slots[0] if len(slots) else len(unmoved_rows)
+    unmoved_ranks[first:] += np.searchsorted(slots, np.arange(first, len(unmoved_rows)), side='right')
+
+    # Rows of the result, in rank order: positions in existing, or n + i for new combo i
+    row_at_rank = np.empty(total, dtype=np.int64)
+    row_at_rank[unmoved_ranks - 1] = unmoved_rows
+    row_at_rank[moved_ranks - 1] = np.concatenate([updated_rows, n + np.arange(len(new_rows))])
+
+    # Build each column in the new row order; categoricals via their codes, so the
+    # existing categories are never re-hashed
+    def reorder(existing_values, new_values):
+        values = np.concatenate([existing_values, new_values]) if len(new_values) else existing_values
+        return values[row_at_rank]
+
+    def typed(col, values):
+        dtype = existing[col].dtype
+        if not pd.api.types.is_numeric_dtype(dtype):
+            return values
+        if pd.api.types.is_integer_dtype(dtype):
+            if values.dtype.kind not in 'iu':
+                return values  # e.g. missing values among the new rows
+            if values.max(initial=0) > np.iinfo(dtype).max:
+                dtype = np.int64
+        return values.astype(dtype)
+
+    columns = {}
+    for col in attribute_cols:
+        column = existing[col]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            additions = new_rows[col].astype(object)
+            extra = pd.Index(additions.dropna().unique()).difference(column.cat.categories)
+            dtype = pd.CategoricalDtype(column.cat.categories.append(extra)) if len(extra) else column.dtype
+            codes = reorder(column.cat.codes.to_numpy(), dtype.categories.get_indexer(additions))
+            columns[col] = pd.Categorical.from_codes(codes, dtype=dtype)
+        else:
+            columns[col] = typed(col, reorder(column.to_numpy(), new_rows[col].to_numpy()))
+    for col in ['Combo Size', 'Min Visitors']:
+        if col in existing.columns:
+            additions = new_rows[col].to_numpy() if col in new_rows.columns else np.zeros(len(new_rows))
+            columns[col] = typed(col, reorder(existing[col].to_numpy(), additions))
+
+    updated = len(updated_rows)
+    for col, values, moved in [('Visitors', visitors, moved_visitors), ('Purchasers', purchasers, moved_purchasers),
+                               ('Conversion %', conversion, moved_conversion)]:
+        values = values.astype(np.result_type(values, moved))
+        values[updated_rows] = moved[:updated]
+        columns[col] = typed(col, reorder(values, moved[updated:]))
+    columns['Rank'] = np.arange(1, total + 1).astype(existing['Rank'].dtype)
+
+    merged = pd.DataFrame({col: columns[col] for col in existing.columns})
+    return merged, int(hit.sum()), len(new_rows), key_index.extended(delta_keys[~hit], row_at_rank)